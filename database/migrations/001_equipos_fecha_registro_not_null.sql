@@ -0,0 +1,21 @@
+-- Migración para bases de datos creadas antes de la paginación por cursor.
+-- schema.sql solo se ejecuta sobre un volumen nuevo; sobre uno existente
+-- aplicar con:
+--   docker-compose exec -T postgres psql -U postgres -d ti_management < database/migrations/001_equipos_fecha_registro_not_null.sql
+-- Es idempotente.
+
+BEGIN;
+
+-- Rellenar los registros sin fecha antes de imponer NOT NULL; se usa la
+-- última actualización como mejor aproximación disponible
+UPDATE equipos
+SET fecha_registro = COALESCE(fecha_ultima_actualizacion, CURRENT_TIMESTAMP)
+WHERE fecha_registro IS NULL;
+
+ALTER TABLE equipos ALTER COLUMN fecha_registro SET DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE equipos ALTER COLUMN fecha_registro SET NOT NULL;
+
+-- Paginación por cursor del listado (ORDER BY fecha_registro DESC, id DESC)
+CREATE INDEX IF NOT EXISTS idx_equipos_registro_id ON equipos(fecha_registro DESC, id DESC);
+
+COMMIT;
@@ -0,0 +1,31 @@
+-- Migración para bases de datos creadas antes de guardar los trabajos de
+-- exportación en la base de datos (compartidos entre réplicas de reportes).
+-- Aplicar con:
+--   docker-compose exec -T postgres psql -U postgres -d ti_management < database/migrations/002_export_jobs.sql
+-- Es idempotente.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS export_jobs (
+    job_id VARCHAR(32) PRIMARY KEY,
+    tipo VARCHAR(50) NOT NULL,
+    formato VARCHAR(10) NOT NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendiente' CHECK (estado IN ('pendiente', 'en_proceso', 'completado', 'error')),
+    progreso INTEGER NOT NULL DEFAULT 0,
+    replica VARCHAR(255),
+    archivo VARCHAR(500),
+    tamano_bytes BIGINT,
+    error TEXT,
+    fecha_creacion TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    fecha_inicio TIMESTAMP,
+    fecha_fin TIMESTAMP,
+    expira TIMESTAMP
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_export_jobs_activo ON export_jobs(formato, tipo) WHERE estado IN ('pendiente', 'en_proceso');
+CREATE INDEX IF NOT EXISTS idx_export_jobs_estado ON export_jobs(estado, fecha_creacion);
+CREATE INDEX IF NOT EXISTS idx_export_jobs_expira ON export_jobs(expira);
+
+COMMENT ON TABLE export_jobs IS 'Trabajos de exportación asíncrona de reportes';
+
+COMMIT;
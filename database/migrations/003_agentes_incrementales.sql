@@ -0,0 +1,75 @@
+-- Migración para bases de datos creadas antes de los agentes incrementales
+-- de obsolescencia y garantías (fecha de fin de vida útil precalculada y
+-- watermarks). Aplicar con:
+--   docker-compose exec -T postgres psql -U postgres -d ti_management < database/migrations/003_agentes_incrementales.sql
+-- Es idempotente.
+
+BEGIN;
+
+-- fecha_compra + vida útil de la categoría; mantenida por trigger
+ALTER TABLE equipos ADD COLUMN IF NOT EXISTS fecha_fin_vida_util DATE;
+
+-- Relleno de los equipos existentes. Se desactiva el trigger de
+-- fecha_ultima_actualizacion: el relleno no es un cambio del equipo y los
+-- agentes incrementales lo tomarían por uno
+ALTER TABLE equipos DISABLE TRIGGER trigger_update_equipos_timestamp;
+
+UPDATE equipos e
+SET fecha_fin_vida_util = (e.fecha_compra + make_interval(years => c.vida_util_anos))::date
+FROM categorias_equipos c
+WHERE c.id = e.categoria_id
+  AND e.fecha_fin_vida_util IS DISTINCT FROM (e.fecha_compra + make_interval(years => c.vida_util_anos))::date;
+
+ALTER TABLE equipos ENABLE TRIGGER trigger_update_equipos_timestamp;
+
+-- Umbrales y marcas de cambio usados por los agentes incrementales
+CREATE INDEX IF NOT EXISTS idx_equipos_fin_vida_util ON equipos(fecha_fin_vida_util);
+CREATE INDEX IF NOT EXISTS idx_equipos_garantia_fin ON equipos(fecha_garantia_fin);
+CREATE INDEX IF NOT EXISTS idx_equipos_ultima_actualizacion ON equipos(fecha_ultima_actualizacion);
+
+-- Última ejecución de cada agente incremental
+CREATE TABLE IF NOT EXISTS agentes_watermarks (
+    agente VARCHAR(100) PRIMARY KEY,
+    ultima_ejecucion TIMESTAMP NOT NULL,
+    ultima_fecha DATE NOT NULL
+);
+
+COMMENT ON TABLE agentes_watermarks IS 'Marcas de la última ejecución de los agentes incrementales';
+
+-- Trigger para precalcular la fecha de fin de vida útil de cada equipo
+CREATE OR REPLACE FUNCTION set_equipos_fin_vida_util()
+RETURNS TRIGGER AS $$
+BEGIN
+    SELECT (NEW.fecha_compra + make_interval(years => c.vida_util_anos))::date
+    INTO NEW.fecha_fin_vida_util
+    FROM categorias_equipos c
+    WHERE c.id = NEW.categoria_id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_set_equipos_fin_vida_util ON equipos;
+CREATE TRIGGER trigger_set_equipos_fin_vida_util
+    BEFORE INSERT OR UPDATE OF fecha_compra, categoria_id ON equipos
+    FOR EACH ROW
+    EXECUTE FUNCTION set_equipos_fin_vida_util();
+
+-- Trigger para recalcular la vida útil de los equipos al cambiar la categoría
+CREATE OR REPLACE FUNCTION update_categoria_fin_vida_util()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE equipos
+    SET fecha_fin_vida_util = (fecha_compra + make_interval(years => NEW.vida_util_anos))::date
+    WHERE categoria_id = NEW.id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_update_categoria_fin_vida_util ON categorias_equipos;
+CREATE TRIGGER trigger_update_categoria_fin_vida_util
+    AFTER UPDATE OF vida_util_anos ON categorias_equipos
+    FOR EACH ROW
+    WHEN (OLD.vida_util_anos IS DISTINCT FROM NEW.vida_util_anos)
+    EXECUTE FUNCTION update_categoria_fin_vida_util();
+
+COMMIT;
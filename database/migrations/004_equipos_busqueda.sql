@@ -0,0 +1,26 @@
+-- Migración para bases de datos creadas antes de la búsqueda de equipos
+-- (GET /equipos/search): texto completo y trigramas. Aplicar con:
+--   docker-compose exec -T postgres psql -U postgres -d ti_management < database/migrations/004_equipos_busqueda.sql
+-- Es idempotente. Añadir la columna generada reescribe la tabla equipos.
+
+BEGIN;
+
+-- Búsqueda aproximada por trigramas (tolerante a errores de escritura)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Documento de búsqueda de texto completo (códigos sin stemming)
+ALTER TABLE equipos ADD COLUMN IF NOT EXISTS busqueda TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', coalesce(codigo_inventario, '') || ' ' || coalesce(numero_serie, '')), 'A') ||
+    setweight(to_tsvector('spanish', coalesce(nombre, '')), 'A') ||
+    setweight(to_tsvector('spanish', coalesce(marca, '') || ' ' || coalesce(modelo, '')), 'B')
+) STORED;
+
+-- Búsqueda: texto completo y trigramas por campo
+CREATE INDEX IF NOT EXISTS idx_equipos_busqueda ON equipos USING GIN (busqueda);
+CREATE INDEX IF NOT EXISTS idx_equipos_nombre_trgm ON equipos USING GIN (nombre gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_equipos_marca_trgm ON equipos USING GIN (marca gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_equipos_modelo_trgm ON equipos USING GIN (modelo gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_equipos_serie_trgm ON equipos USING GIN (numero_serie gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_equipos_codigo_trgm ON equipos USING GIN (codigo_inventario gin_trgm_ops);
+
+COMMIT;
@@ -0,0 +1,102 @@
+-- Migración para bases de datos creadas antes de servir los agregados de
+-- reportes desde vistas materializadas. Aplicar con:
+--   docker-compose exec -T postgres psql -U postgres -d ti_management < database/migrations/005_vistas_reportes.sql
+-- Es idempotente. Las vistas se crean con datos; después las refresca el
+-- agente refresh_reportes.
+
+BEGIN;
+
+-- REFRESH MATERIALIZED VIEW CONCURRENTLY requiere un índice único en cada vista.
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_equipos_por_ubicacion AS
+SELECT u.id as ubicacion_id,
+       u.edificio || ' - ' || u.aula_oficina as ubicacion,
+       COUNT(*) as cantidad
+FROM equipos e
+JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
+GROUP BY u.id, u.edificio, u.aula_oficina;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_equipos_por_ubicacion ON mv_equipos_por_ubicacion(ubicacion_id);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_equipos_por_estado AS
+SELECT estado_operativo as estado, COUNT(*) as cantidad
+FROM equipos
+GROUP BY estado_operativo;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_equipos_por_estado ON mv_equipos_por_estado(estado);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_equipos_por_categoria AS
+SELECT c.nombre as categoria, COUNT(*) as cantidad,
+       COALESCE(SUM(e.costo_compra), 0) as valor_total
+FROM equipos e
+JOIN categorias_equipos c ON e.categoria_id = c.id
+GROUP BY c.nombre;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_equipos_por_categoria ON mv_equipos_por_categoria(categoria);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_equipos_antiguedad AS
+SELECT rango_antiguedad,
+       CASE rango_antiguedad
+           WHEN 'Menos de 1 año' THEN 1
+           WHEN '1-2 años' THEN 2
+           WHEN '3-4 años' THEN 3
+           WHEN '5-6 años' THEN 4
+           ELSE 5
+       END as orden,
+       COUNT(*) as cantidad
+FROM (
+    SELECT CASE
+               WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) < 1 THEN 'Menos de 1 año'
+               WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) BETWEEN 1 AND 2 THEN '1-2 años'
+               WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) BETWEEN 3 AND 4 THEN '3-4 años'
+               WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) BETWEEN 5 AND 6 THEN '5-6 años'
+               ELSE 'Más de 6 años'
+           END as rango_antiguedad
+    FROM equipos
+    WHERE fecha_compra IS NOT NULL
+) rangos
+GROUP BY rango_antiguedad;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_equipos_antiguedad ON mv_equipos_antiguedad(rango_antiguedad);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_costos_mantenimiento AS
+SELECT EXTRACT(YEAR FROM fecha_realizada)::int as anio,
+       TO_CHAR(fecha_realizada, 'Month') as mes,
+       EXTRACT(MONTH FROM fecha_realizada) as mes_num,
+       tipo,
+       SUM(costo) as total_costo,
+       COUNT(*) as cantidad
+FROM mantenimientos
+WHERE fecha_realizada IS NOT NULL
+GROUP BY anio, mes, mes_num, tipo;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_costos_mantenimiento ON mv_costos_mantenimiento(anio, mes_num, tipo);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_mantenimientos_por_prioridad AS
+SELECT prioridad,
+       CASE prioridad
+           WHEN 'urgente' THEN 1
+           WHEN 'alta' THEN 2
+           WHEN 'media' THEN 3
+           WHEN 'baja' THEN 4
+       END as orden,
+       COUNT(*) as cantidad
+FROM mantenimientos
+WHERE estado IN ('programado', 'en_proceso')
+GROUP BY prioridad;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_mantenimientos_por_prioridad ON mv_mantenimientos_por_prioridad(prioridad);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_equipos_garantia AS
+SELECT CASE
+           WHEN fecha_garantia_fin >= CURRENT_DATE THEN 'En garantía'
+           WHEN fecha_garantia_fin < CURRENT_DATE THEN 'Fuera de garantía'
+           ELSE 'Sin información'
+       END as estado_garantia,
+       COUNT(*) as cantidad
+FROM equipos
+GROUP BY estado_garantia;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_equipos_garantia ON mv_equipos_garantia(estado_garantia);
+
+COMMIT;
@@ -0,0 +1,43 @@
+-- Migración para bases de datos creadas antes de la caché de datos de
+-- referencia de equipos y mantenimiento: sin estos triggers las réplicas
+-- nunca reciben el NOTIFY y no recargan su copia. Aplicar con:
+--   docker-compose exec -T postgres psql -U postgres -d ti_management < database/migrations/006_notificar_referencias.sql
+-- Es idempotente.
+
+BEGIN;
+
+-- Notificación de cambios en datos de referencia; el payload es el nombre de
+-- la tabla modificada.
+CREATE OR REPLACE FUNCTION notificar_cambio_referencia()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('datos_referencia', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_notificar_categorias_equipos ON categorias_equipos;
+CREATE TRIGGER trigger_notificar_categorias_equipos
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON categorias_equipos
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notificar_cambio_referencia();
+
+DROP TRIGGER IF EXISTS trigger_notificar_ubicaciones ON ubicaciones;
+CREATE TRIGGER trigger_notificar_ubicaciones
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON ubicaciones
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notificar_cambio_referencia();
+
+DROP TRIGGER IF EXISTS trigger_notificar_proveedores ON proveedores;
+CREATE TRIGGER trigger_notificar_proveedores
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON proveedores
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notificar_cambio_referencia();
+
+DROP TRIGGER IF EXISTS trigger_notificar_usuarios ON usuarios;
+CREATE TRIGGER trigger_notificar_usuarios
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON usuarios
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notificar_cambio_referencia();
+
+COMMIT;
@@ -0,0 +1,25 @@
+-- Migración para bases de datos creadas antes del planificador de agentes
+-- con varias réplicas (registro de ejecuciones programadas). Aplicar con:
+--   docker-compose exec -T postgres psql -U postgres -d ti_management < database/migrations/007_agentes_ejecuciones.sql
+-- Es idempotente.
+
+BEGIN;
+
+-- La restricción única garantiza que cada ejecución corra en una sola réplica
+CREATE TABLE IF NOT EXISTS agentes_ejecuciones (
+    id SERIAL PRIMARY KEY,
+    agente VARCHAR(100) NOT NULL,
+    programada_para TIMESTAMP NOT NULL,
+    fecha_inicio TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    fecha_fin TIMESTAMP,
+    estado VARCHAR(20),
+    resultado JSONB,
+    UNIQUE (agente, programada_para)
+);
+
+-- También lo usa la limpieza del historial (agente purge_ejecuciones)
+CREATE INDEX IF NOT EXISTS idx_agentes_ejecuciones_fecha_inicio ON agentes_ejecuciones(fecha_inicio);
+
+COMMENT ON TABLE agentes_ejecuciones IS 'Historial de ejecuciones programadas de agentes';
+
+COMMIT;
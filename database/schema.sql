@@ -4,6 +4,9 @@
 -- Crear extensión para UUID si es necesario
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
 
+-- Búsqueda aproximada por trigramas (tolerante a errores de escritura)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- ==================== TABLA: USUARIOS ====================
 CREATE TABLE IF NOT EXISTS usuarios (
     id SERIAL PRIMARY KEY,
@@ -104,14 +107,22 @@ CREATE TABLE IF NOT EXISTS equipos (
     fecha_compra DATE,
     costo_compra DECIMAL(12,2),
     fecha_garantia_fin DATE,
+    -- fecha_compra + vida útil de la categoría; mantenida por trigger
+    fecha_fin_vida_util DATE,
     ubicacion_actual_id INTEGER REFERENCES ubicaciones(id),
     estado_operativo VARCHAR(50) DEFAULT 'operativo',
     estado_fisico VARCHAR(50) DEFAULT 'bueno',
     asignado_a_id INTEGER REFERENCES usuarios(id),
     notas TEXT,
     imagen_url VARCHAR(500),
-    fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    fecha_ultima_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    fecha_registro TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    fecha_ultima_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Documento de búsqueda de texto completo (códigos sin stemming)
+    busqueda TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(codigo_inventario, '') || ' ' || coalesce(numero_serie, '')), 'A') ||
+        setweight(to_tsvector('spanish', coalesce(nombre, '')), 'A') ||
+        setweight(to_tsvector('spanish', coalesce(marca, '') || ' ' || coalesce(modelo, '')), 'B')
+    ) STORED
 );
 
 CREATE INDEX idx_equipos_codigo ON equipos(codigo_inventario);
@@ -121,6 +132,19 @@ CREATE INDEX idx_equipos_ubicacion ON equipos(ubicacion_actual_id);
 CREATE INDEX idx_equipos_estado_operativo ON equipos(estado_operativo);
 CREATE INDEX idx_equipos_asignado ON equipos(asignado_a_id);
 CREATE INDEX idx_equipos_fecha_registro ON equipos(fecha_registro);
+-- Paginación por cursor del listado (ORDER BY fecha_registro DESC, id DESC)
+CREATE INDEX idx_equipos_registro_id ON equipos(fecha_registro DESC, id DESC);
+-- Umbrales y marcas de cambio usados por los agentes incrementales
+CREATE INDEX idx_equipos_fin_vida_util ON equipos(fecha_fin_vida_util);
+CREATE INDEX idx_equipos_garantia_fin ON equipos(fecha_garantia_fin);
+CREATE INDEX idx_equipos_ultima_actualizacion ON equipos(fecha_ultima_actualizacion);
+-- Búsqueda: texto completo y trigramas por campo
+CREATE INDEX idx_equipos_busqueda ON equipos USING GIN (busqueda);
+CREATE INDEX idx_equipos_nombre_trgm ON equipos USING GIN (nombre gin_trgm_ops);
+CREATE INDEX idx_equipos_marca_trgm ON equipos USING GIN (marca gin_trgm_ops);
+CREATE INDEX idx_equipos_modelo_trgm ON equipos USING GIN (modelo gin_trgm_ops);
+CREATE INDEX idx_equipos_serie_trgm ON equipos USING GIN (numero_serie gin_trgm_ops);
+CREATE INDEX idx_equipos_codigo_trgm ON equipos USING GIN (codigo_inventario gin_trgm_ops);
 
 -- ==================== TABLA: MOVIMIENTOS_EQUIPOS ====================
 CREATE TABLE IF NOT EXISTS movimientos_equipos (
@@ -189,6 +213,55 @@ CREATE INDEX idx_notificaciones_leida ON notificaciones(leida);
 CREATE INDEX idx_notificaciones_fecha_creacion ON notificaciones(fecha_creacion);
 CREATE INDEX idx_notificaciones_tipo ON notificaciones(tipo);
 
+-- ==================== TABLA: AGENTES_EJECUCIONES ====================
+-- Registro de ejecuciones programadas de agentes (se purga tras
+-- AGENT_HISTORY_RETENTION_DAYS); la restricción única
+-- garantiza que cada ejecución corra en una sola réplica del servicio
+CREATE TABLE IF NOT EXISTS agentes_ejecuciones (
+    id SERIAL PRIMARY KEY,
+    agente VARCHAR(100) NOT NULL,
+    programada_para TIMESTAMP NOT NULL,
+    fecha_inicio TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    fecha_fin TIMESTAMP,
+    estado VARCHAR(20),
+    resultado JSONB,
+    UNIQUE (agente, programada_para)
+);
+
+CREATE INDEX idx_agentes_ejecuciones_fecha_inicio ON agentes_ejecuciones(fecha_inicio);
+
+-- ==================== TABLA: AGENTES_WATERMARKS ====================
+-- Última ejecución de cada agente incremental
+CREATE TABLE IF NOT EXISTS agentes_watermarks (
+    agente VARCHAR(100) PRIMARY KEY,
+    ultima_ejecucion TIMESTAMP NOT NULL,
+    ultima_fecha DATE NOT NULL
+);
+
+-- ==================== TABLA: EXPORT_JOBS ====================
+-- Trabajos de exportación del servicio de reportes, compartidos por todas
+-- sus réplicas; los archivos se guardan en el volumen REPORTS_PATH
+CREATE TABLE IF NOT EXISTS export_jobs (
+    job_id VARCHAR(32) PRIMARY KEY,
+    tipo VARCHAR(50) NOT NULL,
+    formato VARCHAR(10) NOT NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendiente' CHECK (estado IN ('pendiente', 'en_proceso', 'completado', 'error')),
+    progreso INTEGER NOT NULL DEFAULT 0,
+    replica VARCHAR(255),
+    archivo VARCHAR(500),
+    tamano_bytes BIGINT,
+    error TEXT,
+    fecha_creacion TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    fecha_inicio TIMESTAMP,
+    fecha_fin TIMESTAMP,
+    expira TIMESTAMP
+);
+
+-- Un solo trabajo activo por (formato, tipo): deduplica solicitudes idénticas
+CREATE UNIQUE INDEX idx_export_jobs_activo ON export_jobs(formato, tipo) WHERE estado IN ('pendiente', 'en_proceso');
+CREATE INDEX idx_export_jobs_estado ON export_jobs(estado, fecha_creacion);
+CREATE INDEX idx_export_jobs_expira ON export_jobs(expira);
+
 -- ==================== DATOS INICIALES ====================
 
 -- Insertar categorías de equipos por defecto
@@ -236,6 +309,167 @@ CREATE TRIGGER trigger_update_equipos_timestamp
     FOR EACH ROW
     EXECUTE FUNCTION update_equipos_timestamp();
 
+-- Trigger para precalcular la fecha de fin de vida útil de cada equipo
+CREATE OR REPLACE FUNCTION set_equipos_fin_vida_util()
+RETURNS TRIGGER AS $$
+BEGIN
+    SELECT (NEW.fecha_compra + make_interval(years => c.vida_util_anos))::date
+    INTO NEW.fecha_fin_vida_util
+    FROM categorias_equipos c
+    WHERE c.id = NEW.categoria_id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_set_equipos_fin_vida_util
+    BEFORE INSERT OR UPDATE OF fecha_compra, categoria_id ON equipos
+    FOR EACH ROW
+    EXECUTE FUNCTION set_equipos_fin_vida_util();
+
+-- Trigger para recalcular la vida útil de los equipos al cambiar la categoría
+CREATE OR REPLACE FUNCTION update_categoria_fin_vida_util()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE equipos
+    SET fecha_fin_vida_util = (fecha_compra + make_interval(years => NEW.vida_util_anos))::date
+    WHERE categoria_id = NEW.id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_update_categoria_fin_vida_util
+    AFTER UPDATE OF vida_util_anos ON categorias_equipos
+    FOR EACH ROW
+    WHEN (OLD.vida_util_anos IS DISTINCT FROM NEW.vida_util_anos)
+    EXECUTE FUNCTION update_categoria_fin_vida_util();
+
+-- Notificación de cambios en datos de referencia. Los servicios mantienen una
+-- copia en memoria de estas tablas y la recargan al recibir el NOTIFY; el
+-- payload es el nombre de la tabla modificada.
+CREATE OR REPLACE FUNCTION notificar_cambio_referencia()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('datos_referencia', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_notificar_categorias_equipos
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON categorias_equipos
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notificar_cambio_referencia();
+
+CREATE TRIGGER trigger_notificar_ubicaciones
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON ubicaciones
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notificar_cambio_referencia();
+
+CREATE TRIGGER trigger_notificar_proveedores
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON proveedores
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notificar_cambio_referencia();
+
+CREATE TRIGGER trigger_notificar_usuarios
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON usuarios
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notificar_cambio_referencia();
+
+-- ==================== VISTAS MATERIALIZADAS DE REPORTES ====================
+-- Agregados leídos por el servicio de reportes. Se refrescan periódicamente con
+-- REFRESH MATERIALIZED VIEW CONCURRENTLY (agente refresh_reportes), que requiere
+-- un índice único en cada vista.
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_equipos_por_ubicacion AS
+SELECT u.id as ubicacion_id,
+       u.edificio || ' - ' || u.aula_oficina as ubicacion,
+       COUNT(*) as cantidad
+FROM equipos e
+JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
+GROUP BY u.id, u.edificio, u.aula_oficina;
+
+CREATE UNIQUE INDEX idx_mv_equipos_por_ubicacion ON mv_equipos_por_ubicacion(ubicacion_id);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_equipos_por_estado AS
+SELECT estado_operativo as estado, COUNT(*) as cantidad
+FROM equipos
+GROUP BY estado_operativo;
+
+CREATE UNIQUE INDEX idx_mv_equipos_por_estado ON mv_equipos_por_estado(estado);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_equipos_por_categoria AS
+SELECT c.nombre as categoria, COUNT(*) as cantidad,
+       COALESCE(SUM(e.costo_compra), 0) as valor_total
+FROM equipos e
+JOIN categorias_equipos c ON e.categoria_id = c.id
+GROUP BY c.nombre;
+
+CREATE UNIQUE INDEX idx_mv_equipos_por_categoria ON mv_equipos_por_categoria(categoria);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_equipos_antiguedad AS
+SELECT rango_antiguedad,
+       CASE rango_antiguedad
+           WHEN 'Menos de 1 año' THEN 1
+           WHEN '1-2 años' THEN 2
+           WHEN '3-4 años' THEN 3
+           WHEN '5-6 años' THEN 4
+           ELSE 5
+       END as orden,
+       COUNT(*) as cantidad
+FROM (
+    SELECT CASE
+               WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) < 1 THEN 'Menos de 1 año'
+               WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) BETWEEN 1 AND 2 THEN '1-2 años'
+               WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) BETWEEN 3 AND 4 THEN '3-4 años'
+               WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) BETWEEN 5 AND 6 THEN '5-6 años'
+               ELSE 'Más de 6 años'
+           END as rango_antiguedad
+    FROM equipos
+    WHERE fecha_compra IS NOT NULL
+) rangos
+GROUP BY rango_antiguedad;
+
+CREATE UNIQUE INDEX idx_mv_equipos_antiguedad ON mv_equipos_antiguedad(rango_antiguedad);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_costos_mantenimiento AS
+SELECT EXTRACT(YEAR FROM fecha_realizada)::int as anio,
+       TO_CHAR(fecha_realizada, 'Month') as mes,
+       EXTRACT(MONTH FROM fecha_realizada) as mes_num,
+       tipo,
+       SUM(costo) as total_costo,
+       COUNT(*) as cantidad
+FROM mantenimientos
+WHERE fecha_realizada IS NOT NULL
+GROUP BY anio, mes, mes_num, tipo;
+
+CREATE UNIQUE INDEX idx_mv_costos_mantenimiento ON mv_costos_mantenimiento(anio, mes_num, tipo);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_mantenimientos_por_prioridad AS
+SELECT prioridad,
+       CASE prioridad
+           WHEN 'urgente' THEN 1
+           WHEN 'alta' THEN 2
+           WHEN 'media' THEN 3
+           WHEN 'baja' THEN 4
+       END as orden,
+       COUNT(*) as cantidad
+FROM mantenimientos
+WHERE estado IN ('programado', 'en_proceso')
+GROUP BY prioridad;
+
+CREATE UNIQUE INDEX idx_mv_mantenimientos_por_prioridad ON mv_mantenimientos_por_prioridad(prioridad);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_equipos_garantia AS
+SELECT CASE
+           WHEN fecha_garantia_fin >= CURRENT_DATE THEN 'En garantía'
+           WHEN fecha_garantia_fin < CURRENT_DATE THEN 'Fuera de garantía'
+           ELSE 'Sin información'
+       END as estado_garantia,
+       COUNT(*) as cantidad
+FROM equipos
+GROUP BY estado_garantia;
+
+CREATE UNIQUE INDEX idx_mv_equipos_garantia ON mv_equipos_garantia(estado_garantia);
+
 -- ==================== COMENTARIOS EN TABLAS ====================
 
 COMMENT ON TABLE usuarios IS 'Usuarios del sistema';
@@ -247,4 +481,7 @@ COMMENT ON TABLE equipos IS 'Inventario de equipos de TI';
 COMMENT ON TABLE movimientos_equipos IS 'Historial de movimientos de equipos';
 COMMENT ON TABLE mantenimientos IS 'Registro de mantenimientos preventivos y correctivos';
 COMMENT ON TABLE notificaciones IS 'Notificaciones y alertas del sistema';
+COMMENT ON TABLE agentes_ejecuciones IS 'Historial de ejecuciones programadas de agentes';
+COMMENT ON TABLE agentes_watermarks IS 'Marcas de la última ejecución de los agentes incrementales';
+COMMENT ON TABLE export_jobs IS 'Trabajos de exportación asíncrona de reportes';
 
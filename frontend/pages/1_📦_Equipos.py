@@ -19,18 +19,41 @@ API_URL = os.getenv("API_GATEWAY_URL", "http://api-gateway:8000")
 st.title("📦 Gestión de Equipos")
 st.markdown("---")
 
+PAGE_SIZE = 100
+
 # Funciones auxiliares
-def get_equipos(categoria=None, estado=None):
-    params = {}
+def get_equipos(categoria=None, estado=None, cursor=None):
+    """Obtiene una página de equipos; retorna (equipos, next_cursor)"""
+    params = {'limit': PAGE_SIZE}
     if categoria:
         params['categoria'] = categoria
     if estado:
         params['estado'] = estado
+    if cursor:
+        params['cursor'] = cursor
     
     try:
         response = requests.get(f"{API_URL}/api/equipos", params=params, timeout=10)
         if response.status_code == 200:
-            return response.json()
+            data = response.json()
+            return data.get('items', []), data.get('next_cursor')
+        return [], None
+    except Exception as e:
+        st.error(f"Error: {e}")
+        return [], None
+
+def buscar_equipos(texto, categoria=None, estado=None):
+    """Busca equipos por nombre, marca, modelo, serie o código, ordenados por relevancia"""
+    params = {'q': texto, 'limit': PAGE_SIZE}
+    if categoria:
+        params['categoria'] = categoria
+    if estado:
+        params['estado'] = estado
+    
+    try:
+        response = requests.get(f"{API_URL}/api/equipos/search", params=params, timeout=10)
+        if response.status_code == 200:
+            return response.json().get('items', [])
         return []
     except Exception as e:
         st.error(f"Error: {e}")
@@ -111,6 +134,11 @@ with tab1:
     st.subheader("Inventario de Equipos")
     
     # Filtros
+    busqueda = st.text_input(
+        "Buscar",
+        placeholder="Nombre, marca, modelo, número de serie o código de inventario"
+    ).strip()
+    
     col1, col2, col3, col4 = st.columns(4)
     
     categorias = get_categorias()
@@ -138,11 +166,34 @@ with tab1:
     categoria_filtro = filtro_categoria if filtro_categoria != "Todas" else None
     estado_filtro = filtro_estado if filtro_estado != "Todos" else None
     
-    equipos = get_equipos(categoria=categoria_filtro, estado=estado_filtro)
+    # Pila de cursores de las páginas visitadas; se reinicia al cambiar filtros
+    filtros_actuales = (categoria_filtro, estado_filtro)
+    if st.session_state.get('equipos_filtros') != filtros_actuales:
+        st.session_state['equipos_filtros'] = filtros_actuales
+        st.session_state['equipos_cursores'] = [None]
+    cursores = st.session_state['equipos_cursores']
     
-    if equipos:
-        st.success(f"Se encontraron {len(equipos)} equipos")
+    if len(busqueda) >= 2:
+        equipos = buscar_equipos(busqueda, categoria=categoria_filtro, estado=estado_filtro)
+    else:
+        equipos, next_cursor = get_equipos(categoria=categoria_filtro, estado=estado_filtro, cursor=cursores[-1])
+    
+    if equipos and len(busqueda) >= 2:
+        st.success(f"{len(equipos)} resultados para \"{busqueda}\"")
+    elif equipos:
+        st.success(f"Página {len(cursores)}: mostrando {len(equipos)} equipos")
         
+        col_prev, col_next, _ = st.columns([1, 1, 4])
+        with col_prev:
+            if st.button("⬅️ Anterior", disabled=len(cursores) == 1, use_container_width=True):
+                cursores.pop()
+                st.rerun()
+        with col_next:
+            if st.button("Siguiente ➡️", disabled=next_cursor is None, use_container_width=True):
+                cursores.append(next_cursor)
+                st.rerun()
+    
+    if equipos:
         # Convertir a DataFrame
         df = pd.DataFrame(equipos)
         
@@ -20,13 +20,22 @@ st.markdown("---")
 
 # Funciones auxiliares
 def get_equipos():
+    """Obtiene id, código y nombre de todos los equipos recorriendo las páginas del listado"""
+    equipos = []
+    params = {'limit': 1000, 'fields': 'id,codigo_inventario,nombre'}
     try:
-        response = requests.get(f"{API_URL}/api/equipos", timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        return []
+        while True:
+            response = requests.get(f"{API_URL}/api/equipos", params=params, timeout=10)
+            if response.status_code != 200:
+                break
+            data = response.json()
+            equipos.extend(data.get('items', []))
+            if not data.get('next_cursor'):
+                break
+            params['cursor'] = data['next_cursor']
+        return equipos
     except:
-        return []
+        return equipos
 
 def get_mantenimientos(equipo_id=None, estado=None, tipo=None):
     params = {}
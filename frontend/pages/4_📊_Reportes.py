@@ -13,68 +13,85 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import os
+import time
 from datetime import datetime
 
 API_URL = os.getenv("API_GATEWAY_URL", "http://api-gateway:8000")
 
+# Tiempo máximo de espera de un trabajo de exportación (segundos)
+EXPORT_POLL_TIMEOUT = int(os.getenv("EXPORT_POLL_TIMEOUT", "300"))
+
 st.title("📊 Reportes y Análisis")
 st.markdown("---")
 
 # Funciones auxiliares
-def get_dashboard_data():
-    try:
-        response = requests.get(f"{API_URL}/api/reportes/dashboard", timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        return None
-    except:
-        return None
-
-def get_equipos_por_ubicacion():
-    try:
-        response = requests.get(f"{API_URL}/api/reportes/equipos-por-ubicacion", timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        return []
-    except:
-        return []
-
-def get_equipos_por_estado():
-    try:
-        response = requests.get(f"{API_URL}/api/reportes/equipos-por-estado", timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        return []
-    except:
-        return []
-
-def get_equipos_por_categoria():
+def get_datos_reportes(year=None):
+    """Obtiene los datos de todos los reportes con una única petición batch al gateway"""
+    params = {"year": year} if year else None
+    sub_peticiones = [
+        {"id": "dashboard", "path": "/api/reportes/dashboard"},
+        {"id": "ubicacion", "path": "/api/reportes/equipos-por-ubicacion"},
+        {"id": "estado", "path": "/api/reportes/equipos-por-estado"},
+        {"id": "categoria", "path": "/api/reportes/equipos-por-categoria"},
+        {"id": "costos", "path": "/api/reportes/costos-mantenimiento", "params": params},
+        {"id": "antiguedad", "path": "/api/reportes/equipos-antiguedad"},
+    ]
+    datos = {"dashboard": None, "ubicacion": [], "estado": [], "categoria": [], "costos": [], "antiguedad": []}
     try:
-        response = requests.get(f"{API_URL}/api/reportes/equipos-por-categoria", timeout=10)
+        response = requests.post(f"{API_URL}/api/batch", json={"requests": sub_peticiones}, timeout=10)
         if response.status_code == 200:
-            return response.json()
-        return []
+            for resultado in response.json()["responses"]:
+                if resultado["status"] == 200:
+                    datos[resultado["id"]] = resultado["body"]
     except:
-        return []
+        pass
+    return datos
 
-def get_costos_mantenimiento(year=None):
-    params = {"year": year} if year else {}
-    try:
-        response = requests.get(f"{API_URL}/api/reportes/costos-mantenimiento", params=params, timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        return []
-    except:
-        return []
+def exportar_reporte(tipo, formato):
+    """
+    Encola un trabajo de exportación, espera a que termine mostrando el
+    progreso y descarga el archivo. Retorna (contenido, nombre_archivo).
+    """
+    response = requests.post(
+        f"{API_URL}/api/reportes/export/jobs",
+        json={"type": tipo, "format": formato},
+        timeout=10
+    )
+    if response.status_code != 202:
+        raise Exception(response.text)
+    job = response.json()
+    
+    job_id = job['job_id']
+    barra = st.progress(0)
+    limite = time.monotonic() + EXPORT_POLL_TIMEOUT
+    while job['estado'] in ('pendiente', 'en_proceso'):
+        if time.monotonic() >= limite:
+            raise Exception(f"El trabajo {job_id} no terminó en {EXPORT_POLL_TIMEOUT} segundos")
+        time.sleep(1)
+        response = requests.get(f"{API_URL}/api/reportes/export/jobs/{job_id}", timeout=10)
+        if response.status_code != 200:
+            raise Exception(f"No se pudo consultar el trabajo {job_id}: {response.text}")
+        job = response.json()
+        barra.progress(job.get('progreso', 0))
+    
+    if job['estado'] != 'completado':
+        raise Exception(job.get('error') or f"El trabajo terminó en estado '{job['estado']}'")
+    
+    response = requests.get(f"{API_URL}/api/reportes/export/jobs/{job_id}/download", timeout=60)
+    if response.status_code != 200:
+        raise Exception(response.text)
+    
+    extension = 'pdf' if formato == 'pdf' else 'xlsx'
+    filename = f"{tipo}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    content_disposition = response.headers.get('Content-Disposition', '')
+    if 'filename=' in content_disposition:
+        filename = content_disposition.split('filename=')[1].strip('"')
+    
+    return response.content, filename
 
-def get_equipos_antiguedad():
-    try:
-        response = requests.get(f"{API_URL}/api/reportes/equipos-antiguedad", timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        return []
-    except:
-        return []
+# Los datos de todas las pestañas se cargan en una sola petición; el año
+# de costos se toma del selector de la pestaña de gráficos
+datos = get_datos_reportes(year=st.session_state.get("year_costos", 2024))
 
 # Tabs principales
 tab1, tab2, tab3, tab4 = st.tabs(["📈 Dashboard", "📊 Gráficos", "📄 Exportar", "🔍 Análisis Avanzado"])
@@ -82,7 +99,7 @@ tab1, tab2, tab3, tab4 = st.tabs(["📈 Dashboard", "📊 Gráficos", "📄 Expo
 with tab1:
     st.subheader("Dashboard General")
     
-    dashboard = get_dashboard_data()
+    dashboard = datos["dashboard"]
     
     if dashboard:
         # Métricas principales
@@ -146,7 +163,7 @@ with tab2:
     
     # Equipos por ubicación
     st.markdown("### 📍 Equipos por Ubicación")
-    data_ubicacion = get_equipos_por_ubicacion()
+    data_ubicacion = datos["ubicacion"]
     
     if data_ubicacion:
         df_ubicacion = pd.DataFrame(data_ubicacion)
@@ -170,7 +187,7 @@ with tab2:
     
     with col1:
         st.markdown("### 🟢 Equipos por Estado")
-        data_estado = get_equipos_por_estado()
+        data_estado = datos["estado"]
         
         if data_estado:
             df_estado = pd.DataFrame(data_estado)
@@ -186,7 +203,7 @@ with tab2:
     
     with col2:
         st.markdown("### 📦 Equipos por Categoría")
-        data_categoria = get_equipos_por_categoria()
+        data_categoria = datos["categoria"]
         
         if data_categoria:
             df_categoria = pd.DataFrame(data_categoria)
@@ -205,8 +222,8 @@ with tab2:
     # Costos de mantenimiento
     st.markdown("### 💵 Costos de Mantenimiento")
     
-    year_selected = st.selectbox("Seleccionar Año", [2024, 2023, 2022])
-    data_costos = get_costos_mantenimiento(year=year_selected)
+    year_selected = st.selectbox("Seleccionar Año", [2024, 2023, 2022], key="year_costos")
+    data_costos = datos["costos"]
     
     if data_costos:
         df_costos = pd.DataFrame(data_costos)
@@ -244,7 +261,7 @@ with tab2:
     
     # Antigüedad de equipos
     st.markdown("### ⏰ Antigüedad de Equipos")
-    data_antiguedad = get_equipos_antiguedad()
+    data_antiguedad = datos["antiguedad"]
     
     if data_antiguedad:
         df_antiguedad = pd.DataFrame(data_antiguedad)
@@ -277,28 +294,14 @@ with tab3:
         if st.button("📥 Generar PDF", use_container_width=True, key="gen_pdf"):
             with st.spinner("Generando PDF..."):
                 try:
-                    response = requests.post(
-                        f"{API_URL}/api/reportes/export/pdf",
-                        json={"type": tipo_reporte_pdf},
-                        timeout=30,
-                        stream=True
-                    )
+                    pdf_data, filename = exportar_reporte(tipo_reporte_pdf, "pdf")
                     
-                    if response.status_code == 200:
-                        # Obtener el nombre del archivo del header Content-Disposition
-                        content_disposition = response.headers.get('Content-Disposition', '')
-                        filename = f"{tipo_reporte_pdf}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-                        if 'filename=' in content_disposition:
-                            filename = content_disposition.split('filename=')[1].strip('"')
-                        
-                        # Guardar en session_state para que persista después del rerun
-                        st.session_state['pdf_data'] = response.content
-                        st.session_state['pdf_filename'] = filename
-                        st.success(f"✅ PDF generado exitosamente")
-                    else:
-                        st.error(f"Error al generar PDF: {response.text}")
+                    # Guardar en session_state para que persista después del rerun
+                    st.session_state['pdf_data'] = pdf_data
+                    st.session_state['pdf_filename'] = filename
+                    st.success(f"✅ PDF generado exitosamente")
                 except Exception as e:
-                    st.error(f"Error: {e}")
+                    st.error(f"Error al generar PDF: {e}")
         
         # Mostrar botón de descarga si hay un PDF generado
         if 'pdf_data' in st.session_state and 'pdf_filename' in st.session_state:
@@ -323,28 +326,14 @@ with tab3:
         if st.button("📥 Generar Excel", use_container_width=True, key="gen_excel"):
             with st.spinner("Generando Excel..."):
                 try:
-                    response = requests.post(
-                        f"{API_URL}/api/reportes/export/excel",
-                        json={"type": tipo_reporte_excel},
-                        timeout=30,
-                        stream=True
-                    )
+                    excel_data, filename = exportar_reporte(tipo_reporte_excel, "excel")
                     
-                    if response.status_code == 200:
-                        # Obtener el nombre del archivo del header Content-Disposition
-                        content_disposition = response.headers.get('Content-Disposition', '')
-                        filename = f"{tipo_reporte_excel}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-                        if 'filename=' in content_disposition:
-                            filename = content_disposition.split('filename=')[1].strip('"')
-                        
-                        # Guardar en session_state para que persista después del rerun
-                        st.session_state['excel_data'] = response.content
-                        st.session_state['excel_filename'] = filename
-                        st.success(f"✅ Excel generado exitosamente")
-                    else:
-                        st.error(f"Error al generar Excel: {response.text}")
+                    # Guardar en session_state para que persista después del rerun
+                    st.session_state['excel_data'] = excel_data
+                    st.session_state['excel_filename'] = filename
+                    st.success(f"✅ Excel generado exitosamente")
                 except Exception as e:
-                    st.error(f"Error: {e}")
+                    st.error(f"Error al generar Excel: {e}")
         
         # Mostrar botón de descarga si hay un Excel generado
         if 'excel_data' in st.session_state and 'excel_filename' in st.session_state:
@@ -364,7 +353,7 @@ with tab4:
     
     with col1:
         st.markdown("### 📊 Valor por Categoría")
-        data_categoria = get_equipos_por_categoria()
+        data_categoria = datos["categoria"]
         
         if data_categoria:
             df_cat = pd.DataFrame(data_categoria)
@@ -387,7 +376,7 @@ with tab4:
     
     with col2:
         st.markdown("### 🔧 Eficiencia de Mantenimiento")
-        dashboard = get_dashboard_data()
+        dashboard = datos["dashboard"]
         
         if dashboard:
             disponibilidad = dashboard.get("tasa_disponibilidad", 0)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Copia los módulos de services/shared/ en el directorio de cada servicio que
+los usa. Cada servicio se construye con su propio contexto de Docker
+(services/<servicio>), así que no puede importar services/shared
+directamente; las copias se versionan y tests/test_compartidos.py comprueba
+que sigan idénticas a la fuente.
+
+Uso:
+    python scripts/sincronizar_compartidos.py
+"""
+
+import shutil
+from pathlib import Path
+
+SERVICES_DIR = Path(__file__).resolve().parent.parent / "services"
+SHARED_DIR = SERVICES_DIR / "shared"
+
+# módulo compartido -> servicios que lo usan
+COMPARTIDOS = {
+    "observabilidad.py": [
+        "api_gateway",
+        "equipos_service",
+        "proveedores_service",
+        "mantenimiento_service",
+        "reportes_service",
+        "agent_service",
+    ],
+    "referencias.py": [
+        "equipos_service",
+        "mantenimiento_service",
+    ],
+    "proyeccion.py": [
+        "equipos_service",
+        "mantenimiento_service",
+    ],
+}
+
+def copias():
+    """Pares (fuente, copia) de todos los módulos compartidos"""
+    for modulo, servicios in COMPARTIDOS.items():
+        for servicio in servicios:
+            yield SHARED_DIR / modulo, SERVICES_DIR / servicio / modulo
+
+def sincronizar():
+    for fuente, destino in copias():
+        if destino.exists() and destino.read_bytes() == fuente.read_bytes():
+            continue
+        shutil.copyfile(fuente, destino)
+        print(f"✅ {destino.relative_to(SERVICES_DIR.parent)}")
+
+if __name__ == "__main__":
+    sincronizar()
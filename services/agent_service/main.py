@@ -4,27 +4,90 @@ import asyncpg
 import os
 from datetime import datetime, date, timedelta
 import asyncio
+import json
+import random
+from observabilidad import instrumentar, acquire_connection, actualizar_metricas_pool, respuesta_metricas, iniciar_trazas, detener_trazas, esperas_pool
 
 app = FastAPI(title="Agent Service", version="1.0.0")
+instrumentar(app, "agent-service")
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Tamaño del pool configurable por variables de entorno
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+
+# Pool de conexiones global
+_pool = None
+
+async def create_db_pool():
+    """Crea el pool de conexiones con la configuración del servicio"""
+    return await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        command_timeout=60,
+        timeout=30
+    )
+
 async def get_db_pool():
-    return await asyncpg.create_pool(DATABASE_URL)
+    """Obtiene o crea el pool de conexiones a la base de datos"""
+    global _pool
+    
+    if _pool is None:
+        _pool = await create_db_pool()
+    
+    return _pool
+
+@app.on_event("startup")
+async def startup():
+    """Inicializar el pool de conexiones y el planificador al iniciar la aplicación"""
+    global _pool
+    _pool = await create_db_pool()
+    iniciar_planificador()
+    iniciar_trazas()
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Detener el planificador y cerrar el pool de conexiones al apagar la aplicación"""
+    global _pool
+    await detener_trazas()
+    await detener_planificador()
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
 
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "agents"}
 
-async def crear_notificacion(pool, tipo: str, titulo: str, mensaje: str, 
-                             equipo_id: int = None, mantenimiento_id: int = None):
-    """Crea una notificación en la base de datos"""
-    query = """
-        INSERT INTO notificaciones (tipo, titulo, mensaje, equipo_id, mantenimiento_id)
-        VALUES ($1, $2, $3, $4, $5)
-    """
-    async with pool.acquire() as conn:
-        await conn.execute(query, tipo, titulo, mensaje, equipo_id, mantenimiento_id)
+# ==================== MÉTRICAS ====================
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métricas en formato de exposición de Prometheus"""
+    actualizar_metricas_pool(_pool)
+    return respuesta_metricas()
+
+@app.get("/pool-stats")
+async def get_pool_stats():
+    """Estadísticas del pool de conexiones a la base de datos"""
+    pool = await get_db_pool()
+    size = pool.get_size()
+    idle = pool.get_idle_size()
+    return {
+        "size": size,
+        "idle": idle,
+        "in_use": size - idle,
+        "min_size": pool.get_min_size(),
+        "max_size": pool.get_max_size(),
+        "waiters": esperas_pool()
+    }
+
+async def insertar_notificaciones(conn, query: str, *args) -> int:
+    """Ejecuta un INSERT ... SELECT de notificaciones y retorna las filas insertadas"""
+    status = await conn.execute(query, *args)
+    return int(status.split()[-1])
 
 @app.post("/check-maintenance")
 async def check_maintenance_reminders():
@@ -33,95 +96,68 @@ async def check_maintenance_reminders():
     Se ejecuta diariamente
     """
     pool = await get_db_pool()
-    notificaciones_generadas = 0
     
     try:
-        hoy = date.today()
-        fecha_limite_7dias = hoy + timedelta(days=7)
-        fecha_limite_3dias = hoy + timedelta(days=3)
+        detalle = {}
         
-        async with pool.acquire() as conn:
-            # Mantenimientos próximos (7 días)
-            mantenimientos_proximos = await conn.fetch("""
-                SELECT m.id, m.fecha_programada, m.descripcion,
-                       e.id as equipo_id, e.nombre as equipo_nombre, e.codigo_inventario
-                FROM mantenimientos m
-                JOIN equipos e ON m.equipo_id = e.id
-                WHERE m.fecha_programada BETWEEN $1 AND $2
-                AND m.estado = 'programado'
-                AND NOT EXISTS (
-                    SELECT 1 FROM notificaciones n
-                    WHERE n.mantenimiento_id = m.id
-                    AND n.tipo = 'mantenimiento_proximo'
-                    AND n.fecha_creacion >= CURRENT_DATE
-                )
-            """, hoy, fecha_limite_7dias)
-            
-            for mant in mantenimientos_proximos:
-                dias_restantes = (mant['fecha_programada'] - hoy).days
-                mensaje = f"El equipo {mant['equipo_nombre']} ({mant['codigo_inventario']}) tiene un mantenimiento programado en {dias_restantes} días."
+        async with acquire_connection(pool) as conn:
+            async with conn.transaction():
+                hoy = await fecha_actual(conn)
+                fecha_limite_7dias = hoy + timedelta(days=7)
+                fecha_limite_3dias = hoy + timedelta(days=3)
                 
-                await crear_notificacion(
-                    pool,
-                    "mantenimiento_proximo",
-                    f"Mantenimiento programado en {dias_restantes} días",
-                    mensaje,
-                    mant['equipo_id'],
-                    mant['id']
-                )
-                notificaciones_generadas += 1
-            
-            # Mantenimientos urgentes (3 días o menos)
-            mantenimientos_urgentes = await conn.fetch("""
-                SELECT m.id, m.fecha_programada, m.descripcion,
-                       e.id as equipo_id, e.nombre as equipo_nombre, e.codigo_inventario
-                FROM mantenimientos m
-                JOIN equipos e ON m.equipo_id = e.id
-                WHERE m.fecha_programada BETWEEN $1 AND $2
-                AND m.estado = 'programado'
-            """, hoy, fecha_limite_3dias)
-            
-            for mant in mantenimientos_urgentes:
-                dias_restantes = (mant['fecha_programada'] - hoy).days
-                mensaje = f"⚠️ URGENTE: El equipo {mant['equipo_nombre']} ({mant['codigo_inventario']}) tiene un mantenimiento programado en {dias_restantes} días. Por favor, asegurar disponibilidad de técnicos y recursos."
+                # Mantenimientos próximos (7 días)
+                detalle["mantenimiento_proximo"] = await insertar_notificaciones(conn, """
+                    INSERT INTO notificaciones (tipo, titulo, mensaje, equipo_id, mantenimiento_id)
+                    SELECT 'mantenimiento_proximo',
+                           'Mantenimiento programado en ' || (m.fecha_programada - $1::date) || ' días',
+                           'El equipo ' || e.nombre || ' (' || e.codigo_inventario || ') tiene un mantenimiento programado en '
+                               || (m.fecha_programada - $1::date) || ' días.',
+                           e.id, m.id
+                    FROM mantenimientos m
+                    JOIN equipos e ON m.equipo_id = e.id
+                    WHERE m.fecha_programada BETWEEN $1 AND $2
+                    AND m.estado = 'programado'
+                    AND NOT EXISTS (
+                        SELECT 1 FROM notificaciones n
+                        WHERE n.mantenimiento_id = m.id
+                        AND n.tipo = 'mantenimiento_proximo'
+                        AND n.fecha_creacion >= CURRENT_DATE
+                    )
+                """, hoy, fecha_limite_7dias)
                 
-                await crear_notificacion(
-                    pool,
-                    "mantenimiento_urgente",
-                    f"⚠️ Mantenimiento URGENTE en {dias_restantes} días",
-                    mensaje,
-                    mant['equipo_id'],
-                    mant['id']
-                )
-                notificaciones_generadas += 1
-            
-            # Mantenimientos vencidos
-            mantenimientos_vencidos = await conn.fetch("""
-                SELECT m.id, m.fecha_programada,
-                       e.id as equipo_id, e.nombre as equipo_nombre, e.codigo_inventario
-                FROM mantenimientos m
-                JOIN equipos e ON m.equipo_id = e.id
-                WHERE m.fecha_programada < $1
-                AND m.estado = 'programado'
-            """, hoy)
-            
-            for mant in mantenimientos_vencidos:
-                dias_vencidos = (hoy - mant['fecha_programada']).days
-                mensaje = f"🚨 El mantenimiento del equipo {mant['equipo_nombre']} ({mant['codigo_inventario']}) está vencido por {dias_vencidos} días."
+                # Mantenimientos urgentes (3 días o menos)
+                detalle["mantenimiento_urgente"] = await insertar_notificaciones(conn, """
+                    INSERT INTO notificaciones (tipo, titulo, mensaje, equipo_id, mantenimiento_id)
+                    SELECT 'mantenimiento_urgente',
+                           '⚠️ Mantenimiento URGENTE en ' || (m.fecha_programada - $1::date) || ' días',
+                           '⚠️ URGENTE: El equipo ' || e.nombre || ' (' || e.codigo_inventario || ') tiene un mantenimiento programado en '
+                               || (m.fecha_programada - $1::date) || ' días. Por favor, asegurar disponibilidad de técnicos y recursos.',
+                           e.id, m.id
+                    FROM mantenimientos m
+                    JOIN equipos e ON m.equipo_id = e.id
+                    WHERE m.fecha_programada BETWEEN $1 AND $2
+                    AND m.estado = 'programado'
+                """, hoy, fecha_limite_3dias)
                 
-                await crear_notificacion(
-                    pool,
-                    "mantenimiento_vencido",
-                    f"🚨 Mantenimiento VENCIDO",
-                    mensaje,
-                    mant['equipo_id'],
-                    mant['id']
-                )
-                notificaciones_generadas += 1
+                # Mantenimientos vencidos
+                detalle["mantenimiento_vencido"] = await insertar_notificaciones(conn, """
+                    INSERT INTO notificaciones (tipo, titulo, mensaje, equipo_id, mantenimiento_id)
+                    SELECT 'mantenimiento_vencido',
+                           '🚨 Mantenimiento VENCIDO',
+                           '🚨 El mantenimiento del equipo ' || e.nombre || ' (' || e.codigo_inventario || ') está vencido por '
+                               || ($1::date - m.fecha_programada) || ' días.',
+                           e.id, m.id
+                    FROM mantenimientos m
+                    JOIN equipos e ON m.equipo_id = e.id
+                    WHERE m.fecha_programada < $1
+                    AND m.estado = 'programado'
+                """, hoy)
         
         return {
             "status": "success",
-            "notificaciones_generadas": notificaciones_generadas,
+            "notificaciones_generadas": sum(detalle.values()),
+            "detalle_por_tipo": detalle,
             "fecha_ejecucion": datetime.now().isoformat()
         }
     
@@ -132,75 +168,130 @@ async def check_maintenance_reminders():
             "fecha_ejecucion": datetime.now().isoformat()
         }
 
+async def fecha_actual(conn) -> date:
+    """
+    Fecha de hoy según la base de datos. Se usa en lugar de date.today() para
+    que coincida con CURRENT_DATE (deduplicación y watermarks) aunque la zona
+    horaria del servicio y la de PostgreSQL difieran.
+    """
+    return await conn.fetchval("SELECT CURRENT_DATE")
+
+# Días tras los que se repite un aviso si la condición persiste
+DIAS_REPETIR_AVISO = 30
+
+async def leer_watermark(conn, agente: str):
+    """Obtiene (y bloquea) la marca de la última ejecución incremental de un agente"""
+    return await conn.fetchrow(
+        "SELECT ultima_ejecucion, ultima_fecha FROM agentes_watermarks WHERE agente = $1 FOR UPDATE",
+        agente
+    )
+
+async def guardar_watermark(conn, agente: str):
+    """
+    Registra la ejecución actual. CURRENT_TIMESTAMP es el inicio de la
+    transacción, de modo que los cambios posteriores se evalúan en la siguiente.
+    """
+    await conn.execute("""
+        INSERT INTO agentes_watermarks (agente, ultima_ejecucion, ultima_fecha)
+        VALUES ($1, CURRENT_TIMESTAMP, CURRENT_DATE)
+        ON CONFLICT (agente) DO UPDATE
+        SET ultima_ejecucion = EXCLUDED.ultima_ejecucion, ultima_fecha = EXCLUDED.ultima_fecha
+    """, agente)
+
 @app.post("/check-obsolescence")
 async def check_equipment_obsolescence():
     """
-    Agente: Identifica equipos obsoletos o próximos a serlo
+    Agente: Identifica equipos obsoletos o próximos a serlo.
+    Es incremental: solo evalúa los equipos que cruzaron el umbral de vida útil
+    desde la última ejecución o que se modificaron después de ella.
     """
     pool = await get_db_pool()
-    notificaciones_generadas = 0
     
     try:
-        async with pool.acquire() as conn:
-            # Equipos que superan la vida útil
-            equipos_obsoletos = await conn.fetch("""
-                SELECT e.id, e.nombre, e.codigo_inventario, e.fecha_compra,
-                       c.nombre as categoria, c.vida_util_anos,
-                       EXTRACT(YEAR FROM AGE(CURRENT_DATE, e.fecha_compra)) as anos_uso
-                FROM equipos e
-                JOIN categorias_equipos c ON e.categoria_id = c.id
-                WHERE e.fecha_compra IS NOT NULL
-                AND EXTRACT(YEAR FROM AGE(CURRENT_DATE, e.fecha_compra)) >= c.vida_util_anos
-                AND e.estado_operativo NOT IN ('obsoleto', 'dado_baja')
-                AND NOT EXISTS (
-                    SELECT 1 FROM notificaciones n
-                    WHERE n.equipo_id = e.id
-                    AND n.tipo = 'equipo_obsoleto'
-                    AND n.fecha_creacion >= CURRENT_DATE - INTERVAL '30 days'
-                )
-            """)
-            
-            for equipo in equipos_obsoletos:
-                mensaje = f"El equipo {equipo['nombre']} ({equipo['codigo_inventario']}) tiene {int(equipo['anos_uso'])} años de uso, superando la vida útil de {equipo['vida_util_anos']} años. Se recomienda evaluar su reemplazo."
+        detalle = {}
+        
+        async with acquire_connection(pool) as conn:
+            async with conn.transaction():
+                hoy = await fecha_actual(conn)
+                watermark = await leer_watermark(conn, "check_obsolescence")
                 
-                await crear_notificacion(
-                    pool,
-                    "equipo_obsoleto",
-                    "Equipo ha superado su vida útil",
-                    mensaje,
-                    equipo['id']
-                )
-                notificaciones_generadas += 1
-            
-            # Equipos próximos a fin de vida útil (falta 1 año)
-            equipos_proximos_obsolescencia = await conn.fetch("""
-                SELECT e.id, e.nombre, e.codigo_inventario, e.fecha_compra,
-                       c.nombre as categoria, c.vida_util_anos,
-                       EXTRACT(YEAR FROM AGE(CURRENT_DATE, e.fecha_compra)) as anos_uso
-                FROM equipos e
-                JOIN categorias_equipos c ON e.categoria_id = c.id
-                WHERE e.fecha_compra IS NOT NULL
-                AND EXTRACT(YEAR FROM AGE(CURRENT_DATE, e.fecha_compra)) >= (c.vida_util_anos - 1)
-                AND EXTRACT(YEAR FROM AGE(CURRENT_DATE, e.fecha_compra)) < c.vida_util_anos
-                AND e.estado_operativo NOT IN ('obsoleto', 'dado_baja')
-            """)
-            
-            for equipo in equipos_proximos_obsolescencia:
-                anos_restantes = equipo['vida_util_anos'] - int(equipo['anos_uso'])
-                mensaje = f"El equipo {equipo['nombre']} ({equipo['codigo_inventario']}) se acerca al fin de su vida útil. Quedan aproximadamente {anos_restantes} años. Considere incluirlo en el próximo plan de renovación."
+                if watermark is None:
+                    # Primera ejecución: todos los equipos con umbral hasta dentro de un año
+                    candidatos = """
+                        SELECT id FROM equipos
+                        WHERE fecha_fin_vida_util <= ($1::date + INTERVAL '1 year')::date
+                    """
+                    params = [hoy]
+                else:
+                    candidatos = """
+                        SELECT id FROM equipos
+                        WHERE fecha_fin_vida_util > $2 AND fecha_fin_vida_util <= $1
+                        UNION
+                        SELECT id FROM equipos
+                        WHERE fecha_fin_vida_util > ($2::date + INTERVAL '1 year')::date
+                        AND fecha_fin_vida_util <= ($1::date + INTERVAL '1 year')::date
+                        UNION
+                        SELECT id FROM equipos
+                        WHERE fecha_ultima_actualizacion > $3
+                        UNION
+                        -- Avisos que cumplieron DIAS_REPETIR_AVISO desde la última
+                        -- ejecución: se repiten si el equipo sigue obsoleto
+                        SELECT equipo_id FROM notificaciones
+                        WHERE tipo = 'equipo_obsoleto'
+                        AND fecha_creacion >= $2::date - $4::int
+                        AND fecha_creacion < $1::date - $4::int
+                    """
+                    params = [hoy, watermark['ultima_fecha'], watermark['ultima_ejecucion'], DIAS_REPETIR_AVISO]
                 
-                await crear_notificacion(
-                    pool,
-                    "equipo_proximo_obsolescencia",
-                    "Equipo próximo a fin de vida útil",
-                    mensaje,
-                    equipo['id']
-                )
-                notificaciones_generadas += 1
+                # Equipos que superan la vida útil
+                detalle["equipo_obsoleto"] = await insertar_notificaciones(conn, f"""
+                    WITH candidatos AS ({candidatos})
+                    INSERT INTO notificaciones (tipo, titulo, mensaje, equipo_id)
+                    SELECT 'equipo_obsoleto',
+                           'Equipo ha superado su vida útil',
+                           'El equipo ' || e.nombre || ' (' || e.codigo_inventario || ') tiene '
+                               || EXTRACT(YEAR FROM AGE($1::date, e.fecha_compra))::int
+                               || ' años de uso, superando la vida útil de ' || c.vida_util_anos
+                               || ' años. Se recomienda evaluar su reemplazo.',
+                           e.id
+                    FROM candidatos
+                    JOIN equipos e ON e.id = candidatos.id
+                    JOIN categorias_equipos c ON e.categoria_id = c.id
+                    WHERE e.fecha_fin_vida_util <= $1
+                    AND e.estado_operativo NOT IN ('obsoleto', 'dado_baja')
+                    AND NOT EXISTS (
+                        SELECT 1 FROM notificaciones n
+                        WHERE n.equipo_id = e.id
+                        AND n.tipo = 'equipo_obsoleto'
+                        AND n.fecha_creacion >= $1::date - {DIAS_REPETIR_AVISO}
+                    )
+                """, *params)
+                
+                # Equipos próximos a fin de vida útil (falta 1 año)
+                detalle["equipo_proximo_obsolescencia"] = await insertar_notificaciones(conn, f"""
+                    WITH candidatos AS ({candidatos})
+                    INSERT INTO notificaciones (tipo, titulo, mensaje, equipo_id)
+                    SELECT 'equipo_proximo_obsolescencia',
+                           'Equipo próximo a fin de vida útil',
+                           'El equipo ' || e.nombre || ' (' || e.codigo_inventario || ') se acerca al fin de su vida útil. Quedan aproximadamente '
+                               || (c.vida_util_anos - EXTRACT(YEAR FROM AGE($1::date, e.fecha_compra))::int)
+                               || ' años. Considere incluirlo en el próximo plan de renovación.',
+                           e.id
+                    FROM candidatos
+                    JOIN equipos e ON e.id = candidatos.id
+                    JOIN categorias_equipos c ON e.categoria_id = c.id
+                    WHERE e.fecha_fin_vida_util > $1
+                    AND e.fecha_fin_vida_util <= ($1::date + INTERVAL '1 year')::date
+                    AND e.estado_operativo NOT IN ('obsoleto', 'dado_baja')
+                """, *params)
+                
+                await guardar_watermark(conn, "check_obsolescence")
         
         return {
             "status": "success",
-            "notificaciones_generadas": notificaciones_generadas,
+            "incremental": watermark is not None,
+            "notificaciones_generadas": sum(detalle.values()),
+            "detalle_por_tipo": detalle,
             "fecha_ejecucion": datetime.now().isoformat()
         }
     
@@ -214,45 +305,76 @@ async def check_equipment_obsolescence():
 @app.post("/check-warranties")
 async def check_warranty_expiration():
     """
-    Agente: Alerta sobre garantías próximas a vencer
+    Agente: Alerta sobre garantías próximas a vencer.
+    Es incremental: solo evalúa los equipos cuya garantía entró en la ventana
+    de 60 días desde la última ejecución o que se modificaron después de ella.
     """
     pool = await get_db_pool()
-    notificaciones_generadas = 0
     
     try:
-        hoy = date.today()
-        fecha_limite = hoy + timedelta(days=60)
-        
-        async with pool.acquire() as conn:
-            equipos_garantia_proxima = await conn.fetch("""
-                SELECT e.id, e.nombre, e.codigo_inventario, e.fecha_garantia_fin,
-                       p.razon_social as proveedor
-                FROM equipos e
-                LEFT JOIN proveedores p ON e.proveedor_id = p.id
-                WHERE e.fecha_garantia_fin BETWEEN $1 AND $2
-                AND NOT EXISTS (
-                    SELECT 1 FROM notificaciones n
-                    WHERE n.equipo_id = e.id
-                    AND n.tipo = 'garantia_proxima_vencer'
-                    AND n.fecha_creacion >= CURRENT_DATE - INTERVAL '30 days'
-                )
-            """, hoy, fecha_limite)
-            
-            for equipo in equipos_garantia_proxima:
-                dias_restantes = (equipo['fecha_garantia_fin'] - hoy).days
-                mensaje = f"La garantía del equipo {equipo['nombre']} ({equipo['codigo_inventario']}) vence en {dias_restantes} días ({equipo['fecha_garantia_fin'].strftime('%d/%m/%Y')}). Proveedor: {equipo['proveedor'] or 'N/A'}"
+        async with acquire_connection(pool) as conn:
+            async with conn.transaction():
+                hoy = await fecha_actual(conn)
+                fecha_limite = hoy + timedelta(days=60)
+                watermark = await leer_watermark(conn, "check_warranties")
+                
+                if watermark is None:
+                    candidatos = """
+                        SELECT id FROM equipos
+                        WHERE fecha_garantia_fin BETWEEN $1 AND $2
+                    """
+                    params = [hoy, fecha_limite]
+                else:
+                    candidatos = """
+                        SELECT id FROM equipos
+                        WHERE fecha_garantia_fin > $3 AND fecha_garantia_fin <= $2
+                        UNION
+                        SELECT id FROM equipos
+                        WHERE fecha_ultima_actualizacion > $4
+                        UNION
+                        -- Avisos que cumplieron DIAS_REPETIR_AVISO desde la última
+                        -- ejecución: se repiten si la garantía sigue por vencer
+                        SELECT equipo_id FROM notificaciones
+                        WHERE tipo = 'garantia_proxima_vencer'
+                        AND fecha_creacion >= $5::date - $6::int
+                        AND fecha_creacion < $1::date - $6::int
+                    """
+                    params = [
+                        hoy,
+                        fecha_limite,
+                        watermark['ultima_fecha'] + timedelta(days=60),
+                        watermark['ultima_ejecucion'],
+                        watermark['ultima_fecha'],
+                        DIAS_REPETIR_AVISO
+                    ]
+                
+                notificaciones_generadas = await insertar_notificaciones(conn, f"""
+                    WITH candidatos AS ({candidatos})
+                    INSERT INTO notificaciones (tipo, titulo, mensaje, equipo_id)
+                    SELECT 'garantia_proxima_vencer',
+                           'Garantía vence en ' || (e.fecha_garantia_fin - $1::date) || ' días',
+                           'La garantía del equipo ' || e.nombre || ' (' || e.codigo_inventario || ') vence en '
+                               || (e.fecha_garantia_fin - $1::date) || ' días ('
+                               || TO_CHAR(e.fecha_garantia_fin, 'DD/MM/YYYY') || '). Proveedor: '
+                               || COALESCE(p.razon_social, 'N/A'),
+                           e.id
+                    FROM candidatos
+                    JOIN equipos e ON e.id = candidatos.id
+                    LEFT JOIN proveedores p ON e.proveedor_id = p.id
+                    WHERE e.fecha_garantia_fin BETWEEN $1 AND $2
+                    AND NOT EXISTS (
+                        SELECT 1 FROM notificaciones n
+                        WHERE n.equipo_id = e.id
+                        AND n.tipo = 'garantia_proxima_vencer'
+                        AND n.fecha_creacion >= $1::date - {DIAS_REPETIR_AVISO}
+                    )
+                """, *params)
                 
-                await crear_notificacion(
-                    pool,
-                    "garantia_proxima_vencer",
-                    f"Garantía vence en {dias_restantes} días",
-                    mensaje,
-                    equipo['id']
-                )
-                notificaciones_generadas += 1
+                await guardar_watermark(conn, "check_warranties")
         
         return {
             "status": "success",
+            "incremental": watermark is not None,
             "notificaciones_generadas": notificaciones_generadas,
             "fecha_ejecucion": datetime.now().isoformat()
         }
@@ -270,46 +392,55 @@ async def analyze_maintenance_costs():
     Agente: Analiza costos de mantenimiento y genera alertas
     """
     pool = await get_db_pool()
-    alertas = []
     
     try:
-        async with pool.acquire() as conn:
-            # Equipos con alto costo de mantenimiento
-            equipos_alto_costo = await conn.fetch("""
-                SELECT e.id, e.nombre, e.codigo_inventario, e.costo_compra,
-                       COUNT(m.id) as num_mantenimientos,
-                       SUM(m.costo) as costo_total_mantenimiento
-                FROM equipos e
-                JOIN mantenimientos m ON e.id = m.equipo_id
-                WHERE m.fecha_realizada >= CURRENT_DATE - INTERVAL '1 year'
-                GROUP BY e.id
-                HAVING SUM(m.costo) > e.costo_compra * 0.5
-                ORDER BY costo_total_mantenimiento DESC
-            """)
-            
-            for equipo in equipos_alto_costo:
-                porcentaje = (equipo['costo_total_mantenimiento'] / equipo['costo_compra'] * 100) if equipo['costo_compra'] else 0
-                
-                mensaje = f"El equipo {equipo['nombre']} ({equipo['codigo_inventario']}) ha generado costos de mantenimiento por ${equipo['costo_total_mantenimiento']:.2f} en el último año ({int(porcentaje)}% de su valor de compra). Se recomienda evaluar su reemplazo."
-                
-                await crear_notificacion(
-                    pool,
-                    "alto_costo_mantenimiento",
-                    "Equipo con altos costos de mantenimiento",
-                    mensaje,
-                    equipo['id']
-                )
-                
-                alertas.append({
-                    "equipo_id": equipo['id'],
-                    "codigo": equipo['codigo_inventario'],
-                    "costo_mantenimiento": float(equipo['costo_total_mantenimiento']),
-                    "num_mantenimientos": equipo['num_mantenimientos']
-                })
+        async with acquire_connection(pool) as conn:
+            async with conn.transaction():
+                # Equipos con alto costo de mantenimiento: se notifican y se
+                # devuelven en la misma sentencia
+                equipos_alto_costo = await conn.fetch("""
+                    WITH alto_costo AS (
+                        SELECT e.id, e.nombre, e.codigo_inventario, e.costo_compra,
+                               COUNT(m.id) as num_mantenimientos,
+                               SUM(m.costo) as costo_total_mantenimiento
+                        FROM equipos e
+                        JOIN mantenimientos m ON e.id = m.equipo_id
+                        WHERE m.fecha_realizada >= CURRENT_DATE - INTERVAL '1 year'
+                        GROUP BY e.id
+                        HAVING SUM(m.costo) > e.costo_compra * 0.5
+                    ),
+                    insertadas AS (
+                        INSERT INTO notificaciones (tipo, titulo, mensaje, equipo_id)
+                        SELECT 'alto_costo_mantenimiento',
+                               'Equipo con altos costos de mantenimiento',
+                               'El equipo ' || a.nombre || ' (' || a.codigo_inventario || ') ha generado costos de mantenimiento por $'
+                                   || TO_CHAR(a.costo_total_mantenimiento, 'FM999999999990.00') || ' en el último año ('
+                                   || CASE WHEN a.costo_compra > 0
+                                           THEN TRUNC(a.costo_total_mantenimiento / a.costo_compra * 100)::int
+                                           ELSE 0 END
+                                   || '% de su valor de compra). Se recomienda evaluar su reemplazo.',
+                               a.id
+                        FROM alto_costo a
+                    )
+                    SELECT id, codigo_inventario, num_mantenimientos, costo_total_mantenimiento
+                    FROM alto_costo
+                    ORDER BY costo_total_mantenimiento DESC
+                """)
+        
+        alertas = [
+            {
+                "equipo_id": equipo['id'],
+                "codigo": equipo['codigo_inventario'],
+                "costo_mantenimiento": float(equipo['costo_total_mantenimiento']),
+                "num_mantenimientos": equipo['num_mantenimientos']
+            }
+            for equipo in equipos_alto_costo
+        ]
         
         return {
             "status": "success",
             "equipos_identificados": len(alertas),
+            "notificaciones_generadas": len(alertas),
             "detalle": alertas,
             "fecha_ejecucion": datetime.now().isoformat()
         }
@@ -321,6 +452,79 @@ async def analyze_maintenance_costs():
             "fecha_ejecucion": datetime.now().isoformat()
         }
 
+# Vistas materializadas que lee el servicio de reportes
+VISTAS_REPORTES = [
+    "mv_equipos_por_ubicacion",
+    "mv_equipos_por_estado",
+    "mv_equipos_por_categoria",
+    "mv_equipos_antiguedad",
+    "mv_costos_mantenimiento",
+    "mv_mantenimientos_por_prioridad",
+    "mv_equipos_garantia",
+]
+
+@app.post("/refresh-reportes")
+async def refresh_reportes():
+    """
+    Agente: Refresca las vistas materializadas de reportes sin bloquear
+    las lecturas (REFRESH MATERIALIZED VIEW CONCURRENTLY)
+    """
+    pool = await get_db_pool()
+    
+    try:
+        tiempos = {}
+        async with acquire_connection(pool) as conn:
+            for vista in VISTAS_REPORTES:
+                inicio = datetime.now()
+                await conn.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {vista}")
+                tiempos[vista] = round((datetime.now() - inicio).total_seconds() * 1000, 2)
+        
+        return {
+            "status": "success",
+            "vistas_refrescadas": len(tiempos),
+            "tiempos_ms": tiempos,
+            "fecha_ejecucion": datetime.now().isoformat()
+        }
+    
+    except Exception as e:
+        return {
+            "status": "error",
+            "error": str(e),
+            "fecha_ejecucion": datetime.now().isoformat()
+        }
+
+# Días que se conserva el historial de agentes_ejecuciones
+AGENT_HISTORY_RETENTION_DAYS = int(os.getenv("AGENT_HISTORY_RETENTION_DAYS", "30"))
+
+@app.post("/purge-ejecuciones")
+async def purge_ejecuciones():
+    """
+    Agente: Elimina del historial de ejecuciones programadas las anteriores a
+    AGENT_HISTORY_RETENTION_DAYS (refresh_reportes sola añade 288 filas al día)
+    """
+    pool = await get_db_pool()
+    
+    try:
+        async with acquire_connection(pool) as conn:
+            resultado = await conn.execute("""
+                DELETE FROM agentes_ejecuciones
+                WHERE fecha_inicio < CURRENT_TIMESTAMP - make_interval(days => $1)
+            """, AGENT_HISTORY_RETENTION_DAYS)
+        
+        return {
+            "status": "success",
+            "ejecuciones_eliminadas": int(resultado.split()[-1]),
+            "retencion_dias": AGENT_HISTORY_RETENTION_DAYS,
+            "fecha_ejecucion": datetime.now().isoformat()
+        }
+    
+    except Exception as e:
+        return {
+            "status": "error",
+            "error": str(e),
+            "fecha_ejecucion": datetime.now().isoformat()
+        }
+
 @app.get("/notificaciones")
 async def get_notificaciones(leida: bool = False, limit: int = 50):
     """Obtiene las notificaciones del sistema"""
@@ -335,7 +539,7 @@ async def get_notificaciones(leida: bool = False, limit: int = 50):
         LIMIT $2
     """
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         rows = await conn.fetch(query, leida, limit)
         return [dict(row) for row in rows]
 
@@ -344,7 +548,7 @@ async def marcar_notificacion_leida(notif_id: int):
     """Marca una notificación como leída"""
     pool = await get_db_pool()
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         await conn.execute(
             "UPDATE notificaciones SET leida = TRUE, fecha_lectura = CURRENT_TIMESTAMP WHERE id = $1",
             notif_id
@@ -352,15 +556,193 @@ async def marcar_notificacion_leida(notif_id: int):
     
     return {"message": "Notificación marcada como leída"}
 
+# ==================== PLANIFICADOR DE AGENTES ====================
+
+SCHEDULER_ENABLED = os.getenv("AGENT_SCHEDULER_ENABLED", "true").lower() == "true"
+SCHEDULER_JITTER_SECONDS = int(os.getenv("AGENT_SCHEDULER_JITTER_SECONDS", "30"))
+AGENT_MAX_RUNTIME_SECONDS = int(os.getenv("AGENT_MAX_RUNTIME_SECONDS", "600"))
+
+class CronSchedule:
+    """
+    Expresión cron de 5 campos: minuto hora día mes día_semana.
+    Soporta '*', listas 'a,b', rangos 'a-b' y pasos '*/n' o 'a-b/n'.
+    """
+    RANGOS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+    
+    def __init__(self, expresion: str):
+        campos = expresion.split()
+        if len(campos) != 5:
+            raise ValueError(f"Expresión cron inválida: '{expresion}'")
+        self.expresion = expresion
+        self.minutos, self.horas, self.dias, self.meses, dias_semana = [
+            self._parse_campo(campo, minimo, maximo)
+            for campo, (minimo, maximo) in zip(campos, self.RANGOS)
+        ]
+        # Domingo puede escribirse como 0 o 7
+        self.dias_semana = {d % 7 for d in dias_semana}
+        # Como en cron, si día y día de semana están restringidos basta con que coincida uno
+        self._dia_restringido = campos[2] != "*"
+        self._dia_semana_restringido = campos[4] != "*"
+    
+    @staticmethod
+    def _parse_campo(campo: str, minimo: int, maximo: int) -> set:
+        valores = set()
+        for parte in campo.split(","):
+            paso = 1
+            if "/" in parte:
+                parte, paso_str = parte.split("/")
+                paso = int(paso_str)
+            if parte == "*":
+                inicio, fin = minimo, maximo
+            elif "-" in parte:
+                inicio, fin = (int(v) for v in parte.split("-"))
+            else:
+                inicio = fin = int(parte)
+            if inicio < minimo or fin > maximo or inicio > fin or paso < 1:
+                raise ValueError(f"Campo cron fuera de rango: '{campo}'")
+            valores.update(range(inicio, fin + 1, paso))
+        return valores
+    
+    def _coincide_dia(self, momento: datetime) -> bool:
+        dia_ok = momento.day in self.dias
+        dia_semana_ok = (momento.weekday() + 1) % 7 in self.dias_semana
+        if self._dia_restringido and self._dia_semana_restringido:
+            return dia_ok or dia_semana_ok
+        return dia_ok and dia_semana_ok
+    
+    def siguiente(self, desde: datetime) -> datetime:
+        """Primer instante (al minuto) estrictamente posterior a 'desde' que cumple la expresión"""
+        momento = desde.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limite = momento + timedelta(days=366 * 4)
+        while momento < limite:
+            if momento.month not in self.meses or not self._coincide_dia(momento):
+                momento = momento.replace(hour=0, minute=0) + timedelta(days=1)
+            elif momento.hour not in self.horas:
+                momento = momento.replace(minute=0) + timedelta(hours=1)
+            elif momento.minute not in self.minutos:
+                momento += timedelta(minutes=1)
+            else:
+                return momento
+        raise ValueError(f"La expresión cron '{self.expresion}' no tiene próximas ejecuciones")
+
+async def ejecutar_con_lock(nombre: str, agente, programada_para: datetime = None) -> dict:
+    """
+    Ejecuta un agente solo si esta réplica obtiene el advisory lock del agente.
+    Con 'programada_para' además registra la ejecución en agentes_ejecuciones,
+    de modo que cada ejecución programada corre una única vez entre réplicas.
+    """
+    pool = await get_db_pool()
+    
+    async with acquire_connection(pool) as conn:
+        obtenido = await conn.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", f"agent_service:{nombre}")
+        if not obtenido:
+            return {"status": "skipped", "motivo": "El agente se está ejecutando en otra réplica"}
+        
+        try:
+            ejecucion_id = None
+            if programada_para is not None:
+                ejecucion_id = await conn.fetchval("""
+                    INSERT INTO agentes_ejecuciones (agente, programada_para)
+                    VALUES ($1, $2)
+                    ON CONFLICT (agente, programada_para) DO NOTHING
+                    RETURNING id
+                """, nombre, programada_para)
+                if ejecucion_id is None:
+                    return {"status": "skipped", "motivo": "Ejecución ya realizada por otra réplica"}
+            
+            try:
+                resultado = await asyncio.wait_for(agente(), timeout=AGENT_MAX_RUNTIME_SECONDS)
+            except asyncio.TimeoutError:
+                resultado = {
+                    "status": "error",
+                    "error": f"Se superó el tiempo máximo de ejecución ({AGENT_MAX_RUNTIME_SECONDS}s)",
+                    "fecha_ejecucion": datetime.now().isoformat()
+                }
+            
+            if ejecucion_id is not None:
+                await conn.execute("""
+                    UPDATE agentes_ejecuciones
+                    SET fecha_fin = CURRENT_TIMESTAMP, estado = $2, resultado = $3
+                    WHERE id = $1
+                """, ejecucion_id, resultado.get("status"), json.dumps(resultado, default=str))
+            
+            return resultado
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(hashtext($1))", f"agent_service:{nombre}")
+
+# Agentes programados: nombre -> (función, expresión cron por defecto)
+AGENTES = {
+    "check_maintenance": (check_maintenance_reminders, "0 6 * * *"),
+    "check_obsolescence": (check_equipment_obsolescence, "30 6 * * *"),
+    "check_warranties": (check_warranty_expiration, "0 7 * * *"),
+    "analyze_maintenance_costs": (analyze_maintenance_costs, "0 7 * * 1"),
+    "refresh_reportes": (refresh_reportes, "*/5 * * * *"),
+    "purge_ejecuciones": (purge_ejecuciones, "15 3 * * *"),
+}
+
+# Estado del planificador por agente
+_planificacion = {}
+_tareas_planificador = []
+
+async def planificar_agente(nombre: str, agente, cron: CronSchedule):
+    """Bucle de planificación de un agente según su expresión cron"""
+    estado = _planificacion[nombre]
+    while True:
+        programada_para = cron.siguiente(datetime.now())
+        estado["proxima_ejecucion"] = programada_para.isoformat()
+        
+        espera = (programada_para - datetime.now()).total_seconds()
+        espera += random.uniform(0, SCHEDULER_JITTER_SECONDS)
+        await asyncio.sleep(max(espera, 0))
+        
+        try:
+            resultado = await ejecutar_con_lock(nombre, agente, programada_para)
+        except Exception as e:
+            resultado = {"status": "error", "error": str(e)}
+        
+        estado["ultima_ejecucion"] = datetime.now().isoformat()
+        estado["ultimo_resultado"] = resultado
+
+def iniciar_planificador():
+    """Lanza una tarea de planificación por cada agente"""
+    if not SCHEDULER_ENABLED:
+        return
+    
+    for nombre, (agente, cron_por_defecto) in AGENTES.items():
+        expresion = os.getenv(f"AGENT_SCHEDULE_{nombre.upper()}", cron_por_defecto)
+        cron = CronSchedule(expresion)
+        _planificacion[nombre] = {
+            "cron": expresion,
+            "proxima_ejecucion": None,
+            "ultima_ejecucion": None,
+            "ultimo_resultado": None
+        }
+        _tareas_planificador.append(asyncio.create_task(planificar_agente(nombre, agente, cron)))
+
+async def detener_planificador():
+    """Cancela las tareas de planificación en curso"""
+    for tarea in _tareas_planificador:
+        tarea.cancel()
+    await asyncio.gather(*_tareas_planificador, return_exceptions=True)
+    _tareas_planificador.clear()
+
+@app.get("/scheduler")
+async def get_scheduler():
+    """Estado del planificador de agentes en esta réplica"""
+    return {
+        "habilitado": SCHEDULER_ENABLED,
+        "jitter_segundos": SCHEDULER_JITTER_SECONDS,
+        "tiempo_maximo_segundos": AGENT_MAX_RUNTIME_SECONDS,
+        "agentes": _planificacion
+    }
+
 @app.post("/run-all-agents")
 async def run_all_agents(background_tasks: BackgroundTasks):
     """Ejecuta todos los agentes en segundo plano"""
     
     async def ejecutar_todos():
-        await check_maintenance_reminders()
-        await check_equipment_obsolescence()
-        await check_warranty_expiration()
-        await analyze_maintenance_costs()
+        for nombre, (agente, _) in AGENTES.items():
+            await ejecutar_con_lock(nombre, agente)
     
     background_tasks.add_task(ejecutar_todos)
     
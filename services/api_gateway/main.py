@@ -1,9 +1,27 @@
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel
+from prometheus_client import Gauge, Histogram
 import httpx
 import os
-from typing import Optional
+import time
+import math
+import gzip
+import hashlib
+import asyncio
+import posixpath
+from urllib.parse import unquote
+from collections import OrderedDict
+from abc import ABC, abstractmethod
+from typing import Optional, List, Dict, Any
+from observabilidad import instrumentar, respuesta_metricas, iniciar_trazas, detener_trazas, traza_actual, nuevo_span_id, registrar_span
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 app = FastAPI(
     title="API Gateway - Sistema de Gestión TI",
@@ -19,21 +37,742 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+instrumentar(app, "api-gateway")
 
-# URLs de los microservicios
+# URLs de los microservicios (varias réplicas separadas por comas)
 EQUIPOS_SERVICE_URL = os.getenv("EQUIPOS_SERVICE_URL", "http://equipos-service:8001")
 PROVEEDORES_SERVICE_URL = os.getenv("PROVEEDORES_SERVICE_URL", "http://proveedores-service:8002")
 MANTENIMIENTO_SERVICE_URL = os.getenv("MANTENIMIENTO_SERVICE_URL", "http://mantenimiento-service:8003")
 REPORTES_SERVICE_URL = os.getenv("REPORTES_SERVICE_URL", "http://reportes-service:8004")
 AGENT_SERVICE_URL = os.getenv("AGENT_SERVICE_URL", "http://agent-service:8005")
 
-# Cliente HTTP asíncrono
-client = httpx.AsyncClient(timeout=30.0)
+# ==================== BACKENDS ====================
+
+class CircuitBreaker:
+    """
+    Circuito de un backend. En estado closed deja pasar todo; tras
+    CB_FAILURE_THRESHOLD fallos consecutivos (errores de conexión, timeouts
+    o respuestas 5xx) pasa a open y rechaza al instante durante
+    CB_RESET_TIMEOUT segundos; después pasa a half-open y deja pasar hasta
+    CB_HALF_OPEN_MAX peticiones de prueba: un éxito lo cierra y un fallo lo
+    vuelve a abrir.
+    """
+    
+    def __init__(self, prefijo: str):
+        self.umbral_fallos = int(os.getenv(f"{prefijo}_CB_FAILURE_THRESHOLD", os.getenv("CB_FAILURE_THRESHOLD", "5")))
+        self.reset_timeout = float(os.getenv(f"{prefijo}_CB_RESET_TIMEOUT", os.getenv("CB_RESET_TIMEOUT", "30")))
+        self.max_pruebas = int(os.getenv(f"{prefijo}_CB_HALF_OPEN_MAX", os.getenv("CB_HALF_OPEN_MAX", "1")))
+        
+        self.estado = "closed"
+        self.fallos = 0
+        self.abierto_hasta = 0.0
+        self.pruebas_en_curso = 0
+        self.aperturas = 0
+        self.rechazos = 0
+    
+    def permitir(self) -> Optional[float]:
+        """Retorna None si la petición puede pasar, o los segundos sugeridos para reintentar"""
+        ahora = time.monotonic()
+        if self.estado == "open":
+            if ahora < self.abierto_hasta:
+                self.rechazos += 1
+                return self.abierto_hasta - ahora
+            self.estado = "half-open"
+            self.pruebas_en_curso = 0
+        
+        if self.estado == "half-open":
+            if self.pruebas_en_curso >= self.max_pruebas:
+                self.rechazos += 1
+                return 1.0
+            self.pruebas_en_curso += 1
+        return None
+    
+    def registrar_exito(self):
+        self.fallos = 0
+        if self.estado == "half-open":
+            self.estado = "closed"
+            self.pruebas_en_curso = 0
+    
+    def registrar_fallo(self):
+        self.fallos += 1
+        if self.estado == "half-open" or self.fallos >= self.umbral_fallos:
+            self.abrir()
+    
+    def liberar(self):
+        """Devuelve el turno de prueba de una petición que no llegó al backend"""
+        if self.estado == "half-open":
+            self.pruebas_en_curso = max(0, self.pruebas_en_curso - 1)
+    
+    def abrir(self):
+        if self.estado != "open":
+            self.aperturas += 1
+        self.estado = "open"
+        self.abierto_hasta = time.monotonic() + self.reset_timeout
+        self.pruebas_en_curso = 0
+    
+    def stats(self) -> dict:
+        return {
+            "estado": self.estado,
+            "fallos_consecutivos": self.fallos,
+            "reintentar_en": round(max(0.0, self.abierto_hasta - time.monotonic()), 1) if self.estado == "open" else 0,
+            "aperturas": self.aperturas,
+            "rechazos": self.rechazos
+        }
+
+class Replica:
+    """Instancia de un backend; se expulsa del balanceo mientras falle"""
+    
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.sana = True
+        self.en_curso = 0
+        self.peticiones = 0
+        self.fallos_health = 0
+        self.expulsiones = 0
+    
+    def expulsar(self):
+        if self.sana:
+            self.expulsiones += 1
+        self.sana = False
+    
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "sana": self.sana,
+            "en_curso": self.en_curso,
+            "peticiones": self.peticiones,
+            "expulsiones": self.expulsiones
+        }
+
+class Backend:
+    """
+    Servicio de destino con su propio cliente HTTP, de modo que la latencia
+    de un servicio no agote las conexiones de los demás. Se configura con
+    variables <PREFIJO>_MAX_CONNECTIONS, _MAX_KEEPALIVE, _KEEPALIVE_EXPIRY,
+    _CONNECT_TIMEOUT, _READ_TIMEOUT, _POOL_TIMEOUT y _HTTP2; _MAX_CONCURRENT
+    limita las peticiones simultáneas antes de rechazar con 429.
+    Las réplicas se eligen con _LB_STRATEGY: least_outstanding (por
+    defecto) o round_robin.
+    """
+    
+    def __init__(self, nombre: str, prefijo: str, urls: str):
+        self.nombre = nombre
+        self.replicas = [Replica(url.strip()) for url in urls.split(",") if url.strip()]
+        self.estrategia = os.getenv(f"{prefijo}_LB_STRATEGY", os.getenv("LB_STRATEGY", "least_outstanding"))
+        self._turno = 0
+        self.max_connections = int(os.getenv(f"{prefijo}_MAX_CONNECTIONS", "50"))
+        self.max_keepalive = int(os.getenv(f"{prefijo}_MAX_KEEPALIVE", "20"))
+        self.keepalive_expiry = float(os.getenv(f"{prefijo}_KEEPALIVE_EXPIRY", "30"))
+        self.connect_timeout = float(os.getenv(f"{prefijo}_CONNECT_TIMEOUT", "5"))
+        self.read_timeout = float(os.getenv(f"{prefijo}_READ_TIMEOUT", "30"))
+        self.pool_timeout = float(os.getenv(f"{prefijo}_POOL_TIMEOUT", "5"))
+        self.http2 = os.getenv(f"{prefijo}_HTTP2", "false").lower() == "true"
+        self.max_concurrent = int(os.getenv(f"{prefijo}_MAX_CONCURRENT", str(self.max_connections)))
+        self.breaker = CircuitBreaker(prefijo)
+        
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry
+            ),
+            timeout=self.timeout(),
+            http2=self.http2
+        )
+        # Peticiones con una conexión tomada (incluye respuestas en streaming)
+        self.en_curso = 0
+        self.pool_timeouts = 0
+        self.rechazos_concurrencia = 0
+    
+    def timeout(self, read: Optional[float] = None) -> httpx.Timeout:
+        """Timeouts del backend, con la lectura opcionalmente ajustada por ruta"""
+        return httpx.Timeout(
+            connect=self.connect_timeout,
+            read=read if read is not None else self.read_timeout,
+            write=self.read_timeout,
+            pool=self.pool_timeout
+        )
+    
+    def elegir_replica(self) -> Replica:
+        """
+        Elige la réplica para la siguiente petición entre las sanas; si todas
+        están expulsadas se usan todas antes que rechazar la petición.
+        """
+        candidatas = [r for r in self.replicas if r.sana] or self.replicas
+        self._turno = (self._turno + 1) % len(candidatas)
+        if self.estrategia == "round_robin":
+            return candidatas[self._turno]
+        # Least-outstanding; la rotación reparte los empates
+        rotadas = candidatas[self._turno:] + candidatas[:self._turno]
+        return min(rotadas, key=lambda r: r.en_curso)
+    
+    def stats(self) -> dict:
+        return {
+            "estrategia": self.estrategia,
+            "replicas": [r.stats() for r in self.replicas],
+            "http2": self.http2,
+            "max_connections": self.max_connections,
+            "max_keepalive": self.max_keepalive,
+            "max_concurrent": self.max_concurrent,
+            "en_curso": self.en_curso,
+            "saturacion": round(self.en_curso / self.max_connections, 4),
+            "pool_timeouts": self.pool_timeouts,
+            "rechazos_concurrencia": self.rechazos_concurrencia,
+            "circuito": self.breaker.stats(),
+            "timeouts": {"connect": self.connect_timeout, "read": self.read_timeout, "pool": self.pool_timeout}
+        }
+
+BACKENDS = {
+    "equipos": Backend("equipos", "EQUIPOS", EQUIPOS_SERVICE_URL),
+    "proveedores": Backend("proveedores", "PROVEEDORES", PROVEEDORES_SERVICE_URL),
+    "mantenimientos": Backend("mantenimientos", "MANTENIMIENTO", MANTENIMIENTO_SERVICE_URL),
+    "reportes": Backend("reportes", "REPORTES", REPORTES_SERVICE_URL),
+    "agentes": Backend("agentes", "AGENT", AGENT_SERVICE_URL),
+}
+
+# Timeout de lectura por prefijo de ruta del gateway (las exportaciones tardan más)
+RUTA_READ_TIMEOUTS = {
+    "/api/reportes/export": float(os.getenv("REPORTES_EXPORT_READ_TIMEOUT", "300")),
+}
+
+def read_timeout_ruta(path: str) -> Optional[float]:
+    for prefijo, timeout in RUTA_READ_TIMEOUTS.items():
+        if path.startswith(prefijo):
+            return timeout
+    return None
+
+# ==================== MÉTRICAS ====================
+
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_duration_seconds",
+    "Latencia de las llamadas a los backends hasta recibir las cabeceras",
+    ["backend", "status"]
+)
+UPSTREAM_IN_PROGRESS = Gauge("upstream_requests_in_progress", "Peticiones en curso hacia cada backend", ["backend"])
+CIRCUIT_STATE = Gauge("circuit_breaker_state", "Estado del circuito (0 closed, 1 half-open, 2 open)", ["backend"])
+REPLICA_UP = Gauge("backend_replica_up", "Réplica sana (1) o expulsada (0)", ["backend", "replica"])
+
+CIRCUIT_STATE_VALUES = {"closed": 0, "half-open": 1, "open": 2}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métricas en formato de exposición de Prometheus"""
+    for nombre, backend in BACKENDS.items():
+        UPSTREAM_IN_PROGRESS.labels(nombre).set(backend.en_curso)
+        CIRCUIT_STATE.labels(nombre).set(CIRCUIT_STATE_VALUES[backend.breaker.estado])
+        for replica in backend.replicas:
+            REPLICA_UP.labels(nombre, replica.url).set(1 if replica.sana else 0)
+    return respuesta_metricas()
+
+# ==================== HEALTH CHECKS DE RÉPLICAS ====================
+
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "10"))
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "2"))
+HEALTH_CHECK_FAILURES = int(os.getenv("HEALTH_CHECK_FAILURES", "2"))
+
+_health_checker: Optional[asyncio.Task] = None
+
+async def verificar_replica(backend: Backend, replica: Replica):
+    """Consulta /health de la réplica y la expulsa o readmite según el resultado"""
+    try:
+        response = await backend.client.get(f"{replica.url}/health", timeout=HEALTH_CHECK_TIMEOUT)
+        ok = response.status_code < 500
+    except httpx.HTTPError:
+        ok = False
+    
+    if ok:
+        replica.fallos_health = 0
+        if not replica.sana:
+            print(f"✅ Réplica readmitida: {replica.url}")
+        replica.sana = True
+    else:
+        replica.fallos_health += 1
+        if replica.sana and replica.fallos_health >= HEALTH_CHECK_FAILURES:
+            print(f"⚠️ Réplica expulsada por health check: {replica.url}")
+            replica.expulsar()
+
+async def health_checker():
+    """Verifica periódicamente todas las réplicas de todos los backends"""
+    while True:
+        await asyncio.gather(*(
+            verificar_replica(backend, replica)
+            for backend in BACKENDS.values()
+            for replica in backend.replicas
+        ))
+        await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+
+@app.on_event("startup")
+async def startup():
+    """Iniciar los health checks de las réplicas y el volcado de trazas"""
+    global _health_checker
+    _health_checker = asyncio.create_task(health_checker())
+    iniciar_trazas()
+
+@app.get("/backends/stats")
+async def get_backends_stats():
+    """Uso y saturación del pool de conexiones de cada backend"""
+    return {nombre: backend.stats() for nombre, backend in BACKENDS.items()}
+
+# ==================== CACHÉ DE RESPUESTAS ====================
+
+class CacheBackend(ABC):
+    """
+    Interfaz de almacenamiento de la caché de respuestas. Las entradas se
+    etiquetan con el recurso al que pertenecen para poder invalidarlas.
+    """
+    
+    @abstractmethod
+    async def get(self, key: str):
+        """Valor de la clave, o None si no existe o expiró"""
+    
+    @abstractmethod
+    async def set(self, key: str, recurso: str, value, ttl: int):
+        """Guarda el valor durante ttl segundos etiquetado con su recurso"""
+    
+    @abstractmethod
+    async def invalidate(self, recurso: str) -> int:
+        """Elimina las entradas del recurso y retorna cuántas había"""
+    
+    @abstractmethod
+    def size(self) -> int:
+        """Número de entradas almacenadas"""
+
+class MemoryLRUCache(CacheBackend):
+    """Caché en memoria con expiración por entrada y desalojo LRU al superar max_entries"""
+    
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (recurso, value, expira)
+    
+    async def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        recurso, value, expira = entry
+        if expira < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+    
+    async def set(self, key: str, recurso: str, value, ttl: int):
+        self._entries[key] = (recurso, value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    async def invalidate(self, recurso: str) -> int:
+        keys = [key for key, (r, _, _) in self._entries.items() if r == recurso]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+    
+    def size(self) -> int:
+        return len(self._entries)
+
+# Backends disponibles; CACHE_BACKEND elige uno
+CACHE_BACKENDS = {
+    "memory": lambda: MemoryLRUCache(int(os.getenv("CACHE_MAX_ENTRIES", "1000"))),
+}
+
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+
+# TTL en segundos por recurso cacheable (configurable con CACHE_TTL_<RECURSO>)
+CACHE_TTLS = {
+    recurso: int(os.getenv(f"CACHE_TTL_{recurso.upper()}", str(ttl)))
+    for recurso, ttl in {
+        "categorias": 300,
+        "ubicaciones": 300,
+        "proveedores": 60,
+        "contratos": 60,
+        "reportes": 30,
+    }.items()
+}
+
+# Recursos cuya caché deja de ser válida tras una escritura en cada recurso
+CACHE_INVALIDACIONES = {
+    "equipos": ["equipos", "reportes"],
+    "movimientos": ["equipos", "reportes"],
+    "proveedores": ["proveedores", "reportes"],
+    "contratos": ["contratos", "proveedores"],
+    "mantenimientos": ["mantenimientos", "reportes"],
+}
+
+cache = CACHE_BACKENDS[os.getenv("CACHE_BACKEND", "memory")]()
+cache_stats = {"hits": 0, "misses": 0, "invalidaciones": 0}
+
+def omite_cache(request: Request) -> bool:
+    """
+    Peticiones que deben llegar al servicio: Cache-Control: no-cache o
+    fresh=true, que en reportes evita las vistas materializadas.
+    """
+    if "no-cache" in request.headers.get("cache-control", ""):
+        return True
+    return request.query_params.get("fresh", "").lower() in ("true", "1")
+
+def cache_key(request: Request) -> str:
+    """Clave de caché: ruta y parámetros de consulta ordenados"""
+    query = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+    return f"{request.url.path}?{query}"
+
+async def invalidar_cache(recurso: str):
+    """Invalida las entradas afectadas por una escritura en el recurso"""
+    for afectado in CACHE_INVALIDACIONES.get(recurso, [recurso]):
+        cache_stats["invalidaciones"] += await cache.invalidate(afectado)
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Contadores de la caché de respuestas y de la coalescencia de peticiones"""
+    total = cache_stats["hits"] + cache_stats["misses"]
+    return {
+        "habilitada": CACHE_ENABLED,
+        "entradas": cache.size(),
+        "hit_ratio": round(cache_stats["hits"] / total, 4) if total else 0,
+        "ttls": CACHE_TTLS,
+        "single_flight": {**single_flight_stats, "en_curso": len(_inflight)},
+        **cache_stats
+    }
+
+# ==================== SINGLE-FLIGHT ====================
+
+# Cabeceras que pueden cambiar la respuesta y por tanto forman parte de la clave
+SINGLE_FLIGHT_HEADERS = ("accept", "authorization")
+
+# Peticiones idénticas en curso: clave -> tarea que consulta al servicio
+_inflight = {}
+single_flight_stats = {"lideres": 0, "coalescidas": 0}
+
+def single_flight_key(request: Request) -> tuple:
+    """Clave de coalescencia: método, ruta, parámetros y cabeceras relevantes"""
+    return (
+        request.method,
+        request.url.path,
+        tuple(sorted(request.query_params.multi_items())),
+        tuple(request.headers.get(h, "") for h in SINGLE_FLIGHT_HEADERS)
+    )
+
+async def single_flight(request: Request, servicio: str, path: str):
+    """
+    Comparte una única llamada al servicio entre todas las peticiones
+    idénticas concurrentes. La llamada corre en su propia tarea para que la
+    desconexión de un cliente no la cancele para los demás.
+    """
+    key = single_flight_key(request)
+    tarea = _inflight.get(key)
+    if tarea is None:
+        single_flight_stats["lideres"] += 1
+        tarea = asyncio.create_task(fetch_completo(request, servicio, path))
+        _inflight[key] = tarea
+        tarea.add_done_callback(lambda _: _inflight.pop(key, None))
+    else:
+        single_flight_stats["coalescidas"] += 1
+    
+    return await asyncio.shield(tarea)
+
+# ==================== COMPRESIÓN Y ETAG ====================
+
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+# Cuerpos a partir de este tamaño se comprimen fuera del event loop
+COMPRESSION_THREAD_BYTES = 64 * 1024
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "application/x-ndjson")
+
+def calcular_etag(body: bytes) -> str:
+    """ETag fuerte calculado sobre los bytes sin comprimir de la respuesta"""
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def etag_coincide(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Compara If-None-Match con el ETag de la representación sin comprimir.
+    Se ignoran el prefijo W/ y el sufijo de codificación (-gzip, -br) que
+    el gateway añade a las variantes comprimidas.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    
+    base = etag.strip('"')
+    for candidato in if_none_match.split(","):
+        candidato = candidato.strip()
+        if candidato.startswith("W/"):
+            candidato = candidato[2:]
+        candidato = candidato.strip('"')
+        for sufijo in ("-gzip", "-br"):
+            if candidato.endswith(sufijo):
+                candidato = candidato[:-len(sufijo)]
+        if candidato == base:
+            return True
+    return False
+
+def negociar_encoding(accept_encoding: str) -> Optional[str]:
+    """Elige br o gzip según Accept-Encoding (se omiten los valores con q=0)"""
+    aceptadas = set()
+    for parte in accept_encoding.lower().split(","):
+        token, _, parametros = parte.strip().partition(";")
+        q = 1.0
+        if parametros.strip().startswith("q="):
+            try:
+                q = float(parametros.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if q > 0:
+            aceptadas.add(token.strip())
+    
+    if brotli is not None and ("br" in aceptadas or "*" in aceptadas):
+        return "br"
+    if "gzip" in aceptadas or "*" in aceptadas:
+        return "gzip"
+    return None
+
+def comprimir_sync(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+async def comprimir(body: bytes, encoding: str) -> bytes:
+    if len(body) >= COMPRESSION_THREAD_BYTES:
+        return await asyncio.to_thread(comprimir_sync, body, encoding)
+    return comprimir_sync(body, encoding)
+
+async def respuesta_completa(request: Request, status_code: int, headers: dict, body: bytes) -> Response:
+    """
+    Construye la respuesta de un cuerpo ya leído: responde 304 si el ETag
+    coincide con If-None-Match y comprime según Accept-Encoding cuando el
+    cuerpo supera COMPRESSION_MIN_BYTES.
+    """
+    headers = dict(headers)
+    etag = headers.get("etag")
+    if not etag:
+        return Response(content=body, status_code=status_code, headers=headers)
+    
+    headers["Vary"] = "Accept-Encoding"
+    if etag_coincide(request.headers.get("if-none-match"), etag):
+        headers.pop("content-type", None)
+        return Response(status_code=304, headers=headers)
+    
+    content_type = headers.get("content-type", "")
+    if (
+        COMPRESSION_ENABLED
+        and len(body) >= COMPRESSION_MIN_BYTES
+        and "content-encoding" not in headers
+        and any(t in content_type for t in COMPRESSIBLE_TYPES)
+    ):
+        encoding = negociar_encoding(request.headers.get("accept-encoding", ""))
+        if encoding:
+            body = await comprimir(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["etag"] = f'{etag[:-1]}-{encoding}"'
+    
+    return Response(content=body, status_code=status_code, headers=headers)
+
+# ==================== PROXY ====================
+
+# Cabeceras propias de cada conexión que un proxy no debe reenviar
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "host"
+}
+
+# Cabeceras de respuesta propias de una petición concreta: no se guardan en
+# la caché ni se comparten entre peticiones coalescidas
+HEADERS_POR_PETICION = {"x-request-id", "x-parent-span-id", "date"}
+
+def filtrar_headers(headers) -> dict:
+    """Copia las cabeceras excluyendo las hop-by-hop"""
+    return {k: v for k, v in headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+
+async def send_upstream(request: Request, servicio: str, path: str, identidad: bool = False):
+    """
+    Envía la petición a una réplica del backend sin leer todavía el cuerpo de
+    la respuesta; retorna (réplica, respuesta).
+    La conexión queda contabilizada como en curso hasta cerrar la respuesta
+    con cerrar_upstream. Si el backend está al límite de concurrencia o su
+    circuito está abierto, rechaza al instante con 429/503 y Retry-After.
+    Con identidad=True se pide el cuerpo sin comprimir, para que el gateway
+    calcule el ETag y negocie la compresión con el cliente.
+    La llamada se registra como span de la traza en curso, cuyo ID se
+    propaga al backend en X-Request-ID y X-Parent-Span-ID.
+    """
+    backend = BACKENDS[servicio]
+    
+    if backend.en_curso >= backend.max_concurrent:
+        backend.rechazos_concurrencia += 1
+        raise HTTPException(
+            status_code=429,
+            detail=f"Servicio de {servicio} saturado: demasiadas peticiones en curso",
+            headers={"Retry-After": "1"}
+        )
+    
+    espera = backend.breaker.permitir()
+    if espera is not None:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Servicio de {servicio} no disponible temporalmente",
+            headers={"Retry-After": str(math.ceil(espera))}
+        )
+    
+    content = None
+    if "content-length" in request.headers or "transfer-encoding" in request.headers:
+        content = request.stream()
+    
+    headers = filtrar_headers(request.headers)
+    if identidad:
+        headers = {k: v for k, v in headers.items() if k.lower() != "accept-encoding"}
+        headers["accept-encoding"] = "identity"
+    
+    traza = traza_actual()
+    span_id = nuevo_span_id()
+    if traza is not None:
+        headers["x-request-id"] = traza[0]
+        headers["x-parent-span-id"] = span_id
+    
+    replica = backend.elegir_replica()
+    inicio_epoch = time.time()
+    inicio = time.perf_counter()
+    
+    def medir(estado: str):
+        duracion = time.perf_counter() - inicio
+        UPSTREAM_LATENCY.labels(servicio, estado).observe(duracion)
+        if traza is not None:
+            registrar_span(
+                traza[0], span_id, traza[1], f"{request.method} {servicio}{path}",
+                inicio_epoch, duracion, kind="client", replica=replica.url, status=estado
+            )
+    
+    backend.en_curso += 1
+    replica.en_curso += 1
+    replica.peticiones += 1
+    try:
+        upstream_request = backend.client.build_request(
+            request.method,
+            f"{replica.url}{path}",
+            params=request.query_params.multi_items(),
+            headers=headers,
+            content=content,
+            timeout=backend.timeout(read_timeout_ruta(request.url.path))
+        )
+        response = await backend.client.send(upstream_request, stream=True)
+    except httpx.PoolTimeout:
+        medir("pool_timeout")
+        liberar_replica(backend, replica)
+        backend.pool_timeouts += 1
+        backend.breaker.liberar()
+        raise HTTPException(
+            status_code=503,
+            detail=f"Servicio de {servicio} saturado: no hay conexiones disponibles",
+            headers={"Retry-After": "1"}
+        )
+    except httpx.RequestError as e:
+        medir("error")
+        liberar_replica(backend, replica)
+        if isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout)):
+            # La réplica no acepta conexiones: fuera del balanceo hasta que
+            # el health check la readmita
+            replica.expulsar()
+        backend.breaker.registrar_fallo()
+        raise HTTPException(status_code=503, detail=f"Error conectando con servicio de {servicio}: {str(e)}")
+    except BaseException:
+        liberar_replica(backend, replica)
+        backend.breaker.liberar()
+        raise
+    
+    medir(str(response.status_code))
+    if response.status_code >= 500:
+        backend.breaker.registrar_fallo()
+    else:
+        backend.breaker.registrar_exito()
+    return replica, response
+
+def liberar_replica(backend: Backend, replica: Replica):
+    backend.en_curso -= 1
+    replica.en_curso -= 1
+
+async def cerrar_upstream(backend: Backend, replica: Replica, response: httpx.Response):
+    """Cierra la respuesta del backend y libera su conexión"""
+    try:
+        await response.aclose()
+    finally:
+        liberar_replica(backend, replica)
+
+async def fetch_completo(request: Request, servicio: str, path: str):
+    """
+    Consulta al backend y lee la respuesta completa; retorna (status, headers, body).
+    Las respuestas 200 llevan un ETag fuerte calculado sobre el cuerpo. Se
+    descartan las cabeceras de HEADERS_POR_PETICION, porque el resultado se
+    cachea o se comparte entre peticiones.
+    """
+    replica, response = await send_upstream(request, servicio, path, identidad=True)
+    try:
+        body = b"".join([chunk async for chunk in response.aiter_raw()])
+    finally:
+        await cerrar_upstream(BACKENDS[servicio], replica, response)
+    headers = {
+        k: v for k, v in filtrar_headers(response.headers).items()
+        if k.lower() != "content-length" and k.lower() not in HEADERS_POR_PETICION
+    }
+    if response.status_code == 200 and "content-encoding" not in headers:
+        headers["etag"] = calcular_etag(body)
+    return response.status_code, headers, body
+
+async def proxy_request(request: Request, servicio: str, path: str, recurso: Optional[str] = None):
+    """
+    Reenvía la petición a la ruta 'path' del backend y devuelve su respuesta
+    en streaming. Los cuerpos de petición y respuesta pasan como bytes sin
+    decodificar; se conservan el código de estado y las cabeceras.
+    Los GET de un recurso se coalescen con las peticiones idénticas en curso
+    y, si el recurso es cacheable, se sirven desde la caché de respuestas;
+    sus respuestas llevan ETag, admiten If-None-Match y se comprimen.
+    Las escrituras exitosas invalidan las entradas afectadas.
+    """
+    if request.method == "GET" and recurso:
+        ttl = CACHE_TTLS.get(recurso) if CACHE_ENABLED else None
+        if ttl and omite_cache(request):
+            ttl = None
+        
+        if ttl:
+            key = cache_key(request)
+            cached = await cache.get(key)
+            if cached is not None:
+                cache_stats["hits"] += 1
+                status_code, headers, body = cached
+                return await respuesta_completa(request, status_code, {**headers, "X-Cache": "HIT"}, body)
+            cache_stats["misses"] += 1
+        
+        status_code, headers, body = await single_flight(request, servicio, path)
+        
+        if ttl:
+            if status_code == 200:
+                await cache.set(key, recurso, (status_code, headers, body), ttl)
+            headers = {**headers, "X-Cache": "MISS"}
+        return await respuesta_completa(request, status_code, headers, body)
+    
+    replica, response = await send_upstream(request, servicio, path)
+    
+    if recurso and request.method != "GET" and response.status_code < 400:
+        await invalidar_cache(recurso)
+    
+    return StreamingResponse(
+        response.aiter_raw(),
+        status_code=response.status_code,
+        headers=filtrar_headers(response.headers),
+        background=BackgroundTask(cerrar_upstream, BACKENDS[servicio], replica, response)
+    )
 
 @app.get("/health")
 async def health_check():
-    """Health check del API Gateway"""
-    return {"status": "healthy", "service": "api-gateway"}
+    """Health check del API Gateway con el estado del circuito de cada backend"""
+    circuitos = {nombre: backend.breaker.stats() for nombre, backend in BACKENDS.items()}
+    degradado = any(c["estado"] != "closed" for c in circuitos.values())
+    return {
+        "status": "degraded" if degradado else "healthy",
+        "service": "api-gateway",
+        "backends": circuitos
+    }
 
 @app.get("/")
 async def root():
@@ -47,6 +786,7 @@ async def root():
             "mantenimientos": "/api/mantenimientos",
             "reportes": "/api/reportes",
             "agents": "/api/agents",
+            "batch": "/api/batch",
             "docs": "/docs"
         }
     }
@@ -57,86 +797,25 @@ async def root():
 @app.api_route("/api/equipos", methods=["GET", "POST"])
 async def proxy_equipos(request: Request, path: Optional[str] = None):
     """Proxy para el servicio de equipos"""
-    url = f"{EQUIPOS_SERVICE_URL}/equipos"
-    if path:
-        url = f"{EQUIPOS_SERVICE_URL}/equipos/{path}"
-    
-    try:
-        params = dict(request.query_params)
-        
-        # Obtener JSON body si existe
-        json_body = None
-        body_content = None
-        content_type = request.headers.get("content-type", "")
-        
-        if request.method in ["POST", "PUT", "PATCH"]:
-            if content_type.startswith("application/json"):
-                try:
-                    json_body = await request.json()
-                except:
-                    body_content = await request.body()
-            else:
-                body_content = await request.body()
-        
-        response = await client.request(
-            method=request.method,
-            url=url,
-            params=params,
-            json=json_body if json_body else None,
-            content=body_content if body_content else None,
-            headers={k: v for k, v in request.headers.items() if k.lower() not in ['host', 'content-length']}
-        )
-        
-        # Manejar errores HTTP
-        if response.status_code >= 400:
-            try:
-                error_data = response.json()
-                return JSONResponse(content=error_data, status_code=response.status_code)
-            except:
-                return JSONResponse(
-                    content={"detail": response.text or "Error del servidor"},
-                    status_code=response.status_code
-                )
-        
-        return JSONResponse(
-            content=response.json() if response.headers.get("content-type", "").startswith("application/json") else {"data": response.text},
-            status_code=response.status_code
-        )
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=503, detail=f"Error conectando con servicio de equipos: {str(e)}")
-    except Exception as e:
-        import traceback
-        print(f"Error en proxy_equipos: {str(e)}")
-        print(traceback.format_exc())
-        raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
+    upstream_path = f"/equipos/{path}" if path else "/equipos"
+    return await proxy_request(request, "equipos", upstream_path, "equipos")
 
 @app.api_route("/api/categorias", methods=["GET"])
 async def proxy_categorias(request: Request):
     """Proxy para categorías de equipos"""
-    try:
-        response = await client.get(f"{EQUIPOS_SERVICE_URL}/categorias")
-        return JSONResponse(content=response.json(), status_code=response.status_code)
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=503, detail=f"Error conectando con servicio de equipos: {str(e)}")
+    return await proxy_request(request, "equipos", "/categorias", "categorias")
 
 @app.api_route("/api/ubicaciones", methods=["GET"])
 async def proxy_ubicaciones(request: Request):
     """Proxy para ubicaciones"""
-    try:
-        response = await client.get(f"{EQUIPOS_SERVICE_URL}/ubicaciones")
-        return JSONResponse(content=response.json(), status_code=response.status_code)
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=503, detail=f"Error conectando con servicio de equipos: {str(e)}")
+    return await proxy_request(request, "equipos", "/ubicaciones", "ubicaciones")
 
+@app.api_route("/api/movimientos/{path:path}", methods=["POST"])
 @app.api_route("/api/movimientos", methods=["POST"])
-async def proxy_movimientos(request: Request):
-    """Proxy para movimientos de equipos"""
-    try:
-        body = await request.json()
-        response = await client.post(f"{EQUIPOS_SERVICE_URL}/movimientos", json=body)
-        return JSONResponse(content=response.json(), status_code=response.status_code)
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=503, detail=f"Error conectando con servicio de equipos: {str(e)}")
+async def proxy_movimientos(request: Request, path: Optional[str] = None):
+    """Proxy para movimientos de equipos (individuales y en bloque)"""
+    upstream_path = f"/movimientos/{path}" if path else "/movimientos"
+    return await proxy_request(request, "equipos", upstream_path, "movimientos")
 
 # ==================== RUTAS DE PROVEEDORES ====================
 
@@ -144,89 +823,13 @@ async def proxy_movimientos(request: Request):
 @app.api_route("/api/proveedores", methods=["GET", "POST"])
 async def proxy_proveedores(request: Request, path: Optional[str] = None):
     """Proxy para el servicio de proveedores"""
-    url = f"{PROVEEDORES_SERVICE_URL}/proveedores"
-    if path:
-        url = f"{PROVEEDORES_SERVICE_URL}/proveedores/{path}"
-    
-    try:
-        params = dict(request.query_params)
-        
-        # Obtener JSON body si existe
-        json_body = None
-        body_content = None
-        content_type = request.headers.get("content-type", "")
-        
-        if request.method in ["POST", "PUT", "PATCH"]:
-            if content_type.startswith("application/json"):
-                try:
-                    json_body = await request.json()
-                except:
-                    body_content = await request.body()
-            else:
-                body_content = await request.body()
-        
-        response = await client.request(
-            method=request.method,
-            url=url,
-            params=params,
-            json=json_body if json_body else None,
-            content=body_content if body_content else None,
-            headers={k: v for k, v in request.headers.items() if k.lower() not in ['host', 'content-length']}
-        )
-        
-        # Manejar errores HTTP
-        if response.status_code >= 400:
-            try:
-                error_data = response.json()
-                return JSONResponse(content=error_data, status_code=response.status_code)
-            except:
-                return JSONResponse(
-                    content={"detail": response.text or "Error del servidor"},
-                    status_code=response.status_code
-                )
-        
-        return JSONResponse(
-            content=response.json() if response.headers.get("content-type", "").startswith("application/json") else {"data": response.text},
-            status_code=response.status_code
-        )
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=503, detail=f"Error conectando con servicio de proveedores: {str(e)}")
-    except Exception as e:
-        import traceback
-        print(f"Error en proxy_proveedores: {str(e)}")
-        print(traceback.format_exc())
-        raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
+    upstream_path = f"/proveedores/{path}" if path else "/proveedores"
+    return await proxy_request(request, "proveedores", upstream_path, "proveedores")
 
 @app.api_route("/api/contratos", methods=["GET", "POST"])
 async def proxy_contratos(request: Request):
     """Proxy para contratos"""
-    try:
-        if request.method == "GET":
-            params = dict(request.query_params)
-            response = await client.get(f"{PROVEEDORES_SERVICE_URL}/contratos", params=params)
-        else:
-            body = await request.json()
-            response = await client.post(f"{PROVEEDORES_SERVICE_URL}/contratos", json=body)
-        
-        # Manejar errores HTTP
-        if response.status_code >= 400:
-            try:
-                error_data = response.json()
-                return JSONResponse(content=error_data, status_code=response.status_code)
-            except:
-                return JSONResponse(
-                    content={"detail": response.text or "Error del servidor"},
-                    status_code=response.status_code
-                )
-        
-        return JSONResponse(content=response.json(), status_code=response.status_code)
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=503, detail=f"Error conectando con servicio de proveedores: {str(e)}")
-    except Exception as e:
-        import traceback
-        print(f"Error en proxy_contratos: {str(e)}")
-        print(traceback.format_exc())
-        raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
+    return await proxy_request(request, "proveedores", "/contratos", "contratos")
 
 # ==================== RUTAS DE MANTENIMIENTOS ====================
 
@@ -234,70 +837,24 @@ async def proxy_contratos(request: Request):
 @app.api_route("/api/mantenimientos", methods=["GET", "POST"])
 async def proxy_mantenimientos(request: Request, path: Optional[str] = None):
     """Proxy para el servicio de mantenimientos"""
-    url = f"{MANTENIMIENTO_SERVICE_URL}/mantenimientos"
-    if path:
-        url = f"{MANTENIMIENTO_SERVICE_URL}/mantenimientos/{path}"
-    
-    try:
-        body = await request.body()
-        params = dict(request.query_params)
-        
-        response = await client.request(
-            method=request.method,
-            url=url,
-            params=params,
-            content=body if body else None,
-            headers=dict(request.headers)
-        )
-        
-        return JSONResponse(
-            content=response.json() if response.headers.get("content-type", "").startswith("application/json") else {"data": response.text},
-            status_code=response.status_code
-        )
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=503, detail=f"Error conectando con servicio de mantenimientos: {str(e)}")
+    upstream_path = f"/mantenimientos/{path}" if path else "/mantenimientos"
+    return await proxy_request(request, "mantenimientos", upstream_path, "mantenimientos")
 
 # ==================== RUTAS DE REPORTES ====================
 
+# Rutas del servicio de reportes que nunca se cachean
+REPORTES_SIN_CACHE = ("export", "metrics", "render-stats", "health")
+
 @app.api_route("/api/reportes/{path:path}", methods=["GET", "POST"])
 @app.api_route("/api/reportes", methods=["GET"])
 async def proxy_reportes(request: Request, path: Optional[str] = None):
-    """Proxy para el servicio de reportes"""
-    from fastapi.responses import StreamingResponse
+    """Proxy para el servicio de reportes (incluye descargas y exportaciones en streaming)"""
+    upstream_path = f"/{path}" if path else ""
     
-    url = f"{REPORTES_SERVICE_URL}"
-    if path:
-        url = f"{REPORTES_SERVICE_URL}/{path}"
-    
-    try:
-        params = dict(request.query_params)
-        
-        if request.method == "POST":
-            body = await request.json()
-            response = await client.post(url, params=params, json=body)
-        else:
-            response = await client.get(url, params=params)
-        
-        # Si es un archivo binario (PDF o Excel), devolver como StreamingResponse
-        content_type = response.headers.get("content-type", "")
-        if "application/pdf" in content_type or "application/vnd.openxmlformats-officedocument" in content_type or "application/vnd.ms-excel" in content_type:
-            headers = {}
-            if "content-disposition" in response.headers:
-                headers["Content-Disposition"] = response.headers["content-disposition"]
-            
-            return StreamingResponse(
-                iter([response.content]),
-                media_type=content_type,
-                headers=headers
-            )
-        
-        # Para respuestas JSON normales
-        return JSONResponse(
-            content=response.json() if content_type.startswith("application/json") else {"data": response.text},
-            status_code=response.status_code
-        )
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=503, detail=f"Error conectando con servicio de reportes: {str(e)}")
+    # Las exportaciones (descargas, trabajos y streaming) y los endpoints
+    # operativos no se cachean
+    recurso = None if path and path.startswith(REPORTES_SIN_CACHE) else "reportes"
+    return await proxy_request(request, "reportes", upstream_path, recurso)
 
 # ==================== RUTAS DE AGENTES ====================
 
@@ -305,33 +862,113 @@ async def proxy_reportes(request: Request, path: Optional[str] = None):
 @app.api_route("/api/agents", methods=["GET", "POST"])
 async def proxy_agents(request: Request, path: Optional[str] = None):
     """Proxy para el servicio de agentes"""
-    url = f"{AGENT_SERVICE_URL}"
-    if path:
-        url = f"{AGENT_SERVICE_URL}/{path}"
+    upstream_path = f"/{path}" if path else ""
+    return await proxy_request(request, "agentes", upstream_path)
+
+# ==================== BATCH ====================
+
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "20"))
+BATCH_METHODS = {"GET", "POST", "PUT", "DELETE"}
+
+class BatchItem(BaseModel):
+    id: Optional[str] = None
+    method: str = "GET"
+    path: str
+    params: Optional[Dict[str, Any]] = None
+    headers: Optional[Dict[str, str]] = None
+    body: Optional[Any] = None
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem]
+
+# Las sub-peticiones se despachan contra la propia aplicación, de modo que
+# pasan por el mismo enrutado, caché, single-flight y circuit breakers
+batch_client = httpx.AsyncClient(
+    transport=httpx.ASGITransport(app=app, raise_app_exceptions=False),
+    base_url="http://api-gateway",
+    headers={"Accept-Encoding": "identity"},
+    timeout=None
+)
+
+def ruta_permitida_en_batch(path: str) -> bool:
+    """
+    Solo rutas /api/ distintas del propio batch. Se comprueba la ruta ya
+    decodificada y normalizada, tal como la enrutará la aplicación: con
+    "/api/../api/batch" se podría anidar un batch dentro de otro.
+    """
+    ruta = unquote(path.split("?", 1)[0])
+    if ".." in ruta or "//" in ruta or "\\" in ruta:
+        return False
+    ruta = posixpath.normpath(ruta)
+    return ruta.startswith("/api/") and ruta != "/api/batch" and not ruta.startswith("/api/batch/")
+
+async def ejecutar_sub_peticion(indice: int, item: BatchItem) -> dict:
+    """Ejecuta una sub-petición del batch y retorna su resultado"""
+    resultado = {"id": item.id if item.id is not None else str(indice)}
+    method = item.method.upper()
+    
+    if method not in BATCH_METHODS:
+        return {**resultado, "status": 405, "body": {"detail": f"Método no permitido: {item.method}"}}
+    if not ruta_permitida_en_batch(item.path):
+        return {**resultado, "status": 400, "body": {"detail": f"Ruta no permitida en batch: {item.path}"}}
+    
+    # Las sub-peticiones continúan la traza del batch
+    headers = dict(item.headers or {})
+    traza = traza_actual()
+    if traza is not None:
+        headers["x-request-id"] = traza[0]
+        headers["x-parent-span-id"] = traza[1]
     
     try:
-        params = dict(request.query_params)
-        
-        if request.method == "POST":
-            response = await client.post(url, params=params)
-        elif request.method == "PUT":
-            response = await client.put(url, params=params)
-        else:
-            response = await client.get(url, params=params)
-        
-        return JSONResponse(
-            content=response.json() if response.headers.get("content-type", "").startswith("application/json") else {"data": response.text},
-            status_code=response.status_code
+        response = await batch_client.request(
+            method,
+            item.path,
+            params=item.params,
+            headers=headers,
+            json=item.body
         )
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=503, detail=f"Error conectando con servicio de agentes: {str(e)}")
+    except Exception as e:
+        return {**resultado, "status": 502, "body": {"detail": str(e)}}
+    
+    body = response.text
+    if "application/json" in response.headers.get("content-type", ""):
+        try:
+            body = response.json()
+        except ValueError:
+            pass
+    return {**resultado, "status": response.status_code, "body": body}
+
+@app.post("/api/batch")
+async def batch(batch_request: BatchRequest):
+    """
+    Ejecuta varias peticiones al gateway de forma concurrente y devuelve todos
+    los resultados en una sola respuesta, cada uno con su propio status.
+    """
+    if not batch_request.requests:
+        raise HTTPException(status_code=400, detail="El batch no contiene peticiones")
+    if len(batch_request.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"El batch admite como máximo {BATCH_MAX_REQUESTS} peticiones"
+        )
+    
+    responses = await asyncio.gather(*(
+        ejecutar_sub_peticion(indice, item)
+        for indice, item in enumerate(batch_request.requests)
+    ))
+    return {"responses": responses}
 
 @app.on_event("shutdown")
 async def shutdown():
-    """Cerrar cliente HTTP al apagar"""
-    await client.aclose()
+    """Detener los health checks, volcar las trazas y cerrar los clientes HTTP al apagar"""
+    if _health_checker:
+        _health_checker.cancel()
+    await detener_trazas()
+    await asyncio.gather(
+        batch_client.aclose(),
+        *(backend.client.aclose() for backend in BACKENDS.values())
+    )
 
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
-
@@ -1,12 +1,22 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Query, Request
+from pydantic import BaseModel, ValidationError
 from typing import Optional, List
 import asyncpg
+import asyncio
 import os
+import time
 from datetime import datetime, date
 import json
+import base64
+import csv
+import io
+from decimal import Decimal
+from observabilidad import instrumentar, acquire_connection, actualizar_metricas_pool, respuesta_metricas, iniciar_trazas, detener_trazas
+from referencias import configurar_referencias, iniciar_referencias, detener_referencias, listar_referencias, obtener_referencia, estado_referencias
+from proyeccion import parsear_campos
 
 app = FastAPI(title="Equipos Service", version="1.0.0")
+instrumentar(app, "equipos-service")
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
@@ -39,15 +49,45 @@ async def startup():
         command_timeout=60,
         timeout=30
     )
+    iniciar_trazas()
+    iniciar_referencias()
 
 @app.on_event("shutdown")
 async def shutdown():
     """Cerrar el pool de conexiones al apagar la aplicación"""
     global _pool
+    await detener_referencias()
+    await detener_trazas()
     if _pool is not None:
         await _pool.close()
         _pool = None
 
+# ==================== MÉTRICAS ====================
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métricas en formato de exposición de Prometheus"""
+    actualizar_metricas_pool(_pool)
+    return respuesta_metricas()
+
+# ==================== DATOS DE REFERENCIA ====================
+
+# Tablas de catálogo en caché (ver referencias.py); el orden es el que devuelven los listados
+CONSULTAS_REFERENCIAS = {
+    "categorias_equipos": "SELECT * FROM categorias_equipos ORDER BY nombre",
+    "ubicaciones": (
+        "SELECT *, edificio || ' - ' || aula_oficina as nombre_completo "
+        "FROM ubicaciones ORDER BY edificio, aula_oficina"
+    ),
+    "proveedores": "SELECT id, razon_social, activo FROM proveedores ORDER BY id",
+}
+configurar_referencias(DATABASE_URL, CONSULTAS_REFERENCIAS)
+
+@app.get("/referencias/stats")
+async def referencias_stats():
+    """Estado de la caché de datos de referencia"""
+    return estado_referencias()
+
 class EquipoCreate(BaseModel):
     codigo_inventario: str
     categoria_id: int
@@ -85,6 +125,68 @@ class MovimientoCreate(BaseModel):
     motivo: str
     observaciones: Optional[str] = None
 
+class MovimientoBatchCreate(BaseModel):
+    equipo_ids: List[int]
+    ubicacion_destino_id: int
+    usuario_responsable_id: int
+    motivo: str
+    observaciones: Optional[str] = None
+
+# Paginación por cursor del listado de equipos
+EQUIPOS_PAGE_SIZE = int(os.getenv("EQUIPOS_PAGE_SIZE", "100"))
+EQUIPOS_MAX_PAGE_SIZE = int(os.getenv("EQUIPOS_MAX_PAGE_SIZE", "1000"))
+
+# Búsqueda de equipos
+EQUIPOS_SEARCH_LIMIT = int(os.getenv("EQUIPOS_SEARCH_LIMIT", "20"))
+EQUIPOS_SEARCH_MAX_LIMIT = int(os.getenv("EQUIPOS_SEARCH_MAX_LIMIT", "100"))
+
+# Proyección de campos (fields=) del listado: nombre expuesto -> expresión SQL.
+# Solo se hace el JOIN de las tablas cuyas columnas se piden.
+COLUMNAS_EQUIPOS = {
+    "id": "e.id",
+    "codigo_inventario": "e.codigo_inventario",
+    "categoria_id": "e.categoria_id",
+    "nombre": "e.nombre",
+    "marca": "e.marca",
+    "modelo": "e.modelo",
+    "numero_serie": "e.numero_serie",
+    "especificaciones": "e.especificaciones",
+    "proveedor_id": "e.proveedor_id",
+    "fecha_compra": "e.fecha_compra",
+    "costo_compra": "e.costo_compra",
+    "fecha_garantia_fin": "e.fecha_garantia_fin",
+    "fecha_fin_vida_util": "e.fecha_fin_vida_util",
+    "ubicacion_actual_id": "e.ubicacion_actual_id",
+    "estado_operativo": "e.estado_operativo",
+    "estado_fisico": "e.estado_fisico",
+    "asignado_a_id": "e.asignado_a_id",
+    "notas": "e.notas",
+    "imagen_url": "e.imagen_url",
+    "fecha_registro": "e.fecha_registro",
+    "fecha_ultima_actualizacion": "e.fecha_ultima_actualizacion",
+    "categoria_nombre": "c.nombre",
+    "ubicacion_nombre": "u.edificio || ' - ' || u.aula_oficina",
+    "proveedor_nombre": "p.razon_social",
+}
+JOINS_EQUIPOS = {
+    "c": "LEFT JOIN categorias_equipos c ON e.categoria_id = c.id",
+    "u": "LEFT JOIN ubicaciones u ON e.ubicacion_actual_id = u.id",
+    "p": "LEFT JOIN proveedores p ON e.proveedor_id = p.id",
+}
+
+def encode_cursor(fecha_registro: datetime, equipo_id: int) -> str:
+    """Codifica la posición (fecha_registro, id) del último equipo devuelto"""
+    raw = json.dumps({"f": fecha_registro.isoformat(), "id": equipo_id})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str):
+    """Decodifica un cursor generado por encode_cursor"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return datetime.fromisoformat(data["f"]), int(data["id"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor de paginación inválido")
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "equipos"}
@@ -93,18 +195,32 @@ async def health_check():
 async def get_equipos(
     categoria: Optional[str] = None,
     estado: Optional[str] = None,
-    ubicacion: Optional[int] = None
+    ubicacion: Optional[int] = None,
+    limit: int = EQUIPOS_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
 ):
+    """
+    Lista equipos paginados por cursor sobre (fecha_registro, id).
+    El cliente pasa el next_cursor recibido para obtener la página siguiente.
+    Con fields=id,codigo_inventario,nombre solo se seleccionan esas columnas.
+    """
     pool = await get_db_pool()
     
-    query = """
-        SELECT e.*, c.nombre as categoria_nombre, 
-               u.edificio || ' - ' || u.aula_oficina as ubicacion_nombre,
-               p.razon_social as proveedor_nombre
+    if limit < 1 or limit > EQUIPOS_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit debe estar entre 1 y {EQUIPOS_MAX_PAGE_SIZE}")
+    
+    campos = parsear_campos(fields, COLUMNAS_EQUIPOS)
+    # El cursor necesita (fecha_registro, id) aunque no se hayan pedido
+    seleccion = campos + [campo for campo in ("fecha_registro", "id") if campo not in campos]
+    alias = {COLUMNAS_EQUIPOS[campo].split(".")[0] for campo in seleccion}
+    if categoria:
+        alias.add("c")
+    
+    query = f"""
+        SELECT {", ".join(f"{COLUMNAS_EQUIPOS[campo]} AS {campo}" for campo in seleccion)}
         FROM equipos e
-        LEFT JOIN categorias_equipos c ON e.categoria_id = c.id
-        LEFT JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
-        LEFT JOIN proveedores p ON e.proveedor_id = p.id
+        {" ".join(join for a, join in JOINS_EQUIPOS.items() if a in alias)}
         WHERE 1=1
     """
     params = []
@@ -125,17 +241,114 @@ async def get_equipos(
         params.append(ubicacion)
         param_count += 1
     
-    query += " ORDER BY e.fecha_registro DESC"
+    if cursor:
+        fecha_cursor, id_cursor = decode_cursor(cursor)
+        query += f" AND (e.fecha_registro, e.id) < (${param_count}, ${param_count + 1})"
+        params.extend([fecha_cursor, id_cursor])
+        param_count += 2
     
-    async with pool.acquire() as conn:
+    # Se pide una fila extra para saber si existe una página siguiente
+    query += f" ORDER BY e.fecha_registro DESC, e.id DESC LIMIT ${param_count}"
+    params.append(limit + 1)
+    
+    async with acquire_connection(pool) as conn:
         rows = await conn.fetch(query, *params)
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['fecha_registro'], rows[-1]['id'])
+        
+        equipos = []
+        for row in rows:
+            equipo = {campo: row[campo] for campo in campos}
+            if equipo.get('especificaciones'):
+                equipo['especificaciones'] = json.loads(equipo['especificaciones'])
+            equipos.append(equipo)
+        
+        return {
+            "items": equipos,
+            "limit": limit,
+            "next_cursor": next_cursor
+        }
+
+@app.get("/equipos/search")
+async def search_equipos(
+    q: str,
+    categoria: Optional[str] = None,
+    estado: Optional[str] = None,
+    limit: int = EQUIPOS_SEARCH_LIMIT
+):
+    """
+    Busca equipos por nombre, marca, modelo, número de serie o código.
+    Combina texto completo (columna busqueda) con similitud por trigramas,
+    que tolera errores de escritura, y devuelve los resultados por relevancia.
+    """
+    pool = await get_db_pool()
+    
+    q = q.strip()
+    if len(q) < 2:
+        raise HTTPException(status_code=400, detail="La búsqueda debe tener al menos 2 caracteres")
+    if limit < 1 or limit > EQUIPOS_SEARCH_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit debe estar entre 1 y {EQUIPOS_SEARCH_MAX_LIMIT}")
+    
+    # Patrón para coincidencias parciales en códigos y números de serie
+    patron = "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    
+    query = """
+        SELECT e.*, c.nombre as categoria_nombre,
+               u.edificio || ' - ' || u.aula_oficina as ubicacion_nombre,
+               p.razon_social as proveedor_nombre,
+               ts_rank_cd(e.busqueda, b.consulta) + GREATEST(
+                   word_similarity($1, e.nombre),
+                   word_similarity($1, coalesce(e.marca, '')),
+                   word_similarity($1, coalesce(e.modelo, '')),
+                   similarity($1, coalesce(e.numero_serie, '')),
+                   similarity($1, e.codigo_inventario)
+               ) as relevancia
+        FROM equipos e
+        CROSS JOIN websearch_to_tsquery('spanish', $1) as b(consulta)
+        LEFT JOIN categorias_equipos c ON e.categoria_id = c.id
+        LEFT JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
+        LEFT JOIN proveedores p ON e.proveedor_id = p.id
+        WHERE (
+            e.busqueda @@ b.consulta
+            OR $1 <% e.nombre
+            OR $1 <% e.marca
+            OR $1 <% e.modelo
+            OR e.numero_serie ILIKE $2
+            OR e.codigo_inventario ILIKE $2
+        )
+    """
+    params = [q, patron]
+    param_count = 3
+    
+    if categoria:
+        query += f" AND c.nombre = ${param_count}"
+        params.append(categoria)
+        param_count += 1
+    
+    if estado:
+        query += f" AND e.estado_operativo = ${param_count}"
+        params.append(estado)
+        param_count += 1
+    
+    query += f" ORDER BY relevancia DESC, e.id DESC LIMIT ${param_count}"
+    params.append(limit)
+    
+    async with acquire_connection(pool) as conn:
+        rows = await conn.fetch(query, *params)
+        
         equipos = []
         for row in rows:
             equipo = dict(row)
+            equipo.pop('busqueda', None)
+            equipo['relevancia'] = round(float(equipo['relevancia']), 4)
             if equipo.get('especificaciones'):
                 equipo['especificaciones'] = json.loads(equipo['especificaciones'])
             equipos.append(equipo)
-        return equipos
+        
+        return {"query": q, "items": equipos, "limit": limit}
 
 @app.get("/equipos/{equipo_id}")
 async def get_equipo(equipo_id: int):
@@ -154,12 +367,13 @@ async def get_equipo(equipo_id: int):
         WHERE e.id = $1
     """
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         row = await conn.fetchrow(query, equipo_id)
         if not row:
             raise HTTPException(status_code=404, detail="Equipo no encontrado")
         
         equipo = dict(row)
+        equipo.pop('busqueda', None)
         if equipo.get('especificaciones'):
             equipo['especificaciones'] = json.loads(equipo['especificaciones'])
         
@@ -196,24 +410,26 @@ async def create_equipo(equipo: EquipoCreate):
     
     especificaciones_json = json.dumps(equipo.especificaciones) if equipo.especificaciones else None
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         try:
             # Validar que la categoría existe si se proporciona
             if equipo.categoria_id:
-                categoria = await conn.fetchval("SELECT id FROM categorias_equipos WHERE id = $1", equipo.categoria_id)
+                categoria = await obtener_referencia(conn, "categorias_equipos", equipo.categoria_id)
                 if not categoria:
                     raise HTTPException(status_code=400, detail=f"La categoría con ID {equipo.categoria_id} no existe")
             
             # Validar que el proveedor existe si se proporciona
             if equipo.proveedor_id:
-                proveedor = await conn.fetchval("SELECT id FROM proveedores WHERE id = $1", equipo.proveedor_id)
+                proveedor = await obtener_referencia(conn, "proveedores", equipo.proveedor_id)
                 if not proveedor:
                     raise HTTPException(status_code=400, detail=f"El proveedor con ID {equipo.proveedor_id} no existe")
             
             # Validar que la ubicación existe si se proporciona
             if equipo.ubicacion_actual_id:
-                ubicacion = await conn.fetchval("SELECT id FROM ubicaciones WHERE id = $1 AND activo = TRUE", equipo.ubicacion_actual_id)
-                if not ubicacion:
+                ubicacion = await obtener_referencia(
+                    conn, "ubicaciones", equipo.ubicacion_actual_id, valida=lambda ubicacion: ubicacion["activo"]
+                )
+                if not ubicacion or not ubicacion["activo"]:
                     raise HTTPException(status_code=400, detail=f"La ubicación con ID {equipo.ubicacion_actual_id} no existe o está inactiva")
             
             equipo_id = await conn.fetchval(
@@ -265,6 +481,261 @@ async def create_equipo(equipo: EquipoCreate):
             print(traceback.format_exc())
             raise HTTPException(status_code=500, detail=f"Error al crear equipo: {error_detail}")
 
+# Importación masiva de equipos
+EQUIPOS_IMPORT_MAX_ROWS = int(os.getenv("EQUIPOS_IMPORT_MAX_ROWS", "50000"))
+
+# Columnas cargadas con COPY, en el orden de los registros
+COLUMNAS_IMPORTACION = [
+    "codigo_inventario", "categoria_id", "nombre", "marca", "modelo", "numero_serie",
+    "especificaciones", "proveedor_id", "fecha_compra", "costo_compra",
+    "fecha_garantia_fin", "ubicacion_actual_id", "estado_operativo", "estado_fisico",
+    "asignado_a_id", "notas", "imagen_url"
+]
+
+# Límites de las columnas de equipos (schema.sql) que EquipoCreate no
+# comprueba; una sola fila que los supere haría fallar el COPY completo
+LONGITUDES_EQUIPOS = {
+    "codigo_inventario": 100, "nombre": 200, "marca": 100, "modelo": 100, "numero_serie": 100,
+    "estado_operativo": 50, "estado_fisico": 50, "imagen_url": 500,
+}
+COLUMNAS_ENTERAS_EQUIPOS = ("categoria_id", "proveedor_id", "ubicacion_actual_id", "asignado_a_id")
+ENTERO_MAXIMO = 2**31 - 1                 # INTEGER
+COSTO_MAXIMO = Decimal("9999999999.99")   # DECIMAL(12,2)
+
+def validar_columnas(equipo: EquipoCreate) -> List[str]:
+    """Errores de longitud, rango y precisión que la base rechazaría al insertar la fila"""
+    errores = []
+    for campo, maximo in LONGITUDES_EQUIPOS.items():
+        valor = getattr(equipo, campo)
+        if valor is not None and len(valor) > maximo:
+            errores.append(f"{campo}: admite como máximo {maximo} caracteres")
+    for campo in COLUMNAS_ENTERAS_EQUIPOS:
+        valor = getattr(equipo, campo)
+        if valor is not None and not -ENTERO_MAXIMO - 1 <= valor <= ENTERO_MAXIMO:
+            errores.append(f"{campo}: fuera de rango")
+    if equipo.costo_compra is not None:
+        costo = Decimal(str(equipo.costo_compra))
+        # La base redondea a 2 decimales antes de comprobar la precisión
+        if not costo.is_finite() or abs(costo) >= COSTO_MAXIMO + Decimal("0.005"):
+            errores.append(f"costo_compra: debe ser un importe finito de hasta {COSTO_MAXIMO}")
+    # PostgreSQL no admite el carácter NUL en texto ni en JSONB
+    textos = [getattr(equipo, campo) for campo in LONGITUDES_EQUIPOS] + [equipo.notas]
+    if equipo.especificaciones:
+        textos.append(json.dumps(equipo.especificaciones))
+    if any(texto and ("\x00" in texto or "\\u0000" in texto) for texto in textos):
+        errores.append("La fila contiene el carácter NUL (\\u0000)")
+    return errores
+
+def error_importacion(fila: int, errores: List[str], codigo_inventario: Optional[str] = None) -> dict:
+    """Entrada del informe de errores; todas tienen la misma forma"""
+    return {"fila": fila, "codigo_inventario": codigo_inventario, "errores": errores}
+
+def parsear_importacion(contenido: str, formato: str):
+    """
+    Parsea y valida las filas de un CSV o NDJSON de equipos.
+    Retorna (equipos válidos como [(fila, EquipoCreate)], errores por fila).
+    Las filas se numeran desde 1 sin contar la cabecera del CSV.
+    """
+    if formato == "csv":
+        filas = csv.DictReader(io.StringIO(contenido))
+    else:
+        filas = (linea for linea in contenido.splitlines() if linea.strip())
+    
+    validos = []
+    errores = []
+    codigos = set()
+    series = set()
+    
+    for fila, datos in enumerate(filas, start=1):
+        if fila > EQUIPOS_IMPORT_MAX_ROWS:
+            raise HTTPException(status_code=413, detail=f"La importación admite como máximo {EQUIPOS_IMPORT_MAX_ROWS} filas")
+        try:
+            if formato == "csv":
+                datos = {k: (v if v != "" else None) for k, v in datos.items() if k}
+                if datos.get("especificaciones"):
+                    datos["especificaciones"] = json.loads(datos["especificaciones"])
+            else:
+                datos = json.loads(datos)
+            equipo = EquipoCreate.model_validate(datos)
+        except ValidationError as e:
+            codigo = datos.get("codigo_inventario") if isinstance(datos, dict) else None
+            errores.append(error_importacion(
+                fila,
+                [f"{'.'.join(str(l) for l in err['loc'])}: {err['msg']}" for err in e.errors()],
+                codigo if isinstance(codigo, str) else None
+            ))
+            continue
+        except (ValueError, TypeError) as e:
+            errores.append(error_importacion(fila, [f"Fila mal formada: {e}"]))
+            continue
+        
+        errores_columnas = validar_columnas(equipo)
+        if errores_columnas:
+            errores.append(error_importacion(fila, errores_columnas, equipo.codigo_inventario))
+            continue
+        
+        # Duplicados dentro del propio fichero
+        duplicados = []
+        if equipo.codigo_inventario in codigos:
+            duplicados.append("codigo_inventario repetido en el fichero")
+        if equipo.numero_serie and equipo.numero_serie in series:
+            duplicados.append("numero_serie repetido en el fichero")
+        if duplicados:
+            errores.append(error_importacion(fila, duplicados, equipo.codigo_inventario))
+            continue
+        
+        codigos.add(equipo.codigo_inventario)
+        if equipo.numero_serie:
+            series.add(equipo.numero_serie)
+        validos.append((fila, equipo))
+    
+    return validos, errores
+
+async def validar_referencias(conn, validos: list) -> dict:
+    """
+    Valida claves foráneas y unicidad de todas las filas con una sola consulta
+    sobre una tabla temporal; retorna {fila: [errores]} de las filas inválidas.
+    """
+    await conn.execute("""
+        CREATE TEMP TABLE import_equipos (
+            fila INTEGER PRIMARY KEY,
+            codigo_inventario VARCHAR(100),
+            numero_serie VARCHAR(100),
+            categoria_id INTEGER,
+            proveedor_id INTEGER,
+            ubicacion_actual_id INTEGER,
+            asignado_a_id INTEGER
+        ) ON COMMIT DROP
+    """)
+    await conn.copy_records_to_table(
+        "import_equipos",
+        records=[
+            (fila, e.codigo_inventario, e.numero_serie, e.categoria_id,
+             e.proveedor_id, e.ubicacion_actual_id, e.asignado_a_id)
+            for fila, e in validos
+        ],
+        columns=["fila", "codigo_inventario", "numero_serie", "categoria_id",
+                 "proveedor_id", "ubicacion_actual_id", "asignado_a_id"]
+    )
+    
+    rows = await conn.fetch("""
+        SELECT i.fila,
+               c.id IS NULL AS categoria_invalida,
+               i.proveedor_id IS NOT NULL AND p.id IS NULL AS proveedor_invalido,
+               i.ubicacion_actual_id IS NOT NULL AND u.id IS NULL AS ubicacion_invalida,
+               i.asignado_a_id IS NOT NULL AND us.id IS NULL AS usuario_invalido,
+               ec.id IS NOT NULL AS codigo_existente,
+               es.id IS NOT NULL AS serie_existente
+        FROM import_equipos i
+        LEFT JOIN categorias_equipos c ON c.id = i.categoria_id
+        LEFT JOIN proveedores p ON p.id = i.proveedor_id
+        LEFT JOIN ubicaciones u ON u.id = i.ubicacion_actual_id AND u.activo = TRUE
+        LEFT JOIN usuarios us ON us.id = i.asignado_a_id
+        LEFT JOIN equipos ec ON ec.codigo_inventario = i.codigo_inventario
+        LEFT JOIN equipos es ON es.numero_serie = i.numero_serie
+        WHERE c.id IS NULL
+           OR (i.proveedor_id IS NOT NULL AND p.id IS NULL)
+           OR (i.ubicacion_actual_id IS NOT NULL AND u.id IS NULL)
+           OR (i.asignado_a_id IS NOT NULL AND us.id IS NULL)
+           OR ec.id IS NOT NULL
+           OR es.id IS NOT NULL
+    """)
+    
+    mensajes = {
+        "categoria_invalida": "La categoría no existe",
+        "proveedor_invalido": "El proveedor no existe",
+        "ubicacion_invalida": "La ubicación no existe o está inactiva",
+        "usuario_invalido": "El usuario asignado no existe",
+        "codigo_existente": "El código de inventario ya está registrado",
+        "serie_existente": "El número de serie ya está registrado",
+    }
+    return {
+        row["fila"]: [mensaje for campo, mensaje in mensajes.items() if row[campo]]
+        for row in rows
+    }
+
+@app.post("/equipos/import")
+async def import_equipos(
+    request: Request,
+    formato: Optional[str] = Query(None, alias="format"),
+    solo_validar: bool = False
+):
+    """
+    Importa equipos en bloque desde CSV (con cabecera) o NDJSON.
+    Valida todas las filas en bloque, carga las válidas con COPY en una única
+    transacción y devuelve el informe de errores por fila. Con
+    solo_validar=true no inserta nada.
+    """
+    pool = await get_db_pool()
+    inicio = time.perf_counter()
+    
+    if formato is None:
+        content_type = request.headers.get("content-type", "")
+        formato = "ndjson" if "ndjson" in content_type or "json" in content_type else "csv"
+    if formato not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Formato no soportado. Use 'csv' o 'ndjson'")
+    
+    try:
+        contenido = (await request.body()).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="El fichero debe estar codificado en UTF-8")
+    
+    # El parseo y la validación de filas es CPU; se hace fuera del event loop
+    validos, errores = await asyncio.to_thread(parsear_importacion, contenido, formato)
+    total = len(validos) + len(errores)
+    insertados = 0
+    
+    if validos:
+        async with acquire_connection(pool) as conn:
+            try:
+                async with conn.transaction():
+                    errores_bd = await validar_referencias(conn, validos)
+                    codigos = {fila: e.codigo_inventario for fila, e in validos}
+                    for fila, mensajes in errores_bd.items():
+                        errores.append(error_importacion(fila, mensajes, codigos[fila]))
+                    validos = [(fila, e) for fila, e in validos if fila not in errores_bd]
+                    
+                    if validos and not solo_validar:
+                        await conn.copy_records_to_table(
+                            "equipos",
+                            records=[
+                                (
+                                    e.codigo_inventario, e.categoria_id, e.nombre, e.marca, e.modelo,
+                                    e.numero_serie,
+                                    json.dumps(e.especificaciones) if e.especificaciones else None,
+                                    e.proveedor_id, e.fecha_compra,
+                                    Decimal(str(e.costo_compra)) if e.costo_compra is not None else None,
+                                    e.fecha_garantia_fin, e.ubicacion_actual_id, e.estado_operativo,
+                                    e.estado_fisico, e.asignado_a_id, e.notas, e.imagen_url
+                                )
+                                for _, e in validos
+                            ],
+                            columns=COLUMNAS_IMPORTACION
+                        )
+                        insertados = len(validos)
+            except asyncpg.UniqueViolationError as e:
+                # Otro proceso registró uno de los códigos durante la importación
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Conflicto con equipos registrados durante la importación; no se insertó ninguna fila: {e}"
+                )
+            except Exception as e:
+                import traceback
+                print(f"Error al importar equipos: {e}")
+                print(traceback.format_exc())
+                raise HTTPException(status_code=500, detail=f"Error al importar equipos: {str(e)}")
+    
+    errores.sort(key=lambda err: err["fila"])
+    return {
+        "total": total,
+        "validos": len(validos),
+        "insertados": insertados,
+        "rechazados": len(errores),
+        "errores": errores,
+        "solo_validar": solo_validar,
+        "duracion_ms": round((time.perf_counter() - inicio) * 1000, 2)
+    }
+
 @app.put("/equipos/{equipo_id}")
 async def update_equipo(equipo_id: int, equipo: EquipoUpdate):
     pool = await get_db_pool()
@@ -324,7 +795,7 @@ async def update_equipo(equipo_id: int, equipo: EquipoUpdate):
     params.append(equipo_id)
     query = f"UPDATE equipos SET {', '.join(updates)} WHERE id = ${param_count}"
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         result = await conn.execute(query, *params)
         if result == "UPDATE 0":
             raise HTTPException(status_code=404, detail="Equipo no encontrado")
@@ -335,65 +806,116 @@ async def update_equipo(equipo_id: int, equipo: EquipoUpdate):
 async def delete_equipo(equipo_id: int):
     pool = await get_db_pool()
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         result = await conn.execute("DELETE FROM equipos WHERE id = $1", equipo_id)
         if result == "DELETE 0":
             raise HTTPException(status_code=404, detail="Equipo no encontrado")
         
         return {"message": "Equipo eliminado exitosamente"}
 
+# Máximo de equipos por movimiento en bloque
+MOVIMIENTOS_BATCH_MAX = int(os.getenv("MOVIMIENTOS_BATCH_MAX", "1000"))
+
+async def registrar_movimientos(conn, equipo_ids: List[int], ubicacion_destino_id: int,
+                                usuario_responsable_id: int, motivo: str, observaciones: Optional[str]):
+    """
+    Mueve los equipos a la ubicación destino en una única transacción:
+    registra el historial con INSERT ... SELECT y actualiza la ubicación con
+    UPDATE ... FROM. Retorna [(movimiento_id, equipo_id)].
+    """
+    try:
+        async with conn.transaction():
+            # Bloquear los equipos en orden de id evita interbloqueos entre lotes
+            bloqueados = await conn.fetch(
+                "SELECT id FROM equipos WHERE id = ANY($1::int[]) ORDER BY id FOR UPDATE",
+                equipo_ids
+            )
+            encontrados = {row["id"] for row in bloqueados}
+            faltantes = [equipo_id for equipo_id in equipo_ids if equipo_id not in encontrados]
+            if faltantes:
+                raise HTTPException(status_code=404, detail=f"Equipos no encontrados: {faltantes}")
+            
+            movimientos = await conn.fetch("""
+                INSERT INTO movimientos_equipos
+                (equipo_id, ubicacion_origen_id, ubicacion_destino_id, usuario_responsable_id, motivo, observaciones)
+                SELECT e.id, e.ubicacion_actual_id, $2, $3, $4, $5
+                FROM equipos e
+                WHERE e.id = ANY($1::int[])
+                ORDER BY e.id
+                RETURNING id, equipo_id
+            """, equipo_ids, ubicacion_destino_id, usuario_responsable_id, motivo, observaciones)
+            
+            await conn.execute("""
+                UPDATE equipos e
+                SET ubicacion_actual_id = $2
+                FROM unnest($1::int[]) AS m(equipo_id)
+                WHERE e.id = m.equipo_id
+            """, equipo_ids, ubicacion_destino_id)
+            
+            return [(row["id"], row["equipo_id"]) for row in movimientos]
+    except asyncpg.ForeignKeyViolationError as e:
+        error_msg = str(e)
+        if "ubicacion_destino_id" in error_msg.lower():
+            raise HTTPException(status_code=400, detail=f"La ubicación con ID {ubicacion_destino_id} no existe")
+        elif "usuario_responsable_id" in error_msg.lower():
+            raise HTTPException(status_code=400, detail=f"El usuario con ID {usuario_responsable_id} no existe")
+        raise HTTPException(status_code=400, detail=f"Error de referencia: {error_msg}")
+
 @app.post("/movimientos")
 async def create_movimiento(movimiento: MovimientoCreate):
     pool = await get_db_pool()
     
-    async with pool.acquire() as conn:
-        ubicacion_origen = await conn.fetchval(
-            "SELECT ubicacion_actual_id FROM equipos WHERE id = $1",
-            movimiento.equipo_id
-        )
-        
-        await conn.execute(
-            """
-            INSERT INTO movimientos_equipos 
-            (equipo_id, ubicacion_origen_id, ubicacion_destino_id, usuario_responsable_id, motivo, observaciones)
-            VALUES ($1, $2, $3, $4, $5, $6)
-            """,
-            movimiento.equipo_id,
-            ubicacion_origen,
+    async with acquire_connection(pool) as conn:
+        movimientos = await registrar_movimientos(
+            conn,
+            [movimiento.equipo_id],
             movimiento.ubicacion_destino_id,
             movimiento.usuario_responsable_id,
             movimiento.motivo,
             movimiento.observaciones
         )
         
-        await conn.execute(
-            "UPDATE equipos SET ubicacion_actual_id = $1 WHERE id = $2",
-            movimiento.ubicacion_destino_id,
-            movimiento.equipo_id
+        return {"id": movimientos[0][0], "message": "Movimiento registrado exitosamente"}
+
+@app.post("/movimientos/batch")
+async def create_movimientos_batch(batch: MovimientoBatchCreate):
+    """Mueve varios equipos a la misma ubicación; o se mueven todos o ninguno"""
+    pool = await get_db_pool()
+    
+    # Se descartan ids repetidos conservando el orden
+    equipo_ids = list(dict.fromkeys(batch.equipo_ids))
+    if not equipo_ids:
+        raise HTTPException(status_code=400, detail="Debe indicar al menos un equipo")
+    if len(equipo_ids) > MOVIMIENTOS_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"Se admiten como máximo {MOVIMIENTOS_BATCH_MAX} equipos por lote")
+    
+    async with acquire_connection(pool) as conn:
+        movimientos = await registrar_movimientos(
+            conn,
+            equipo_ids,
+            batch.ubicacion_destino_id,
+            batch.usuario_responsable_id,
+            batch.motivo,
+            batch.observaciones
         )
         
-        return {"message": "Movimiento registrado exitosamente"}
+        return {
+            "movidos": len(movimientos),
+            "equipo_ids": [equipo_id for _, equipo_id in movimientos],
+            "movimiento_ids": [movimiento_id for movimiento_id, _ in movimientos],
+            "message": "Movimientos registrados exitosamente"
+        }
 
 @app.get("/categorias")
 async def get_categorias():
     pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM categorias_equipos ORDER BY nombre")
-        return [dict(row) for row in rows]
+    return await listar_referencias(pool, "categorias_equipos")
 
 @app.get("/ubicaciones")
 async def get_ubicaciones():
     pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(
-            """
-            SELECT *, edificio || ' - ' || aula_oficina as nombre_completo 
-            FROM ubicaciones 
-            WHERE activo = TRUE 
-            ORDER BY edificio, aula_oficina
-            """
-        )
-        return [dict(row) for row in rows]
+    ubicaciones = await listar_referencias(pool, "ubicaciones")
+    return [ubicacion for ubicacion in ubicaciones if ubicacion["activo"]]
 
 if __name__ == "__main__":
     import uvicorn
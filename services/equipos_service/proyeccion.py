@@ -0,0 +1,22 @@
+"""
+Proyección de campos (fields=) de los listados.
+
+Este archivo es la única fuente: scripts/sincronizar_compartidos.py lo copia
+como services/<servicio>/proyeccion.py. No editar las copias.
+"""
+from typing import List, Optional
+
+from fastapi import HTTPException
+
+def parsear_campos(fields: Optional[str], columnas: dict) -> List[str]:
+    """Campos pedidos en fields= (separados por comas), validados contra la lista blanca"""
+    if not fields:
+        return list(columnas)
+    campos = list(dict.fromkeys(campo.strip() for campo in fields.split(",") if campo.strip()))
+    desconocidos = [campo for campo in campos if campo not in columnas]
+    if not campos or desconocidos:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Campos no permitidos: {', '.join(desconocidos) or fields}. Disponibles: {', '.join(columnas)}"
+        )
+    return campos
@@ -0,0 +1,144 @@
+"""
+Caché en memoria de datos de referencia invalidada con LISTEN/NOTIFY.
+
+Copia de tablas de catálogo pequeñas que casi nunca cambian. Se carga al
+arrancar y cada tabla se recarga al recibir el NOTIFY que emiten los
+triggers de schema.sql, de modo que todas las réplicas se invalidan a la vez.
+
+Este archivo es la única fuente: scripts/sincronizar_compartidos.py lo copia
+como services/<servicio>/referencias.py. No editar las copias.
+
+Uso desde main.py:
+
+    configurar_referencias(DATABASE_URL, {"proveedores": "SELECT ... ORDER BY id"})
+    # startup: iniciar_referencias()    shutdown: await detener_referencias()
+"""
+import asyncio
+import os
+from typing import Callable, Optional
+
+import asyncpg
+
+from observabilidad import acquire_connection
+
+CANAL_REFERENCIAS = "datos_referencia"
+REFERENCIAS_ENABLED = os.getenv("REFERENCIAS_ENABLED", "true").lower() == "true"
+# Cada cuánto se comprueba que la conexión de escucha sigue viva (segundos)
+REFERENCIAS_KEEPALIVE = float(os.getenv("REFERENCIAS_KEEPALIVE", "30"))
+REFERENCIAS_RECONNECT_DELAY = float(os.getenv("REFERENCIAS_RECONNECT_DELAY", "5"))
+
+# Los fija configurar_referencias(): URL de la base y consulta de carga de
+# cada tabla (el orden es el que devuelven los listados)
+DATABASE_URL = None
+CONSULTAS_REFERENCIAS = {}
+
+_referencias = {}                    # tabla -> {id: fila}
+_referencias_activas = False         # False si la escucha cayó: se lee de la base
+_recargas_pendientes = set()
+_evento_recarga = asyncio.Event()
+_referencias_task: Optional[asyncio.Task] = None
+_referencias_stats = {"recargas": 0, "notificaciones": 0, "reconexiones": 0, "aciertos": 0, "fallos": 0}
+
+def configurar_referencias(database_url: str, consultas: dict):
+    """Fija la base de datos y las tablas de referencia del servicio"""
+    global DATABASE_URL, CONSULTAS_REFERENCIAS
+    DATABASE_URL = database_url
+    CONSULTAS_REFERENCIAS = dict(consultas)
+
+def al_notificar(conn, pid, canal, tabla):
+    if tabla in CONSULTAS_REFERENCIAS:
+        _referencias_stats["notificaciones"] += 1
+        _recargas_pendientes.add(tabla)
+        _evento_recarga.set()
+
+async def procesar_recargas(conn):
+    """Recarga las tablas pendientes; se ejecuta en una sola tarea, sin carreras entre recargas."""
+    while _recargas_pendientes:
+        tabla = _recargas_pendientes.pop()
+        rows = await conn.fetch(CONSULTAS_REFERENCIAS[tabla])
+        _referencias[tabla] = {row["id"]: dict(row) for row in rows}
+        _referencias_stats["recargas"] += 1
+
+async def escuchar_referencias():
+    """Mantiene una conexión dedicada con LISTEN y reconecta si se pierde."""
+    global _referencias_activas
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(DATABASE_URL)
+            conn.add_termination_listener(lambda c: _evento_recarga.set())
+            await conn.add_listener(CANAL_REFERENCIAS, al_notificar)
+            # Carga completa: mientras no se escuchaba pudieron perderse notificaciones
+            _recargas_pendientes.update(CONSULTAS_REFERENCIAS)
+            await procesar_recargas(conn)
+            _referencias_activas = True
+            while True:
+                try:
+                    await asyncio.wait_for(_evento_recarga.wait(), REFERENCIAS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    await conn.fetchval("SELECT 1")
+                    continue
+                _evento_recarga.clear()
+                if conn.is_closed():
+                    raise ConnectionError("conexión de escucha cerrada")
+                await procesar_recargas(conn)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Escucha de datos de referencia interrumpida: {e}")
+        finally:
+            _referencias_activas = False
+            if conn is not None and not conn.is_closed():
+                conn.terminate()
+        _referencias_stats["reconexiones"] += 1
+        await asyncio.sleep(REFERENCIAS_RECONNECT_DELAY)
+
+def iniciar_referencias():
+    global _referencias_task
+    if REFERENCIAS_ENABLED:
+        _referencias_task = asyncio.create_task(escuchar_referencias())
+
+async def detener_referencias():
+    if _referencias_task:
+        _referencias_task.cancel()
+        try:
+            await _referencias_task
+        except asyncio.CancelledError:
+            pass
+
+async def listar_referencias(pool, tabla: str) -> list:
+    """Filas de una tabla de referencia en el orden de su consulta; lee la base si la caché no está al día."""
+    if _referencias_activas and tabla in _referencias:
+        _referencias_stats["aciertos"] += 1
+        return list(_referencias[tabla].values())
+    _referencias_stats["fallos"] += 1
+    async with acquire_connection(pool) as conn:
+        rows = await conn.fetch(CONSULTAS_REFERENCIAS[tabla])
+    return [dict(row) for row in rows]
+
+async def obtener_referencia(conn, tabla: str, ref_id: int,
+                             valida: Optional[Callable[[dict], bool]] = None) -> Optional[dict]:
+    """
+    Fila de referencia por id. Solo se responde desde la caché si la fila
+    existe y cumple 'valida'; si no, se confirma contra la base, porque la
+    fila puede ser nueva o haber cambiado y su notificación no haberse
+    procesado aún. El llamador vuelve a validar la fila devuelta.
+    """
+    if _referencias_activas and tabla in _referencias:
+        fila = _referencias[tabla].get(ref_id)
+        if fila is not None and (valida is None or valida(fila)):
+            _referencias_stats["aciertos"] += 1
+            return fila
+    _referencias_stats["fallos"] += 1
+    row = await conn.fetchrow(
+        f"SELECT * FROM ({CONSULTAS_REFERENCIAS[tabla]}) AS r WHERE id = $1", ref_id
+    )
+    return dict(row) if row else None
+
+def estado_referencias() -> dict:
+    """Estado de la caché de datos de referencia"""
+    return {
+        "activa": _referencias_activas,
+        "tablas": {tabla: len(filas) for tabla, filas in _referencias.items()},
+        **_referencias_stats
+    }
@@ -5,8 +5,12 @@ import asyncpg
 import os
 from datetime import datetime, date
 import json
+from observabilidad import instrumentar, acquire_connection, actualizar_metricas_pool, respuesta_metricas, iniciar_trazas, detener_trazas
+from referencias import configurar_referencias, iniciar_referencias, detener_referencias, obtener_referencia, estado_referencias
+from proyeccion import parsear_campos
 
 app = FastAPI(title="Mantenimiento Service", version="1.0.0")
+instrumentar(app, "mantenimiento-service")
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
@@ -39,15 +43,41 @@ async def startup():
         command_timeout=60,
         timeout=30
     )
+    iniciar_trazas()
+    iniciar_referencias()
 
 @app.on_event("shutdown")
 async def shutdown():
     """Cerrar el pool de conexiones al apagar la aplicación"""
     global _pool
+    await detener_referencias()
+    await detener_trazas()
     if _pool is not None:
         await _pool.close()
         _pool = None
 
+# ==================== MÉTRICAS ====================
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métricas en formato de exposición de Prometheus"""
+    actualizar_metricas_pool(_pool)
+    return respuesta_metricas()
+
+# ==================== DATOS DE REFERENCIA ====================
+
+# Tablas de catálogo en caché (ver referencias.py); el orden es el que devuelven los listados
+CONSULTAS_REFERENCIAS = {
+    "usuarios": "SELECT id, nombre_completo, rol, activo FROM usuarios ORDER BY id",
+    "proveedores": "SELECT id, razon_social, activo FROM proveedores ORDER BY id",
+}
+configurar_referencias(DATABASE_URL, CONSULTAS_REFERENCIAS)
+
+@app.get("/referencias/stats")
+async def referencias_stats():
+    """Estado de la caché de datos de referencia"""
+    return estado_referencias()
+
 class MantenimientoCreate(BaseModel):
     equipo_id: int
     tipo: str  # 'preventivo' o 'correctivo'
@@ -78,26 +108,57 @@ class MantenimientoUpdate(BaseModel):
 async def health_check():
     return {"status": "healthy", "service": "mantenimientos"}
 
+# Proyección de campos (fields=) del listado: nombre expuesto -> expresión SQL.
+# Solo se hace el JOIN de las tablas cuyas columnas se piden.
+COLUMNAS_MANTENIMIENTOS = {
+    "id": "m.id",
+    "equipo_id": "m.equipo_id",
+    "tipo": "m.tipo",
+    "fecha_programada": "m.fecha_programada",
+    "fecha_realizada": "m.fecha_realizada",
+    "tecnico_id": "m.tecnico_id",
+    "proveedor_id": "m.proveedor_id",
+    "descripcion": "m.descripcion",
+    "problema_reportado": "m.problema_reportado",
+    "solucion_aplicada": "m.solucion_aplicada",
+    "costo": "m.costo",
+    "tiempo_fuera_servicio_horas": "m.tiempo_fuera_servicio_horas",
+    "estado": "m.estado",
+    "prioridad": "m.prioridad",
+    "partes_reemplazadas": "m.partes_reemplazadas",
+    "observaciones": "m.observaciones",
+    "fecha_creacion": "m.fecha_creacion",
+    "codigo_inventario": "e.codigo_inventario",
+    "equipo_nombre": "e.nombre",
+    "tecnico_nombre": "u.nombre_completo",
+    "proveedor_nombre": "p.razon_social",
+}
+# equipo_id es NOT NULL con FK, así que omitir el JOIN con equipos no cambia las filas
+JOINS_MANTENIMIENTOS = {
+    "e": "JOIN equipos e ON m.equipo_id = e.id",
+    "u": "LEFT JOIN usuarios u ON m.tecnico_id = u.id",
+    "p": "LEFT JOIN proveedores p ON m.proveedor_id = p.id",
+}
+
 @app.get("/mantenimientos")
 async def get_mantenimientos(
     equipo_id: Optional[int] = None,
     estado: Optional[str] = None,
     tipo: Optional[str] = None,
     fecha_desde: Optional[date] = None,
-    fecha_hasta: Optional[date] = None
+    fecha_hasta: Optional[date] = None,
+    fields: Optional[str] = None
 ):
-    """Obtiene lista de mantenimientos con filtros opcionales"""
+    """Obtiene lista de mantenimientos con filtros opcionales y proyección fields="""
     pool = await get_db_pool()
     
-    query = """
-        SELECT m.*, 
-               e.codigo_inventario, e.nombre as equipo_nombre,
-               u.nombre_completo as tecnico_nombre,
-               p.razon_social as proveedor_nombre
+    campos = parsear_campos(fields, COLUMNAS_MANTENIMIENTOS)
+    alias = {COLUMNAS_MANTENIMIENTOS[campo].split(".")[0] for campo in campos}
+    
+    query = f"""
+        SELECT {", ".join(f"{COLUMNAS_MANTENIMIENTOS[campo]} AS {campo}" for campo in campos)}
         FROM mantenimientos m
-        JOIN equipos e ON m.equipo_id = e.id
-        LEFT JOIN usuarios u ON m.tecnico_id = u.id
-        LEFT JOIN proveedores p ON m.proveedor_id = p.id
+        {" ".join(join for a, join in JOINS_MANTENIMIENTOS.items() if a in alias)}
         WHERE 1=1
     """
     params = []
@@ -130,7 +191,7 @@ async def get_mantenimientos(
     
     query += " ORDER BY m.fecha_programada DESC"
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         rows = await conn.fetch(query, *params)
         mantenimientos = []
         for row in rows:
@@ -157,7 +218,7 @@ async def get_mantenimiento(mantenimiento_id: int):
         WHERE m.id = $1
     """
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         row = await conn.fetchrow(query, mantenimiento_id)
         if not row:
             raise HTTPException(status_code=404, detail="Mantenimiento no encontrado")
@@ -189,7 +250,7 @@ async def create_mantenimiento(mantenimiento: MantenimientoCreate):
     else:
         estado_equipo = None
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         try:
             # Validar que el equipo existe
             equipo = await conn.fetchval("SELECT id FROM equipos WHERE id = $1", mantenimiento.equipo_id)
@@ -198,13 +259,15 @@ async def create_mantenimiento(mantenimiento: MantenimientoCreate):
             
             # Validar técnico si se proporciona
             if mantenimiento.tecnico_id:
-                tecnico = await conn.fetchval("SELECT id FROM usuarios WHERE id = $1 AND rol = 'tecnico'", mantenimiento.tecnico_id)
-                if not tecnico:
+                tecnico = await obtener_referencia(
+                    conn, "usuarios", mantenimiento.tecnico_id, valida=lambda usuario: usuario["rol"] == "tecnico"
+                )
+                if not tecnico or tecnico["rol"] != "tecnico":
                     raise HTTPException(status_code=400, detail=f"El técnico con ID {mantenimiento.tecnico_id} no existe")
             
             # Validar proveedor si se proporciona
             if mantenimiento.proveedor_id:
-                proveedor = await conn.fetchval("SELECT id FROM proveedores WHERE id = $1", mantenimiento.proveedor_id)
+                proveedor = await obtener_referencia(conn, "proveedores", mantenimiento.proveedor_id)
                 if not proveedor:
                     raise HTTPException(status_code=400, detail=f"El proveedor con ID {mantenimiento.proveedor_id} no existe")
             
@@ -330,7 +393,7 @@ async def update_mantenimiento(mantenimiento_id: int, mantenimiento: Mantenimien
     params.append(mantenimiento_id)
     query = f"UPDATE mantenimientos SET {', '.join(updates)} WHERE id = ${param_count}"
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         # Obtener información del mantenimiento antes de actualizar
         mant_actual = await conn.fetchrow("SELECT equipo_id, estado, tipo FROM mantenimientos WHERE id = $1", mantenimiento_id)
         if not mant_actual:
@@ -352,7 +415,7 @@ async def delete_mantenimiento(mantenimiento_id: int):
     """Elimina un mantenimiento"""
     pool = await get_db_pool()
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         result = await conn.execute("DELETE FROM mantenimientos WHERE id = $1", mantenimiento_id)
         if result == "DELETE 0":
             raise HTTPException(status_code=404, detail="Mantenimiento no encontrado")
@@ -384,7 +447,7 @@ async def get_calendario_mantenimientos(
         ORDER BY m.fecha_programada, m.prioridad DESC
     """
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         rows = await conn.fetch(query, mes, año)
         return [dict(row) for row in rows]
 
@@ -393,7 +456,7 @@ async def get_estadisticas_mantenimientos():
     """Obtiene estadísticas de mantenimientos"""
     pool = await get_db_pool()
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         stats = {}
         
         # Total de mantenimientos
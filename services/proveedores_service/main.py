@@ -4,8 +4,10 @@ from typing import Optional
 import asyncpg
 import os
 from datetime import date
+from observabilidad import instrumentar, acquire_connection, actualizar_metricas_pool, respuesta_metricas, iniciar_trazas, detener_trazas
 
 app = FastAPI(title="Proveedores Service", version="1.0.0")
+instrumentar(app, "proveedores-service")
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
@@ -38,15 +40,25 @@ async def startup():
         command_timeout=60,
         timeout=30
     )
+    iniciar_trazas()
 
 @app.on_event("shutdown")
 async def shutdown():
     """Cerrar el pool de conexiones al apagar la aplicación"""
     global _pool
+    await detener_trazas()
     if _pool is not None:
         await _pool.close()
         _pool = None
 
+# ==================== MÉTRICAS ====================
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métricas en formato de exposición de Prometheus"""
+    actualizar_metricas_pool(_pool)
+    return respuesta_metricas()
+
 class ProveedorCreate(BaseModel):
     razon_social: str
     ruc: str
@@ -96,7 +108,7 @@ async def get_proveedores(activo: Optional[bool] = None):
     
     query += " ORDER BY razon_social"
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         rows = await conn.fetch(query, *params)
         return [dict(row) for row in rows]
 
@@ -104,7 +116,7 @@ async def get_proveedores(activo: Optional[bool] = None):
 async def get_proveedor(proveedor_id: int):
     pool = await get_db_pool()
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         proveedor = await conn.fetchrow(
             "SELECT * FROM proveedores WHERE id = $1",
             proveedor_id
@@ -154,7 +166,7 @@ async def create_proveedor(proveedor: ProveedorCreate):
         RETURNING id
     """
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         try:
             proveedor_id = await conn.fetchval(
                 query,
@@ -197,7 +209,7 @@ async def update_proveedor(proveedor_id: int, proveedor: ProveedorUpdate):
     params.append(proveedor_id)
     query = f"UPDATE proveedores SET {', '.join(updates)} WHERE id = ${param_count}"
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         result = await conn.execute(query, *params)
         if result == "UPDATE 0":
             raise HTTPException(status_code=404, detail="Proveedor no encontrado")
@@ -221,7 +233,7 @@ async def get_contratos(proveedor_id: Optional[int] = None):
     
     query += " ORDER BY c.fecha_inicio DESC"
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         rows = await conn.fetch(query, *params)
         return [dict(row) for row in rows]
 
@@ -239,7 +251,7 @@ async def create_contrato(contrato: ContratoCreate):
     
     estado = "vigente" if contrato.fecha_fin >= date.today() else "vencido"
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         try:
             # Validar que el proveedor existe
             proveedor = await conn.fetchval("SELECT id FROM proveedores WHERE id = $1", contrato.proveedor_id)
@@ -1,5 +1,5 @@
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, FileResponse
 from typing import Optional
 import asyncpg
 import os
@@ -11,11 +11,26 @@ from reportlab.lib.units import inch
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet
 import io
+import time
+import asyncio
+import uuid
+import csv
+import json
+import re
+import socket
+from decimal import Decimal
+from concurrent.futures import ProcessPoolExecutor
+from prometheus_client import Gauge
+from observabilidad import instrumentar, acquire_connection, actualizar_metricas_pool, respuesta_metricas, iniciar_trazas, detener_trazas
 
 app = FastAPI(title="Reportes Service", version="1.0.0")
+instrumentar(app, "reportes-service")
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# En modo debug el dashboard incluye los tiempos de cada sección
+DEBUG = os.getenv("DEBUG", "false").lower() == "true"
+
 # Pool de conexiones global
 _pool = None
 
@@ -36,7 +51,7 @@ async def get_db_pool():
 
 @app.on_event("startup")
 async def startup():
-    """Inicializar el pool de conexiones al iniciar la aplicación"""
+    """Inicializar el pool de conexiones, el renderizado y los workers de exportación al iniciar la aplicación"""
     global _pool
     _pool = await asyncpg.create_pool(
         DATABASE_URL,
@@ -45,60 +60,91 @@ async def startup():
         command_timeout=60,
         timeout=30
     )
+    iniciar_renderizado()
+    await iniciar_exportaciones()
+    iniciar_trazas()
 
 @app.on_event("shutdown")
 async def shutdown():
-    """Cerrar el pool de conexiones al apagar la aplicación"""
+    """Detener exportaciones y renderizado y cerrar el pool de conexiones al apagar la aplicación"""
     global _pool
+    await detener_trazas()
+    await detener_exportaciones()
+    detener_renderizado()
     if _pool is not None:
         await _pool.close()
         _pool = None
 
+# ==================== MÉTRICAS ====================
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métricas en formato de exposición de Prometheus"""
+    actualizar_metricas_pool(_pool)
+    if _pool is not None:
+        EXPORT_JOBS_QUEUED.set(await contar_pendientes())
+    return respuesta_metricas()
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "reportes"}
 
+async def fetch_seccion(pool, query: str, *args):
+    """Ejecuta una consulta en su propia conexión del pool y mide su duración"""
+    inicio = time.perf_counter()
+    async with acquire_connection(pool) as conn:
+        row = await conn.fetchrow(query, *args)
+    return row, round((time.perf_counter() - inicio) * 1000, 2)
+
 @app.get("/dashboard")
 async def get_dashboard():
     try:
         pool = await get_db_pool()
+        inicio = time.perf_counter()
         
-        async with pool.acquire() as conn:
-            total_equipos = await conn.fetchval("SELECT COUNT(*) FROM equipos")
-            
-            equipos_operativos = await conn.fetchval(
-                "SELECT COUNT(*) FROM equipos WHERE estado_operativo = 'operativo'"
-            )
-            
-            equipos_reparacion = await conn.fetchval(
-                "SELECT COUNT(*) FROM equipos WHERE estado_operativo = 'en_reparacion'"
-            )
-            
-            valor_inventario = await conn.fetchval(
-                "SELECT COALESCE(SUM(costo_compra), 0) FROM equipos"
-            )
-            
-            mantenimientos_mes = await conn.fetchval("""
-                SELECT COUNT(*) FROM mantenimientos
-                WHERE EXTRACT(MONTH FROM fecha_programada) = EXTRACT(MONTH FROM CURRENT_DATE)
-                AND EXTRACT(YEAR FROM fecha_programada) = EXTRACT(YEAR FROM CURRENT_DATE)
+        # Las secciones son independientes: se consultan en paralelo
+        (equipos, t_equipos), (mant, t_mant), (costo, t_costo) = await asyncio.gather(
+            fetch_seccion(pool, """
+                SELECT COUNT(*) as total,
+                       COUNT(*) FILTER (WHERE estado_operativo = 'operativo') as operativos,
+                       COUNT(*) FILTER (WHERE estado_operativo = 'en_reparacion') as en_reparacion,
+                       COALESCE(SUM(costo_compra), 0) as valor_inventario
+                FROM equipos
+            """),
+            fetch_seccion(pool, """
+                SELECT COUNT(*) as cantidad FROM mantenimientos
+                WHERE fecha_programada >= date_trunc('month', CURRENT_DATE)::date
+                AND fecha_programada < (date_trunc('month', CURRENT_DATE) + INTERVAL '1 month')::date
+            """),
+            fetch_seccion(pool, """
+                SELECT COALESCE(SUM(costo), 0) as total FROM mantenimientos
+                WHERE fecha_realizada >= date_trunc('month', CURRENT_DATE)::date
+                AND fecha_realizada < (date_trunc('month', CURRENT_DATE) + INTERVAL '1 month')::date
             """)
-            
-            costo_mantenimiento_mes = await conn.fetchval("""
-                SELECT COALESCE(SUM(costo), 0) FROM mantenimientos
-                WHERE EXTRACT(MONTH FROM fecha_realizada) = EXTRACT(MONTH FROM CURRENT_DATE)
-                AND EXTRACT(YEAR FROM fecha_realizada) = EXTRACT(YEAR FROM CURRENT_DATE)
-            """)
-            
-            return {
-                "total_equipos": total_equipos,
-                "equipos_operativos": equipos_operativos,
-                "equipos_reparacion": equipos_reparacion,
-                "tasa_disponibilidad": round((equipos_operativos / total_equipos * 100) if total_equipos > 0 else 0, 2),
-                "valor_inventario": float(valor_inventario),
-                "mantenimientos_mes": mantenimientos_mes,
-                "costo_mantenimiento_mes": float(costo_mantenimiento_mes)
+        )
+        
+        total_equipos = equipos['total']
+        equipos_operativos = equipos['operativos']
+        
+        dashboard = {
+            "total_equipos": total_equipos,
+            "equipos_operativos": equipos_operativos,
+            "equipos_reparacion": equipos['en_reparacion'],
+            "tasa_disponibilidad": round((equipos_operativos / total_equipos * 100) if total_equipos > 0 else 0, 2),
+            "valor_inventario": float(equipos['valor_inventario']),
+            "mantenimientos_mes": mant['cantidad'],
+            "costo_mantenimiento_mes": float(costo['total'])
+        }
+        
+        if DEBUG:
+            dashboard["tiempos_ms"] = {
+                "equipos": t_equipos,
+                "mantenimientos_mes": t_mant,
+                "costo_mantenimiento_mes": t_costo,
+                "total": round((time.perf_counter() - inicio) * 1000, 2)
             }
+        
+        return dashboard
     except Exception as e:
         import traceback
         print(f"Error en dashboard: {str(e)}")
@@ -106,213 +152,427 @@ async def get_dashboard():
         raise HTTPException(status_code=500, detail=f"Error al obtener dashboard: {str(e)}")
 
 @app.get("/equipos-por-ubicacion")
-async def get_equipos_por_ubicacion():
+async def get_equipos_por_ubicacion(fresh: bool = False):
     pool = await get_db_pool()
     
-    query = """
-        SELECT u.edificio || ' - ' || u.aula_oficina as ubicacion,
-               COUNT(*) as cantidad
-        FROM equipos e
-        JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
-        GROUP BY u.id, u.edificio, u.aula_oficina
-        ORDER BY cantidad DESC
-    """
+    if fresh:
+        query = """
+            SELECT u.edificio || ' - ' || u.aula_oficina as ubicacion,
+                   COUNT(*) as cantidad
+            FROM equipos e
+            JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
+            GROUP BY u.id, u.edificio, u.aula_oficina
+            ORDER BY cantidad DESC
+        """
+    else:
+        query = "SELECT ubicacion, cantidad FROM mv_equipos_por_ubicacion ORDER BY cantidad DESC"
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         rows = await conn.fetch(query)
         return [dict(row) for row in rows]
 
 @app.get("/equipos-por-estado")
-async def get_equipos_por_estado():
+async def get_equipos_por_estado(fresh: bool = False):
     pool = await get_db_pool()
     
-    query = """
-        SELECT estado_operativo as estado, COUNT(*) as cantidad
-        FROM equipos
-        GROUP BY estado_operativo
-        ORDER BY cantidad DESC
-    """
+    if fresh:
+        query = """
+            SELECT estado_operativo as estado, COUNT(*) as cantidad
+            FROM equipos
+            GROUP BY estado_operativo
+            ORDER BY cantidad DESC
+        """
+    else:
+        query = "SELECT estado, cantidad FROM mv_equipos_por_estado ORDER BY cantidad DESC"
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         rows = await conn.fetch(query)
         return [dict(row) for row in rows]
 
 @app.get("/equipos-por-categoria")
-async def get_equipos_por_categoria():
+async def get_equipos_por_categoria(fresh: bool = False):
     pool = await get_db_pool()
     
-    query = """
-        SELECT c.nombre as categoria, COUNT(*) as cantidad,
-               COALESCE(SUM(e.costo_compra), 0) as valor_total
-        FROM equipos e
-        JOIN categorias_equipos c ON e.categoria_id = c.id
-        GROUP BY c.nombre
-        ORDER BY cantidad DESC
-    """
+    if fresh:
+        query = """
+            SELECT c.nombre as categoria, COUNT(*) as cantidad,
+                   COALESCE(SUM(e.costo_compra), 0) as valor_total
+            FROM equipos e
+            JOIN categorias_equipos c ON e.categoria_id = c.id
+            GROUP BY c.nombre
+            ORDER BY cantidad DESC
+        """
+    else:
+        query = "SELECT categoria, cantidad, valor_total FROM mv_equipos_por_categoria ORDER BY cantidad DESC"
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         rows = await conn.fetch(query)
         return [dict(row) for row in rows]
 
 @app.get("/equipos-antiguedad")
-async def get_equipos_antiguedad():
+async def get_equipos_antiguedad(fresh: bool = False):
     pool = await get_db_pool()
     
-    query = """
-        SELECT 
-            CASE 
-                WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) < 1 THEN 'Menos de 1 año'
-                WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) BETWEEN 1 AND 2 THEN '1-2 años'
-                WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) BETWEEN 3 AND 4 THEN '3-4 años'
-                WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) BETWEEN 5 AND 6 THEN '5-6 años'
-                ELSE 'Más de 6 años'
-            END as rango_antiguedad,
-            COUNT(*) as cantidad
-        FROM equipos
-        WHERE fecha_compra IS NOT NULL
-        GROUP BY rango_antiguedad
-        ORDER BY 
-            CASE rango_antiguedad
-                WHEN 'Menos de 1 año' THEN 1
-                WHEN '1-2 años' THEN 2
-                WHEN '3-4 años' THEN 3
-                WHEN '5-6 años' THEN 4
-                ELSE 5
-            END
-    """
+    if fresh:
+        query = """
+            SELECT 
+                CASE 
+                    WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) < 1 THEN 'Menos de 1 año'
+                    WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) BETWEEN 1 AND 2 THEN '1-2 años'
+                    WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) BETWEEN 3 AND 4 THEN '3-4 años'
+                    WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) BETWEEN 5 AND 6 THEN '5-6 años'
+                    ELSE 'Más de 6 años'
+                END as rango_antiguedad,
+                COUNT(*) as cantidad
+            FROM equipos
+            WHERE fecha_compra IS NOT NULL
+            GROUP BY rango_antiguedad
+            ORDER BY 
+                CASE rango_antiguedad
+                    WHEN 'Menos de 1 año' THEN 1
+                    WHEN '1-2 años' THEN 2
+                    WHEN '3-4 años' THEN 3
+                    WHEN '5-6 años' THEN 4
+                    ELSE 5
+                END
+        """
+    else:
+        query = "SELECT rango_antiguedad, cantidad FROM mv_equipos_antiguedad ORDER BY orden"
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         rows = await conn.fetch(query)
         return [dict(row) for row in rows]
 
 @app.get("/costos-mantenimiento")
-async def get_costos_mantenimiento(year: Optional[int] = None):
+async def get_costos_mantenimiento(year: Optional[int] = None, fresh: bool = False):
     pool = await get_db_pool()
     
     if not year:
         year = datetime.now().year
     
-    query = """
-        SELECT 
-            TO_CHAR(fecha_realizada, 'Month') as mes,
-            EXTRACT(MONTH FROM fecha_realizada) as mes_num,
-            tipo,
-            SUM(costo) as total_costo,
-            COUNT(*) as cantidad
-        FROM mantenimientos
-        WHERE EXTRACT(YEAR FROM fecha_realizada) = $1
-        AND fecha_realizada IS NOT NULL
-        GROUP BY mes, mes_num, tipo
-        ORDER BY mes_num, tipo
-    """
+    if fresh:
+        query = """
+            SELECT 
+                TO_CHAR(fecha_realizada, 'Month') as mes,
+                EXTRACT(MONTH FROM fecha_realizada) as mes_num,
+                tipo,
+                SUM(costo) as total_costo,
+                COUNT(*) as cantidad
+            FROM mantenimientos
+            WHERE EXTRACT(YEAR FROM fecha_realizada) = $1
+            AND fecha_realizada IS NOT NULL
+            GROUP BY mes, mes_num, tipo
+            ORDER BY mes_num, tipo
+        """
+    else:
+        query = """
+            SELECT mes, mes_num, tipo, total_costo, cantidad
+            FROM mv_costos_mantenimiento
+            WHERE anio = $1
+            ORDER BY mes_num, tipo
+        """
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         rows = await conn.fetch(query, year)
         return [dict(row) for row in rows]
 
 @app.get("/mantenimientos-por-prioridad")
-async def get_mantenimientos_por_prioridad():
+async def get_mantenimientos_por_prioridad(fresh: bool = False):
     pool = await get_db_pool()
     
-    query = """
-        SELECT prioridad, COUNT(*) as cantidad
-        FROM mantenimientos
-        WHERE estado IN ('programado', 'en_proceso')
-        GROUP BY prioridad
-        ORDER BY 
-            CASE prioridad
-                WHEN 'urgente' THEN 1
-                WHEN 'alta' THEN 2
-                WHEN 'media' THEN 3
-                WHEN 'baja' THEN 4
-            END
-    """
+    if fresh:
+        query = """
+            SELECT prioridad, COUNT(*) as cantidad
+            FROM mantenimientos
+            WHERE estado IN ('programado', 'en_proceso')
+            GROUP BY prioridad
+            ORDER BY 
+                CASE prioridad
+                    WHEN 'urgente' THEN 1
+                    WHEN 'alta' THEN 2
+                    WHEN 'media' THEN 3
+                    WHEN 'baja' THEN 4
+                END
+        """
+    else:
+        query = "SELECT prioridad, cantidad FROM mv_mantenimientos_por_prioridad ORDER BY orden"
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         rows = await conn.fetch(query)
         return [dict(row) for row in rows]
 
 @app.get("/equipos-garantia")
-async def get_equipos_garantia():
+async def get_equipos_garantia(fresh: bool = False):
     pool = await get_db_pool()
     
-    query = """
-        SELECT 
-            CASE 
-                WHEN fecha_garantia_fin >= CURRENT_DATE THEN 'En garantía'
-                WHEN fecha_garantia_fin < CURRENT_DATE THEN 'Fuera de garantía'
-                ELSE 'Sin información'
-            END as estado_garantia,
-            COUNT(*) as cantidad
-        FROM equipos
-        GROUP BY estado_garantia
-    """
+    if fresh:
+        query = """
+            SELECT 
+                CASE 
+                    WHEN fecha_garantia_fin >= CURRENT_DATE THEN 'En garantía'
+                    WHEN fecha_garantia_fin < CURRENT_DATE THEN 'Fuera de garantía'
+                    ELSE 'Sin información'
+                END as estado_garantia,
+                COUNT(*) as cantidad
+            FROM equipos
+            GROUP BY estado_garantia
+        """
+    else:
+        query = "SELECT estado_garantia, cantidad FROM mv_equipos_garantia"
     
-    async with pool.acquire() as conn:
+    async with acquire_connection(pool) as conn:
         rows = await conn.fetch(query)
         return [dict(row) for row in rows]
 
+# ==================== EXPORTACIÓN ====================
+
+TIPOS_REPORTE = ("equipos", "mantenimientos", "proveedores")
+
+EXCEL_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+def consulta_excel(report_type: str) -> str:
+    """Consulta con el detalle completo de un reporte Excel"""
+    if report_type == "equipos":
+        return """
+            SELECT e.codigo_inventario, e.nombre, e.marca, e.modelo,
+                   c.nombre as categoria, e.estado_operativo,
+                   u.edificio || ' - ' || u.aula_oficina as ubicacion,
+                   e.fecha_compra, e.costo_compra
+            FROM equipos e
+            LEFT JOIN categorias_equipos c ON e.categoria_id = c.id
+            LEFT JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
+            ORDER BY e.codigo_inventario
+        """
+    elif report_type == "mantenimientos":
+        return """
+            SELECT m.id, m.tipo, m.fecha_programada, m.fecha_realizada,
+                   e.codigo_inventario, e.nombre as equipo,
+                   m.estado, m.costo, m.descripcion
+            FROM mantenimientos m
+            JOIN equipos e ON m.equipo_id = e.id
+            ORDER BY m.fecha_programada DESC
+        """
+    elif report_type == "proveedores":
+        # Subconsultas por proveedor: unir contratos y equipos a la vez multiplicaría las sumas
+        return """
+            SELECT p.id, p.razon_social as nombre, p.contacto_nombre as contacto, p.email, p.telefono,
+                   (SELECT COUNT(*) FROM contratos c WHERE c.proveedor_id = p.id) as total_contratos,
+                   (SELECT COALESCE(SUM(e.costo_compra), 0) FROM equipos e WHERE e.proveedor_id = p.id) as total_comprado
+            FROM proveedores p
+            ORDER BY p.razon_social
+        """
+    raise HTTPException(status_code=400, detail="Tipo de reporte no válido")
+
+def consulta_pdf(report_type: str):
+    """Consulta y encabezados de la tabla de un reporte PDF"""
+    if report_type == "equipos":
+        query = """
+            SELECT e.codigo_inventario, e.nombre, c.nombre as categoria, 
+                   e.estado_operativo, u.edificio || ' - ' || u.aula_oficina as ubicacion
+            FROM equipos e
+            LEFT JOIN categorias_equipos c ON e.categoria_id = c.id
+            LEFT JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
+            ORDER BY e.codigo_inventario
+            LIMIT 50
+        """
+        headers = ['Código', 'Nombre', 'Categoría', 'Estado', 'Ubicación']
+    elif report_type == "mantenimientos":
+        query = """
+            SELECT m.id, m.tipo, m.fecha_programada, m.fecha_realizada,
+                   e.codigo_inventario, m.estado, m.costo
+            FROM mantenimientos m
+            JOIN equipos e ON m.equipo_id = e.id
+            ORDER BY m.fecha_programada DESC
+            LIMIT 50
+        """
+        headers = ['ID', 'Tipo', 'Fecha Prog.', 'Fecha Real.', 'Equipo', 'Estado', 'Costo']
+    elif report_type == "proveedores":
+        query = """
+            SELECT p.id, p.razon_social, p.contacto_nombre, p.email, p.telefono,
+                   (SELECT COUNT(*) FROM contratos c WHERE c.proveedor_id = p.id) as total_contratos
+            FROM proveedores p
+            ORDER BY p.razon_social
+            LIMIT 50
+        """
+        headers = ['ID', 'Nombre', 'Contacto', 'Email', 'Teléfono', 'Contratos']
+    else:
+        raise HTTPException(status_code=400, detail="Tipo de reporte no válido")
+    return query, headers
+
+def renderizar_excel(registros: list) -> bytes:
+    """Genera un libro Excel en memoria a partir de una lista de diccionarios"""
+    df = pd.DataFrame(registros)
+    
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name='Reporte')
+    
+    # IMPORTANTE: No hacer seek después de cerrar el writer
+    return output.getvalue()
+
+def renderizar_pdf(report_type: str, headers: list, filas: list) -> bytes:
+    """Genera un PDF en memoria con una tabla de encabezados y filas"""
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+    elements = []
+    styles = getSampleStyleSheet()
+    
+    title = Paragraph(f"<b>Reporte de {report_type.capitalize()}</b>", styles['Title'])
+    elements.append(title)
+    elements.append(Spacer(1, 12))
+    
+    date_str = Paragraph(f"Fecha: {datetime.now().strftime('%d/%m/%Y %H:%M')}", styles['Normal'])
+    elements.append(date_str)
+    elements.append(Spacer(1, 20))
+    
+    table = Table([headers] + filas)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    elements.append(table)
+    
+    doc.build(elements)
+    
+    # IMPORTANTE: Obtener el contenido del buffer antes de crear un nuevo BytesIO
+    return buffer.getvalue()
+
+# Renderizado de reportes en procesos separados para no bloquear el event loop
+
+def cpus_disponibles(cgroup: str = "/sys/fs/cgroup") -> int:
+    """
+    CPUs que puede usar el contenedor. os.cpu_count() devuelve las del host,
+    así que se aplica la cuota de cgroups (v2 cpu.max o v1 cfs_quota_us) y la
+    afinidad del proceso.
+    """
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    try:
+        with open(os.path.join(cgroup, "cpu.max")) as f:
+            cuota, periodo = f.read().split()[:2]
+    except (OSError, ValueError):
+        try:
+            with open(os.path.join(cgroup, "cpu", "cpu.cfs_quota_us")) as f:
+                cuota = f.read().strip()
+            with open(os.path.join(cgroup, "cpu", "cpu.cfs_period_us")) as f:
+                periodo = f.read().strip()
+        except OSError:
+            return cpus
+    if cuota not in ("max", "-1"):
+        cpus = min(cpus, max(1, int(cuota) // int(periodo)))
+    return cpus
+
+# Por defecto las CPUs del contenedor, con un máximo de RENDER_MAX_PROCESSES_DEFAULT
+RENDER_MAX_PROCESSES_DEFAULT = 4
+RENDER_PROCESSES = int(os.getenv("RENDER_PROCESSES", str(min(cpus_disponibles(), RENDER_MAX_PROCESSES_DEFAULT))))
+RENDER_MAX_CONCURRENCY = int(os.getenv("RENDER_MAX_CONCURRENCY", str(RENDER_PROCESSES)))
+
+_render_executor = None
+_render_semaforo = None
+# Renderizados esperando turno y en ejecución
+_render_en_cola = 0
+_render_en_curso = 0
+
+RENDER_QUEUE_DEPTH = Gauge("render_queue_depth", "Renderizados PDF/Excel esperando un proceso libre")
+RENDER_IN_PROGRESS = Gauge("render_in_progress", "Renderizados PDF/Excel en ejecución")
+EXPORT_JOBS_QUEUED = Gauge("export_jobs_queued", "Trabajos de exportación en cola sin empezar")
+
+def iniciar_renderizado():
+    """Crea el pool de procesos de renderizado"""
+    global _render_executor, _render_semaforo
+    _render_executor = ProcessPoolExecutor(max_workers=RENDER_PROCESSES)
+    _render_semaforo = asyncio.Semaphore(RENDER_MAX_CONCURRENCY)
+
+def detener_renderizado():
+    """Apaga el pool de procesos de renderizado"""
+    global _render_executor
+    if _render_executor is not None:
+        _render_executor.shutdown(wait=False, cancel_futures=True)
+        _render_executor = None
+
+async def renderizar(funcion, *args) -> bytes:
+    """Ejecuta una función de renderizado en el pool de procesos respetando el límite de concurrencia"""
+    global _render_en_cola, _render_en_curso
+    _render_en_cola += 1
+    RENDER_QUEUE_DEPTH.inc()
+    try:
+        await _render_semaforo.acquire()
+    finally:
+        _render_en_cola -= 1
+        RENDER_QUEUE_DEPTH.dec()
+    
+    _render_en_curso += 1
+    RENDER_IN_PROGRESS.inc()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_render_executor, funcion, *args)
+    finally:
+        _render_en_curso -= 1
+        RENDER_IN_PROGRESS.dec()
+        _render_semaforo.release()
+
+@app.get("/render-stats")
+async def get_render_stats():
+    """Estado del pool de renderizado y de la cola de trabajos de exportación"""
+    return {
+        "procesos": RENDER_PROCESSES,
+        "max_concurrencia": RENDER_MAX_CONCURRENCY,
+        "en_curso": _render_en_curso,
+        "en_cola": _render_en_cola,
+        "trabajos_en_cola": await contar_pendientes()
+    }
+
+async def generar_excel(report_type: str, job_id: str = None) -> bytes:
+    """Consulta los datos y genera el Excel; actualiza el progreso del trabajo si se indica"""
+    query = consulta_excel(report_type)
+    pool = await get_db_pool()
+    
+    async with acquire_connection(pool) as conn:
+        rows = await conn.fetch(query)
+    registros = [dict(row) for row in rows]
+    
+    if job_id is not None:
+        await actualizar_progreso(job_id, 50)
+    
+    return await renderizar(renderizar_excel, registros)
+
+async def generar_pdf(report_type: str, job_id: str = None) -> bytes:
+    """Consulta los datos y genera el PDF; actualiza el progreso del trabajo si se indica"""
+    query, headers = consulta_pdf(report_type)
+    pool = await get_db_pool()
+    
+    async with acquire_connection(pool) as conn:
+        rows = await conn.fetch(query)
+    filas = [[str(val)[:30] if val else '' for val in row] for row in rows]
+    
+    if job_id is not None:
+        await actualizar_progreso(job_id, 50)
+    
+    return await renderizar(renderizar_pdf, report_type, headers, filas)
+
 @app.post("/export/excel")
 async def export_excel(report_data: dict):
     report_type = report_data.get("type", "equipos")
-    pool = await get_db_pool()
     
     try:
-        if report_type == "equipos":
-            query = """
-                SELECT e.codigo_inventario, e.nombre, e.marca, e.modelo,
-                       c.nombre as categoria, e.estado_operativo,
-                       u.edificio || ' - ' || u.aula_oficina as ubicacion,
-                       e.fecha_compra, e.costo_compra
-                FROM equipos e
-                LEFT JOIN categorias_equipos c ON e.categoria_id = c.id
-                LEFT JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
-                ORDER BY e.codigo_inventario
-            """
-        elif report_type == "mantenimientos":
-            query = """
-                SELECT m.id, m.tipo, m.fecha_programada, m.fecha_realizada,
-                       e.codigo_inventario, e.nombre as equipo,
-                       m.estado, m.costo, m.descripcion
-                FROM mantenimientos m
-                JOIN equipos e ON m.equipo_id = e.id
-                ORDER BY m.fecha_programada DESC
-            """
-        elif report_type == "proveedores":
-            query = """
-                SELECT p.id, p.nombre, p.contacto, p.email, p.telefono,
-                       COUNT(DISTINCT c.id) as total_contratos,
-                       COALESCE(SUM(e.costo_compra), 0) as total_comprado
-                FROM proveedores p
-                LEFT JOIN contratos c ON p.id = c.proveedor_id
-                LEFT JOIN equipos e ON c.id = e.contrato_id
-                GROUP BY p.id, p.nombre, p.contacto, p.email, p.telefono
-                ORDER BY p.nombre
-            """
-        else:
-            raise HTTPException(status_code=400, detail="Tipo de reporte no válido")
+        excel_data = await generar_excel(report_type)
         
-        async with pool.acquire() as conn:
-            rows = await conn.fetch(query)
-            df = pd.DataFrame([dict(row) for row in rows])
-            
-            # Generar Excel en memoria
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False, sheet_name='Reporte')
-            
-            # IMPORTANTE: No hacer seek después de cerrar el writer
-            excel_data = output.getvalue()
-            
-            # Nombre del archivo para descarga
-            filename = f"{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-            
-            return StreamingResponse(
-                io.BytesIO(excel_data),
-                media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
-            )
+        # Nombre del archivo para descarga
+        filename = f"{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        
+        return StreamingResponse(
+            io.BytesIO(excel_data),
+            media_type=EXCEL_MEDIA_TYPE,
+            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        )
     
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         print(f"Error al exportar Excel: {str(e)}")
@@ -322,83 +582,9 @@ async def export_excel(report_data: dict):
 @app.post("/export/pdf")
 async def export_pdf(report_data: dict):
     report_type = report_data.get("type", "equipos")
-    pool = await get_db_pool()
     
     try:
-        # Crear PDF en memoria
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4)
-        elements = []
-        styles = getSampleStyleSheet()
-        
-        title = Paragraph(f"<b>Reporte de {report_type.capitalize()}</b>", styles['Title'])
-        elements.append(title)
-        elements.append(Spacer(1, 12))
-        
-        date_str = Paragraph(f"Fecha: {datetime.now().strftime('%d/%m/%Y %H:%M')}", styles['Normal'])
-        elements.append(date_str)
-        elements.append(Spacer(1, 20))
-        
-        if report_type == "equipos":
-            query = """
-                SELECT e.codigo_inventario, e.nombre, c.nombre as categoria, 
-                       e.estado_operativo, u.edificio || ' - ' || u.aula_oficina as ubicacion
-                FROM equipos e
-                LEFT JOIN categorias_equipos c ON e.categoria_id = c.id
-                LEFT JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
-                ORDER BY e.codigo_inventario
-                LIMIT 50
-            """
-            headers = ['Código', 'Nombre', 'Categoría', 'Estado', 'Ubicación']
-        elif report_type == "mantenimientos":
-            query = """
-                SELECT m.id, m.tipo, m.fecha_programada, m.fecha_realizada,
-                       e.codigo_inventario, m.estado, m.costo
-                FROM mantenimientos m
-                JOIN equipos e ON m.equipo_id = e.id
-                ORDER BY m.fecha_programada DESC
-                LIMIT 50
-            """
-            headers = ['ID', 'Tipo', 'Fecha Prog.', 'Fecha Real.', 'Equipo', 'Estado', 'Costo']
-        elif report_type == "proveedores":
-            query = """
-                SELECT p.id, p.nombre, p.contacto, p.email, p.telefono,
-                       COUNT(DISTINCT c.id) as total_contratos
-                FROM proveedores p
-                LEFT JOIN contratos c ON p.id = c.proveedor_id
-                GROUP BY p.id, p.nombre, p.contacto, p.email, p.telefono
-                ORDER BY p.nombre
-                LIMIT 50
-            """
-            headers = ['ID', 'Nombre', 'Contacto', 'Email', 'Teléfono', 'Contratos']
-        else:
-            raise HTTPException(status_code=400, detail="Tipo de reporte no válido")
-        
-        async with pool.acquire() as conn:
-            rows = await conn.fetch(query)
-            
-            data = [headers]
-            for row in rows:
-                data.append([str(val)[:30] if val else '' for val in row])
-            
-            table = Table(data)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            
-            elements.append(table)
-        
-        doc.build(elements)
-        
-        # IMPORTANTE: Obtener el contenido del buffer antes de crear un nuevo BytesIO
-        pdf_data = buffer.getvalue()
+        pdf_data = await generar_pdf(report_type)
         
         # Nombre del archivo para descarga
         filename = f"{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
@@ -409,12 +595,381 @@ async def export_pdf(report_data: dict):
             headers={"Content-Disposition": f"attachment; filename={filename}"}
         )
     
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         print(f"Error al exportar PDF: {str(e)}")
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Error al exportar: {str(e)}")
 
+# ==================== EXPORTACIÓN EN STREAMING ====================
+
+STREAM_PREFETCH = int(os.getenv("STREAM_PREFETCH", "1000"))
+STREAM_CHUNK_BYTES = int(os.getenv("STREAM_CHUNK_BYTES", str(64 * 1024)))
+
+# formato -> (media type, extensión)
+STREAM_FORMATOS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+
+def json_default(valor):
+    """Serializa los tipos de asyncpg que json no soporta"""
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    return str(valor)
+
+async def stream_registros(query: str, formato: str):
+    """
+    Recorre la consulta con un cursor del servidor y produce bloques de
+    CSV o NDJSON a medida que se generan; la memoria usada no depende del
+    tamaño de la tabla.
+    """
+    pool = await get_db_pool()
+    
+    async with acquire_connection(pool) as conn:
+        async with conn.transaction():
+            stmt = await conn.prepare(query)
+            columnas = [attr.name for attr in stmt.get_attributes()]
+            
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            if formato == "csv":
+                writer.writerow(columnas)
+            
+            async for row in stmt.cursor(prefetch=STREAM_PREFETCH):
+                if formato == "csv":
+                    writer.writerow(row)
+                else:
+                    buffer.write(json.dumps(dict(row), default=json_default, ensure_ascii=False))
+                    buffer.write("\n")
+                
+                if buffer.tell() >= STREAM_CHUNK_BYTES:
+                    yield buffer.getvalue().encode()
+                    buffer.seek(0)
+                    buffer.truncate()
+            
+            if buffer.tell():
+                yield buffer.getvalue().encode()
+
+@app.get("/export/stream/{report_type}")
+async def export_stream(report_type: str, format: str = "csv"):
+    """Exporta todos los equipos o mantenimientos en streaming como CSV o NDJSON"""
+    if report_type not in ("equipos", "mantenimientos"):
+        raise HTTPException(status_code=400, detail="Tipo de reporte no válido")
+    if format not in STREAM_FORMATOS:
+        raise HTTPException(status_code=400, detail=f"Formato no válido, use uno de: {', '.join(STREAM_FORMATOS)}")
+    
+    media_type, extension = STREAM_FORMATOS[format]
+    filename = f"{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    
+    return StreamingResponse(
+        stream_registros(consulta_excel(report_type), format),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+# ==================== TRABAJOS DE EXPORTACIÓN ====================
+
+REPORTS_PATH = os.getenv("REPORTS_PATH", "/app/reportes")
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+EXPORT_TTL_SECONDS = int(os.getenv("EXPORT_TTL_SECONDS", "3600"))
+# Un trabajo en proceso sin terminar tras este tiempo se considera
+# abandonado (réplica caída) y vuelve a la cola
+EXPORT_JOB_TIMEOUT_SECONDS = int(os.getenv("EXPORT_JOB_TIMEOUT_SECONDS", "900"))
+EXPORT_POLL_INTERVAL = float(os.getenv("EXPORT_POLL_INTERVAL", "2"))
+EXPORT_CLEANUP_INTERVAL = 60
+
+# Identifica a esta réplica en los trabajos que reclama
+REPLICA_ID = socket.gethostname()
+
+# formato -> (generador, extensión, media type)
+EXPORT_FORMATOS = {
+    "excel": (generar_excel, "xlsx", EXCEL_MEDIA_TYPE),
+    "pdf": (generar_pdf, "pdf", "application/pdf"),
+}
+
+# Archivos de exportación en REPORTS_PATH: <job_id>.<extensión>
+ARCHIVO_EXPORT = re.compile(r"^([0-9a-f]{32})\.(xlsx|pdf)$")
+
+# Los trabajos se guardan en la tabla export_jobs y los archivos en el
+# volumen compartido REPORTS_PATH, de modo que cualquier réplica puede
+# atender el estado y la descarga de un trabajo encolado por otra
+_export_evento = None
+_export_tasks = []
+
+def job_publico(row) -> dict:
+    """Vista del trabajo expuesta por la API (sin la ruta local ni la réplica)"""
+    return {k: v for k, v in dict(row).items() if k not in ("archivo", "replica")}
+
+def escribir_archivo(ruta: str, data: bytes):
+    with open(ruta, "wb") as f:
+        f.write(data)
+
+def eliminar_archivo(ruta: str):
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+def archivos_export(ruta: str) -> dict:
+    """Archivos de exportación presentes en 'ruta': job_id -> ruta completa"""
+    archivos = {}
+    for nombre in os.listdir(ruta):
+        coincidencia = ARCHIVO_EXPORT.match(nombre)
+        if coincidencia:
+            archivos[coincidencia.group(1)] = os.path.join(ruta, nombre)
+    return archivos
+
+async def actualizar_progreso(job_id: str, progreso: int):
+    pool = await get_db_pool()
+    async with acquire_connection(pool) as conn:
+        await conn.execute(
+            "UPDATE export_jobs SET progreso = $2 WHERE job_id = $1 AND replica = $3",
+            job_id, progreso, REPLICA_ID
+        )
+
+async def contar_pendientes() -> int:
+    """Trabajos de exportación en cola sin empezar, en todas las réplicas"""
+    pool = await get_db_pool()
+    async with acquire_connection(pool) as conn:
+        return await conn.fetchval("SELECT COUNT(*) FROM export_jobs WHERE estado = 'pendiente'")
+
+async def reclamar_job():
+    """
+    Toma el trabajo pendiente más antiguo y lo marca en proceso por esta
+    réplica; SKIP LOCKED evita que dos workers reclamen el mismo.
+    """
+    pool = await get_db_pool()
+    async with acquire_connection(pool) as conn:
+        return await conn.fetchrow(
+            """
+            UPDATE export_jobs
+            SET estado = 'en_proceso', progreso = 10, replica = $1, fecha_inicio = CURRENT_TIMESTAMP
+            WHERE job_id = (
+                SELECT job_id FROM export_jobs
+                WHERE estado = 'pendiente'
+                ORDER BY fecha_creacion
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING *
+            """,
+            REPLICA_ID
+        )
+
+async def procesar_job(job):
+    """Genera el archivo de un trabajo reclamado y registra el resultado"""
+    job_id = job["job_id"]
+    pool = await get_db_pool()
+    try:
+        generar, extension, _ = EXPORT_FORMATOS[job["formato"]]
+        data = await generar(job["tipo"], job_id)
+        
+        ruta = os.path.join(REPORTS_PATH, f"{job_id}.{extension}")
+        await asyncio.to_thread(escribir_archivo, ruta, data)
+        
+        async with acquire_connection(pool) as conn:
+            await conn.execute(
+                """
+                UPDATE export_jobs
+                SET estado = 'completado', progreso = 100, archivo = $3, tamano_bytes = $4,
+                    fecha_fin = CURRENT_TIMESTAMP, expira = CURRENT_TIMESTAMP + $5 * INTERVAL '1 second'
+                WHERE job_id = $1 AND replica = $2
+                """,
+                job_id, REPLICA_ID, ruta, len(data), EXPORT_TTL_SECONDS
+            )
+    except Exception as e:
+        import traceback
+        print(f"Error en trabajo de exportación {job_id}: {str(e)}")
+        print(traceback.format_exc())
+        async with acquire_connection(pool) as conn:
+            await conn.execute(
+                """
+                UPDATE export_jobs
+                SET estado = 'error', error = $3,
+                    fecha_fin = CURRENT_TIMESTAMP, expira = CURRENT_TIMESTAMP + $4 * INTERVAL '1 second'
+                WHERE job_id = $1 AND replica = $2
+                """,
+                job_id, REPLICA_ID, str(e), EXPORT_TTL_SECONDS
+            )
+
+async def export_worker():
+    """
+    Procesa trabajos de exportación uno a la vez. Se despierta al encolar
+    un trabajo en esta réplica o cada EXPORT_POLL_INTERVAL segundos para
+    recoger los encolados en otras.
+    """
+    while True:
+        try:
+            job = await reclamar_job()
+        except (asyncpg.PostgresError, OSError) as e:
+            print(f"Error reclamando trabajo de exportación: {str(e)}")
+            job = None
+        
+        if job is None:
+            try:
+                await asyncio.wait_for(_export_evento.wait(), EXPORT_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            _export_evento.clear()
+            continue
+        
+        try:
+            await procesar_job(job)
+        except (asyncpg.PostgresError, OSError) as e:
+            # Sin poder registrar el resultado, el trabajo vuelve a la cola
+            # al superar EXPORT_JOB_TIMEOUT_SECONDS
+            print(f"Error registrando trabajo de exportación {job['job_id']}: {str(e)}")
+
+async def limpiar_exportaciones():
+    """
+    Elimina los trabajos cuyo TTL expiró junto con sus archivos, devuelve a
+    la cola los trabajos abandonados y borra los archivos huérfanos (sin
+    trabajo en la tabla, p. ej. tras una caída entre ambos borrados).
+    """
+    pool = await get_db_pool()
+    async with acquire_connection(pool) as conn:
+        expirados = await conn.fetch(
+            "DELETE FROM export_jobs WHERE expira < CURRENT_TIMESTAMP RETURNING archivo"
+        )
+        await conn.execute(
+            """
+            UPDATE export_jobs
+            SET estado = 'pendiente', progreso = 0, replica = NULL, fecha_inicio = NULL
+            WHERE estado = 'en_proceso'
+              AND fecha_inicio < CURRENT_TIMESTAMP - $1 * INTERVAL '1 second'
+            """,
+            EXPORT_JOB_TIMEOUT_SECONDS
+        )
+        archivos = await asyncio.to_thread(archivos_export, REPORTS_PATH)
+        conocidos = set()
+        if archivos:
+            filas = await conn.fetch(
+                "SELECT job_id FROM export_jobs WHERE job_id = ANY($1::varchar[])",
+                list(archivos)
+            )
+            conocidos = {fila["job_id"] for fila in filas}
+    
+    for row in expirados:
+        if row["archivo"]:
+            await asyncio.to_thread(eliminar_archivo, row["archivo"])
+    for job_id, ruta in archivos.items():
+        if job_id not in conocidos:
+            await asyncio.to_thread(eliminar_archivo, ruta)
+
+async def export_cleanup():
+    """Limpieza periódica de trabajos y archivos de exportación"""
+    while True:
+        try:
+            await limpiar_exportaciones()
+        except (asyncpg.PostgresError, OSError) as e:
+            print(f"Error limpiando exportaciones: {str(e)}")
+        await asyncio.sleep(EXPORT_CLEANUP_INTERVAL)
+
+async def recuperar_exportaciones():
+    """Devuelve a la cola los trabajos que esta réplica dejó en proceso al reiniciarse"""
+    pool = await get_db_pool()
+    async with acquire_connection(pool) as conn:
+        await conn.execute(
+            """
+            UPDATE export_jobs
+            SET estado = 'pendiente', progreso = 0, replica = NULL, fecha_inicio = NULL
+            WHERE estado = 'en_proceso' AND replica = $1
+            """,
+            REPLICA_ID
+        )
+
+async def iniciar_exportaciones():
+    """Recupera los trabajos interrumpidos y lanza los workers de exportación y la limpieza por TTL"""
+    global _export_evento
+    os.makedirs(REPORTS_PATH, exist_ok=True)
+    _export_evento = asyncio.Event()
+    await recuperar_exportaciones()
+    _export_tasks.extend(asyncio.create_task(export_worker()) for _ in range(EXPORT_WORKERS))
+    _export_tasks.append(asyncio.create_task(export_cleanup()))
+
+async def detener_exportaciones():
+    """Cancela los workers de exportación"""
+    for tarea in _export_tasks:
+        tarea.cancel()
+    await asyncio.gather(*_export_tasks, return_exceptions=True)
+    _export_tasks.clear()
+
+@app.post("/export/jobs", status_code=202)
+async def create_export_job(report_data: dict):
+    """
+    Encola un trabajo de exportación. Si ya hay uno igual pendiente o en
+    proceso (en cualquier réplica) se devuelve ese mismo trabajo.
+    """
+    report_type = report_data.get("type", "equipos")
+    formato = report_data.get("format", "excel")
+    
+    if report_type not in TIPOS_REPORTE:
+        raise HTTPException(status_code=400, detail="Tipo de reporte no válido")
+    if formato not in EXPORT_FORMATOS:
+        raise HTTPException(status_code=400, detail=f"Formato no válido, use uno de: {', '.join(EXPORT_FORMATOS)}")
+    
+    pool = await get_db_pool()
+    async with acquire_connection(pool) as conn:
+        # El índice único parcial sobre (formato, tipo) de los trabajos
+        # activos deduplica también entre réplicas
+        job = await conn.fetchrow(
+            """
+            INSERT INTO export_jobs (job_id, tipo, formato)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (formato, tipo) WHERE estado IN ('pendiente', 'en_proceso') DO NOTHING
+            RETURNING *
+            """,
+            uuid.uuid4().hex, report_type, formato
+        )
+        if job is None:
+            job = await conn.fetchrow(
+                """
+                SELECT * FROM export_jobs
+                WHERE formato = $1 AND tipo = $2 AND estado IN ('pendiente', 'en_proceso')
+                """,
+                formato, report_type
+            )
+    
+    if job is None:
+        # El trabajo activo terminó entre ambas consultas; se encola uno nuevo
+        return await create_export_job(report_data)
+    
+    if _export_evento is not None:
+        _export_evento.set()
+    return job_publico(job)
+
+async def leer_job(job_id: str):
+    pool = await get_db_pool()
+    async with acquire_connection(pool) as conn:
+        job = await conn.fetchrow("SELECT * FROM export_jobs WHERE job_id = $1", job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo de exportación no encontrado")
+    return job
+
+@app.get("/export/jobs/{job_id}")
+async def get_export_job(job_id: str):
+    """Estado y progreso de un trabajo de exportación"""
+    return job_publico(await leer_job(job_id))
+
+@app.get("/export/jobs/{job_id}/download")
+async def download_export_job(job_id: str):
+    """Descarga el archivo generado por un trabajo completado"""
+    job = await leer_job(job_id)
+    if job["estado"] != "completado":
+        raise HTTPException(status_code=409, detail=f"El trabajo no está completado (estado: {job['estado']})")
+    if not os.path.exists(job["archivo"]):
+        raise HTTPException(status_code=410, detail="El archivo del trabajo ya no está disponible")
+    
+    _, extension, media_type = EXPORT_FORMATOS[job["formato"]]
+    filename = f"{job['tipo']}_{job_id[:8]}.{extension}"
+    
+    return FileResponse(job["archivo"], media_type=media_type, filename=filename)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8004)
@@ -0,0 +1,266 @@
+"""
+Métricas de Prometheus y trazas distribuidas comunes a todos los servicios.
+
+Este archivo es la única fuente: cada servicio tiene su propio contexto de
+build, así que scripts/sincronizar_compartidos.py lo copia como
+services/<servicio>/observabilidad.py. No editar las copias.
+
+Uso desde main.py:
+
+    app = FastAPI(...)
+    instrumentar(app, "equipos-service")
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Optional
+
+from fastapi import Response
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+# ==================== MÉTRICAS ====================
+
+HTTP_REQUESTS = Counter("http_requests_total", "Peticiones HTTP atendidas", ["method", "route", "status"])
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "Latencia de las peticiones HTTP", ["method", "route", "status"])
+HTTP_IN_PROGRESS = Gauge("http_requests_in_progress", "Peticiones HTTP en curso")
+DB_POOL_CONNECTIONS = Gauge("db_pool_connections", "Conexiones del pool de asyncpg", ["estado"])
+DB_POOL_WAITERS = Gauge("db_pool_waiters", "Corrutinas esperando una conexión del pool")
+DB_POOL_ACQUIRE = Histogram(
+    "db_pool_acquire_seconds",
+    "Espera para obtener una conexión del pool",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
+# Corrutinas esperando una conexión del pool (lo mismo que DB_POOL_WAITERS,
+# legible sin pasar por prometheus_client)
+_esperas_pool = 0
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI que registra conteo, latencia y peticiones en curso.
+    Se etiqueta con la plantilla de la ruta (no con la URL) para acotar la
+    cardinalidad; la latencia incluye el envío completo del cuerpo.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+        
+        status = {"code": 500}
+        
+        async def send_con_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+        
+        HTTP_IN_PROGRESS.inc()
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_con_status)
+        finally:
+            HTTP_IN_PROGRESS.dec()
+            route = scope.get("route")
+            ruta = route.path if route is not None else "sin_ruta"
+            codigo = str(status["code"])
+            HTTP_LATENCY.labels(scope["method"], ruta, codigo).observe(time.perf_counter() - inicio)
+            HTTP_REQUESTS.labels(scope["method"], ruta, codigo).inc()
+
+def esperas_pool() -> int:
+    """Corrutinas esperando ahora mismo una conexión del pool"""
+    return _esperas_pool
+
+def actualizar_metricas_pool(pool):
+    """Actualiza los gauges de conexiones del pool de asyncpg, si existe"""
+    if pool is None:
+        return
+    size = pool.get_size()
+    idle = pool.get_idle_size()
+    DB_POOL_CONNECTIONS.labels("en_uso").set(size - idle)
+    DB_POOL_CONNECTIONS.labels("libres").set(idle)
+    DB_POOL_CONNECTIONS.labels("max").set(pool.get_max_size())
+
+def respuesta_metricas() -> Response:
+    """Métricas en formato de exposición de Prometheus"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+# ==================== TRAZAS ====================
+
+# Nombre del servicio en los spans y ruta del log; los fija instrumentar()
+SERVICE_NAME = "servicio"
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", f"/app/logs/traces-{SERVICE_NAME}.jsonl")
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", "1"))
+
+# Límite de spans en memoria entre volcados; los que exceden se descartan
+TRACE_MAX_PENDING = 10000
+
+# Traza de la petición en curso: (trace_id, span_id del span activo)
+_traza_actual: ContextVar[Optional[tuple]] = ContextVar("traza_actual", default=None)
+
+# Spans terminados pendientes de escribir en el log
+_spans_pendientes = []
+_trace_flusher: Optional[asyncio.Task] = None
+
+def traza_actual() -> Optional[tuple]:
+    """(trace_id, span_id) de la petición en curso, o None fuera de una traza"""
+    return _traza_actual.get() if TRACING_ENABLED else None
+
+def nuevo_span_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+def registrar_span(trace_id: str, span_id: str, parent_id: Optional[str], nombre: str,
+                   inicio: float, duracion: float, **atributos):
+    """Encola un span terminado; 'inicio' es un timestamp epoch y 'duracion' en segundos"""
+    if len(_spans_pendientes) >= TRACE_MAX_PENDING:
+        return
+    _spans_pendientes.append({
+        "trace_id": trace_id,
+        "span_id": span_id,
+        "parent_id": parent_id,
+        "service": SERVICE_NAME,
+        "name": nombre,
+        "start": datetime.fromtimestamp(inicio).isoformat(),
+        "duration_ms": round(duracion * 1000, 3),
+        **atributos
+    })
+
+def escribir_spans(spans: list):
+    os.makedirs(os.path.dirname(TRACE_LOG_PATH), exist_ok=True)
+    with open(TRACE_LOG_PATH, "a") as f:
+        f.write("".join(json.dumps(span, default=str) + "\n" for span in spans))
+
+async def volcar_spans():
+    """Escribe los spans pendientes en el log JSON fuera del event loop"""
+    global _spans_pendientes
+    if not _spans_pendientes:
+        return
+    lote, _spans_pendientes = _spans_pendientes, []
+    try:
+        await asyncio.to_thread(escribir_spans, lote)
+    except OSError as e:
+        print(f"⚠️ No se pudieron escribir las trazas: {e}")
+
+async def trace_flusher():
+    while True:
+        await asyncio.sleep(TRACE_FLUSH_INTERVAL)
+        await volcar_spans()
+
+def iniciar_trazas():
+    global _trace_flusher
+    if TRACING_ENABLED:
+        _trace_flusher = asyncio.create_task(trace_flusher())
+
+async def detener_trazas():
+    if _trace_flusher:
+        _trace_flusher.cancel()
+    await volcar_spans()
+
+class TracingMiddleware:
+    """
+    Continúa la traza recibida en X-Request-ID / X-Parent-Span-ID, o inicia
+    una nueva, y registra un span por cada petición atendida. El ID de la
+    traza se devuelve en la cabecera X-Request-ID de la respuesta.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TRACING_ENABLED or scope["path"] in ("/metrics", "/health"):
+            await self.app(scope, receive, send)
+            return
+        
+        headers = dict(scope["headers"])
+        trace_id = headers.get(b"x-request-id", b"").decode("latin-1")
+        if not trace_id or len(trace_id) > 64:
+            trace_id = uuid.uuid4().hex
+        parent_id = headers.get(b"x-parent-span-id", b"").decode("latin-1")[:32] or None
+        span_id = nuevo_span_id()
+        status = {"code": 500}
+        
+        async def send_con_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                # Siempre el ID de esta traza: una cabecera copiada de otra
+                # respuesta (caché, coalescencia) llevaría el de otra petición
+                response_headers = [(k, v) for k, v in message.get("headers", []) if k.lower() != b"x-request-id"]
+                response_headers.append((b"x-request-id", trace_id.encode("latin-1")))
+                message["headers"] = response_headers
+            await send(message)
+        
+        token = _traza_actual.set((trace_id, span_id))
+        inicio = time.time()
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_con_id)
+        finally:
+            _traza_actual.reset(token)
+            route = scope.get("route")
+            ruta = route.path if route is not None else scope["path"]
+            registrar_span(
+                trace_id, span_id, parent_id, f"{scope['method']} {ruta}",
+                inicio, time.perf_counter() - t0, kind="server", status=status["code"]
+            )
+
+def instrumentar(app, servicio: str):
+    """
+    Registra los middlewares de métricas y trazas en 'app' y fija el nombre
+    del servicio en los spans. La traza envuelve a las métricas.
+    """
+    global SERVICE_NAME, TRACE_LOG_PATH
+    SERVICE_NAME = servicio
+    TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", f"/app/logs/traces-{servicio}.jsonl")
+    app.add_middleware(MetricsMiddleware)
+    app.add_middleware(TracingMiddleware)
+
+# ==================== BASE DE DATOS ====================
+
+def span_consulta(record):
+    """Query logger de asyncpg: registra cada consulta de la petición como un span"""
+    traza = _traza_actual.get()
+    if traza is None:
+        return
+    trace_id, parent_id = traza
+    registrar_span(
+        trace_id, nuevo_span_id(), parent_id, "db.query",
+        time.time() - record.elapsed, record.elapsed,
+        kind="client",
+        query=" ".join(record.query.split())[:200],
+        error=type(record.exception).__name__ if record.exception else None
+    )
+
+@asynccontextmanager
+async def acquire_connection(pool):
+    """Adquiere una conexión del pool registrando la espera y, si hay traza, sus consultas"""
+    global _esperas_pool
+    _esperas_pool += 1
+    DB_POOL_WAITERS.inc()
+    inicio = time.perf_counter()
+    try:
+        conn = await pool.acquire()
+    finally:
+        _esperas_pool -= 1
+        DB_POOL_WAITERS.dec()
+        DB_POOL_ACQUIRE.observe(time.perf_counter() - inicio)
+    # Solo las conexiones usadas dentro de una traza registran sus consultas
+    traza = traza_actual()
+    if traza is not None:
+        espera = time.perf_counter() - inicio
+        registrar_span(traza[0], nuevo_span_id(), traza[1], "db.acquire", time.time() - espera, espera, kind="internal")
+        conn.add_query_logger(span_consulta)
+    try:
+        yield conn
+    finally:
+        if traza is not None:
+            conn.remove_query_logger(span_consulta)
+        await pool.release(conn)
@@ -0,0 +1,70 @@
+"""
+Utilidades comunes de las pruebas.
+
+Cada servicio es un main.py independiente con su propio contexto de build,
+así que se carga por ruta con un nombre de módulo propio. Requiere las
+dependencias de services/*/requirements.txt y pytest; no necesita
+PostgreSQL ni los demás servicios (ver tests/fakes.py).
+"""
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+from prometheus_client import REGISTRY
+
+SERVICES_DIR = Path(__file__).resolve().parent.parent / "services"
+
+# Colectores propios de prometheus_client (proceso, plataforma, gc)
+_COLECTORES_BASE = set(REGISTRY._collector_to_names)
+
+_cargados = {}
+
+def cargar_servicio(nombre: str):
+    """Importa services/<nombre>/main.py una sola vez por sesión"""
+    if nombre in _cargados:
+        return _cargados[nombre]
+    
+    # Todos los servicios registran las mismas métricas en el registro global
+    for colector in list(REGISTRY._collector_to_names):
+        if colector not in _COLECTORES_BASE:
+            REGISTRY.unregister(colector)
+    
+    directorio = SERVICES_DIR / nombre
+    # Los módulos auxiliares se copian en cada servicio: se importa la copia propia
+    locales = [p.stem for p in directorio.glob("*.py") if p.stem != "main"]
+    for modulo in locales:
+        sys.modules.pop(modulo, None)
+    sys.path.insert(0, str(directorio))
+    try:
+        spec = importlib.util.spec_from_file_location(f"{nombre}_main", directorio / "main.py")
+        modulo = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = modulo
+        spec.loader.exec_module(modulo)
+    finally:
+        sys.path.remove(str(directorio))
+        for nombre_local in locales:
+            sys.modules.pop(nombre_local, None)
+    
+    _cargados[nombre] = modulo
+    return modulo
+
+@pytest.fixture
+def equipos():
+    return cargar_servicio("equipos_service")
+
+@pytest.fixture
+def mantenimiento():
+    return cargar_servicio("mantenimiento_service")
+
+@pytest.fixture
+def gateway():
+    return cargar_servicio("api_gateway")
+
+@pytest.fixture
+def agentes():
+    return cargar_servicio("agent_service")
+
+@pytest.fixture
+def reportes():
+    return cargar_servicio("reportes_service")
@@ -0,0 +1,123 @@
+"""
+Dobles de prueba de asyncpg. FakeConn delega cada consulta en un 'handler'
+(metodo, sql, args) -> resultado y registra todas las llamadas; las filas
+pueden ser dicts, que admiten row["col"] y dict(row) como asyncpg.Record.
+"""
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+class Registro(dict):
+    """Fila que, como asyncpg.Record, se itera por valores"""
+    
+    def __iter__(self):
+        return iter(self.values())
+
+class FakeStatement:
+    """Sentencia preparada; su cursor cuenta las filas que se han leído"""
+    
+    def __init__(self, filas):
+        self.filas = [Registro(fila) for fila in filas]
+        self.leidas = 0
+        self.prefetch = None
+    
+    def get_attributes(self):
+        columnas = self.filas[0].keys() if self.filas else []
+        return [SimpleNamespace(name=columna) for columna in columnas]
+    
+    def cursor(self, prefetch=None):
+        self.prefetch = prefetch
+        return self._recorrer()
+    
+    async def _recorrer(self):
+        for fila in self.filas:
+            self.leidas += 1
+            yield fila
+
+class FakeConn:
+    
+    def __init__(self, handler=None):
+        self.handler = handler or (lambda metodo, sql, args: None)
+        self.consultas = []
+        self.copias = []
+        self.sentencias = []
+        self.transacciones = 0
+    
+    async def _llamar(self, metodo, sql, args):
+        self.consultas.append((metodo, " ".join(sql.split()), args))
+        resultado = self.handler(metodo, sql, args)
+        if isinstance(resultado, BaseException):
+            raise resultado
+        return resultado
+    
+    async def fetch(self, sql, *args):
+        return await self._llamar("fetch", sql, args) or []
+    
+    async def fetchrow(self, sql, *args):
+        return await self._llamar("fetchrow", sql, args)
+    
+    async def fetchval(self, sql, *args):
+        return await self._llamar("fetchval", sql, args)
+    
+    async def execute(self, sql, *args):
+        return await self._llamar("execute", sql, args) or "OK"
+    
+    async def prepare(self, sql):
+        sentencia = FakeStatement(await self._llamar("prepare", sql, ()) or [])
+        self.sentencias.append(sentencia)
+        return sentencia
+    
+    async def copy_records_to_table(self, tabla, records, columns=None):
+        records = list(records)
+        self.copias.append((tabla, records, columns))
+        resultado = self.handler("copy", tabla, records)
+        if isinstance(resultado, BaseException):
+            raise resultado
+        return f"COPY {len(records)}"
+    
+    @asynccontextmanager
+    async def _transaccion(self):
+        self.transacciones += 1
+        yield
+    
+    def transaction(self):
+        return self._transaccion()
+    
+    def add_query_logger(self, callback):
+        pass
+    
+    def remove_query_logger(self, callback):
+        pass
+    
+    def sqls(self, metodo=None):
+        return [sql for m, sql, _ in self.consultas if metodo is None or m == metodo]
+
+class FakePool:
+    
+    def __init__(self, conn: FakeConn):
+        self.conn = conn
+    
+    async def acquire(self):
+        return self.conn
+    
+    async def release(self, conn):
+        pass
+    
+    def get_size(self):
+        return 1
+    
+    def get_idle_size(self):
+        return 1
+    
+    def get_max_size(self):
+        return 1
+
+def usar_conexion(monkeypatch, modulo, handler=None) -> FakeConn:
+    """Hace que get_db_pool() del servicio devuelva un pool con una FakeConn"""
+    conn = FakeConn(handler)
+    pool = FakePool(conn)
+    
+    async def get_db_pool():
+        return pool
+    
+    monkeypatch.setattr(modulo, "get_db_pool", get_db_pool)
+    return conn
@@ -0,0 +1,27 @@
+"""Columnas de cada tabla según database/schema.sql, para validar consultas sin PostgreSQL"""
+import re
+from pathlib import Path
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent / "database" / "schema.sql"
+
+def columnas_por_tabla() -> dict:
+    tablas = {}
+    sql = SCHEMA_PATH.read_text(encoding="utf-8")
+    for tabla, cuerpo in re.findall(r"CREATE TABLE IF NOT EXISTS (\w+) \((.*?)\n\);", sql, re.S):
+        columnas = set()
+        for linea in cuerpo.splitlines():
+            match = re.match(r"\s+(\w+)\s+[A-Z]", linea)
+            if match and match.group(1) not in ("CHECK", "UNIQUE", "PRIMARY", "FOREIGN", "CONSTRAINT"):
+                columnas.add(match.group(1))
+        tablas[tabla] = columnas
+    return tablas
+
+def columnas_inexistentes(query: str) -> list:
+    """Referencias alias.columna de la consulta que no existen en la tabla del alias"""
+    tablas = columnas_por_tabla()
+    alias = {a: t for t, a in re.findall(r"(?:FROM|JOIN)\s+(\w+)\s+(?:AS\s+)?(\w+)", query) if t in tablas}
+    return [
+        f"{a}.{columna}"
+        for a, columna in re.findall(r"\b(\w+)\.(\w+)\b", query)
+        if a in alias and columna not in tablas[alias[a]]
+    ]
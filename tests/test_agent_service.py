@@ -0,0 +1,287 @@
+import asyncio
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+from fakes import usar_conexion
+
+HOY_DB = date(2024, 6, 1)
+
+def handler_agente(watermark):
+    def handler(metodo, sql, args):
+        if "SELECT CURRENT_DATE" in sql:
+            return HOY_DB
+        if "FROM agentes_watermarks" in sql:
+            return watermark
+        if sql.lstrip().startswith("WITH candidatos") or "INSERT INTO notificaciones" in sql:
+            return "INSERT 0 1"
+        return None
+    return handler
+
+WATERMARK = {"ultima_ejecucion": datetime(2024, 5, 31, 6, 30), "ultima_fecha": date(2024, 5, 31)}
+
+# ---------- Agentes incrementales ----------
+
+def test_obsolescencia_incremental_repite_avisos_vencidos(agentes, monkeypatch):
+    conn = usar_conexion(monkeypatch, agentes, handler_agente(WATERMARK))
+    
+    resultado = asyncio.run(agentes.check_equipment_obsolescence())
+    
+    assert resultado["status"] == "success" and resultado["incremental"] is True
+    inserts = [(sql, args) for m, sql, args in conn.consultas if "INSERT INTO notificaciones" in sql]
+    sql, args = inserts[0]
+    # Los avisos creados antes de hoy - 30 días y después de la ventana anterior vuelven a evaluarse
+    assert "SELECT equipo_id FROM notificaciones WHERE tipo = 'equipo_obsoleto'" in sql
+    assert "fecha_creacion >= $2::date - $4::int AND fecha_creacion < $1::date - $4::int" in sql
+    assert args == (HOY_DB, WATERMARK["ultima_fecha"], WATERMARK["ultima_ejecucion"], 30)
+
+def test_garantias_incremental_repite_avisos_vencidos(agentes, monkeypatch):
+    conn = usar_conexion(monkeypatch, agentes, handler_agente(WATERMARK))
+    
+    resultado = asyncio.run(agentes.check_warranty_expiration())
+    
+    assert resultado["status"] == "success"
+    sql, args = next((sql, args) for m, sql, args in conn.consultas if "INSERT INTO notificaciones" in sql)
+    assert "WHERE tipo = 'garantia_proxima_vencer'" in sql
+    assert args[0] == HOY_DB
+    assert args[1] == date(2024, 7, 31)
+    assert args[4:] == (WATERMARK["ultima_fecha"], 30)
+
+def test_agentes_usan_la_fecha_de_la_base(agentes, monkeypatch):
+    """Ninguna fecha sale del reloj local: todas derivan de CURRENT_DATE"""
+    for agente in (agentes.check_maintenance_reminders, agentes.check_equipment_obsolescence,
+                   agentes.check_warranty_expiration):
+        conn = usar_conexion(monkeypatch, agentes, handler_agente(None))
+        asyncio.run(agente())
+        assert conn.sqls("fetchval")[0] == "SELECT CURRENT_DATE"
+        for metodo, sql, args in conn.consultas:
+            if "INSERT INTO notificaciones" in sql:
+                assert args[0] == HOY_DB
+
+def handler_insertadas(watermark, insertadas: dict, error: Exception = None):
+    """Como handler_agente, pero cada INSERT de notificaciones devuelve 'INSERT 0 n' según su tipo"""
+    base = handler_agente(watermark)
+    def handler(metodo, sql, args):
+        if "INSERT INTO notificaciones" in sql:
+            if error is not None:
+                return error
+            tipo = next(t for t in insertadas if f"SELECT '{t}'" in sql)
+            return f"INSERT 0 {insertadas[tipo]}"
+        return base(metodo, sql, args)
+    return handler
+
+def test_recordatorios_de_mantenimiento_cuentan_las_filas_insertadas(agentes, monkeypatch):
+    insertadas = {"mantenimiento_proximo": 4, "mantenimiento_urgente": 2, "mantenimiento_vencido": 1}
+    conn = usar_conexion(monkeypatch, agentes, handler_insertadas(None, insertadas))
+    
+    resultado = asyncio.run(agentes.check_maintenance_reminders())
+    
+    assert resultado["status"] == "success"
+    assert resultado["detalle_por_tipo"] == insertadas
+    assert resultado["notificaciones_generadas"] == 7
+    # Una sentencia INSERT ... SELECT por tipo, en una sola transacción
+    assert len([sql for sql in conn.sqls("execute") if "INSERT INTO notificaciones" in sql]) == 3
+    assert conn.transacciones == 1
+
+def test_obsolescencia_primera_ejecucion_evalua_todos_y_guarda_watermark(agentes, monkeypatch):
+    insertadas = {"equipo_obsoleto": 3, "equipo_proximo_obsolescencia": 5}
+    conn = usar_conexion(monkeypatch, agentes, handler_insertadas(None, insertadas))
+    
+    resultado = asyncio.run(agentes.check_equipment_obsolescence())
+    
+    assert resultado["incremental"] is False
+    assert resultado["detalle_por_tipo"] == insertadas
+    assert resultado["notificaciones_generadas"] == 8
+    inserts = [(sql, args) for m, sql, args in conn.consultas if "INSERT INTO notificaciones" in sql]
+    assert all(args == (HOY_DB,) for _, args in inserts)
+    assert "fecha_ultima_actualizacion" not in inserts[0][0]
+
+def test_watermark_se_lee_bloqueado_y_avanza_tras_insertar(agentes, monkeypatch):
+    for agente, nombre, insertadas in (
+        (agentes.check_equipment_obsolescence, "check_obsolescence", {"equipo_obsoleto": 1, "equipo_proximo_obsolescencia": 0}),
+        (agentes.check_warranty_expiration, "check_warranties", {"garantia_proxima_vencer": 2}),
+    ):
+        conn = usar_conexion(monkeypatch, agentes, handler_insertadas(WATERMARK, insertadas))
+        
+        resultado = asyncio.run(agente())
+        
+        assert resultado["status"] == "success" and resultado["incremental"] is True
+        sqls = conn.sqls()
+        lectura = next(i for i, sql in enumerate(sqls) if "FROM agentes_watermarks" in sql)
+        escritura = next(i for i, sql in enumerate(sqls) if "INSERT INTO agentes_watermarks" in sql)
+        assert sqls[lectura].endswith("FOR UPDATE")
+        assert "VALUES ($1, CURRENT_TIMESTAMP, CURRENT_DATE)" in sqls[escritura]
+        assert conn.consultas[escritura][2] == (nombre,)
+        # La marca se guarda después de todos los INSERT, dentro de la misma transacción
+        assert escritura == len(sqls) - 1
+        assert max(i for i, sql in enumerate(sqls) if "INSERT INTO notificaciones" in sql) < escritura
+        assert conn.transacciones == 1
+
+def test_watermark_no_avanza_si_falla_un_insert(agentes, monkeypatch):
+    insertadas = {"garantia_proxima_vencer": 0}
+    conn = usar_conexion(monkeypatch, agentes, handler_insertadas(WATERMARK, insertadas, error=RuntimeError("sin conexión")))
+    
+    resultado = asyncio.run(agentes.check_warranty_expiration())
+    
+    assert resultado["status"] == "error"
+    assert not any("INSERT INTO agentes_watermarks" in sql for sql in conn.sqls())
+
+def test_ventana_de_repeticion_de_avisos(agentes, monkeypatch):
+    monkeypatch.setattr(agentes, "DIAS_REPETIR_AVISO", 10)
+    insertadas = {"equipo_obsoleto": 0, "equipo_proximo_obsolescencia": 0, "garantia_proxima_vencer": 0}
+    conn = usar_conexion(monkeypatch, agentes, handler_insertadas(WATERMARK, insertadas))
+    
+    asyncio.run(agentes.check_equipment_obsolescence())
+    asyncio.run(agentes.check_warranty_expiration())
+    
+    inserts = {
+        tipo: (sql, args)
+        for m, sql, args in conn.consultas if "INSERT INTO notificaciones" in sql
+        for tipo in insertadas if f"SELECT '{tipo}'" in sql
+    }
+    # No se repite un aviso creado en los últimos DIAS_REPETIR_AVISO días...
+    for tipo in ("equipo_obsoleto", "garantia_proxima_vencer"):
+        sql, args = inserts[tipo]
+        assert f"AND n.tipo = '{tipo}' AND n.fecha_creacion >= $1::date - 10 )" in sql
+        assert args[-1] == 10
+    # ...y los que cumplieron la ventana desde la última ejecución vuelven a ser candidatos
+    assert "fecha_creacion >= $2::date - $4::int AND fecha_creacion < $1::date - $4::int" in inserts["equipo_obsoleto"][0]
+    assert "fecha_creacion >= $5::date - $6::int AND fecha_creacion < $1::date - $6::int" in inserts["garantia_proxima_vencer"][0]
+    # El aviso de proximidad no se deduplica por ventana: solo por candidatos
+    assert "n.fecha_creacion" not in inserts["equipo_proximo_obsolescencia"][0]
+
+def test_analisis_de_costos_inserta_y_devuelve_en_una_sentencia(agentes, monkeypatch):
+    filas = [
+        {"id": 3, "codigo_inventario": "EQ-3", "num_mantenimientos": 4, "costo_total_mantenimiento": Decimal("900.50")},
+        {"id": 8, "codigo_inventario": "EQ-8", "num_mantenimientos": 2, "costo_total_mantenimiento": Decimal("400")},
+    ]
+    conn = usar_conexion(monkeypatch, agentes, lambda metodo, sql, args: filas if metodo == "fetch" else None)
+    
+    resultado = asyncio.run(agentes.analyze_maintenance_costs())
+    
+    assert resultado["status"] == "success"
+    assert resultado["equipos_identificados"] == resultado["notificaciones_generadas"] == 2
+    assert resultado["detalle"][0] == {"equipo_id": 3, "codigo": "EQ-3", "costo_mantenimiento": 900.5, "num_mantenimientos": 4}
+    sql, = conn.sqls()
+    assert "INSERT INTO notificaciones" in sql and "FROM alto_costo a" in sql
+
+# ---------- Expresiones cron ----------
+
+@pytest.mark.parametrize("expresion,desde,esperado", [
+    # Pasos
+    ("*/15 * * * *", datetime(2024, 6, 1, 10, 7), datetime(2024, 6, 1, 10, 15)),
+    ("*/15 * * * *", datetime(2024, 6, 1, 10, 45), datetime(2024, 6, 1, 11, 0)),
+    ("0 0-12/6 * * *", datetime(2024, 6, 1, 6, 0), datetime(2024, 6, 1, 12, 0)),
+    # Rangos
+    ("0 9-17 * * *", datetime(2024, 6, 1, 17, 30), datetime(2024, 6, 2, 9, 0)),
+    # Listas; el instante de partida no cuenta aunque coincida
+    ("0,30 8 * * *", datetime(2024, 6, 1, 8, 0), datetime(2024, 6, 1, 8, 30)),
+    ("0,30 8 * * *", datetime(2024, 6, 1, 8, 0, 59), datetime(2024, 6, 1, 8, 30)),
+    # Solo día de la semana (2024-06-01 es sábado)
+    ("0 7 * * 1", datetime(2024, 6, 1, 12, 0), datetime(2024, 6, 3, 7, 0)),
+    # Domingo como 0 y como 7
+    ("0 12 * * 0", datetime(2024, 6, 1, 12, 0), datetime(2024, 6, 2, 12, 0)),
+    ("0 12 * * 7", datetime(2024, 6, 1, 12, 0), datetime(2024, 6, 2, 12, 0)),
+    ("0 12 * * 5-7", datetime(2024, 6, 3, 0, 0), datetime(2024, 6, 7, 12, 0)),
+    # Día del mes y día de la semana restringidos: basta con uno (día 13 o viernes)
+    ("0 0 13 * 5", datetime(2024, 6, 1, 0, 0), datetime(2024, 6, 7, 0, 0)),
+    ("0 0 13 * 5", datetime(2024, 6, 8, 0, 0), datetime(2024, 6, 13, 0, 0)),
+    # Solo día del mes, con cambio de año
+    ("0 6 1 1 *", datetime(2024, 6, 1, 0, 0), datetime(2025, 1, 1, 6, 0)),
+    # 29 de febrero: el siguiente año bisiesto
+    ("0 0 29 2 *", datetime(2024, 3, 1, 0, 0), datetime(2028, 2, 29, 0, 0)),
+])
+def test_cron_siguiente(agentes, expresion, desde, esperado):
+    assert agentes.CronSchedule(expresion).siguiente(desde) == esperado
+
+@pytest.mark.parametrize("expresion", ["0 0 31 2 *", "0 0 30 2 *", "0 0 31 4,6,9,11 *"])
+def test_cron_fecha_imposible(agentes, expresion):
+    cron = agentes.CronSchedule(expresion)
+    with pytest.raises(ValueError):
+        cron.siguiente(datetime(2024, 1, 1))
+
+@pytest.mark.parametrize("expresion", ["* * * *", "60 * * * *", "* 24 * * *", "* * 0 * *", "* * * 13 *", "* * * * 8", "5-1 * * * *", "*/0 * * * *", "a * * * *"])
+def test_cron_expresion_invalida(agentes, expresion):
+    with pytest.raises(ValueError):
+        agentes.CronSchedule(expresion)
+
+# ---------- Ejecución con advisory lock ----------
+
+def handler_lock(obtenido=True, ejecucion_id=5):
+    def handler(metodo, sql, args):
+        if "pg_try_advisory_lock" in sql:
+            return obtenido
+        if "INSERT INTO agentes_ejecuciones" in sql:
+            return ejecucion_id
+    return handler
+
+def agente_contado(llamadas):
+    async def agente():
+        llamadas.append(1)
+        return {"status": "success"}
+    return agente
+
+def test_sin_lock_no_ejecuta_el_agente(agentes, monkeypatch):
+    llamadas = []
+    conn = usar_conexion(monkeypatch, agentes, handler_lock(obtenido=False))
+    
+    resultado = asyncio.run(agentes.ejecutar_con_lock("check_warranties", agente_contado(llamadas), datetime(2024, 6, 1, 7, 0)))
+    
+    assert resultado["status"] == "skipped"
+    assert llamadas == []
+    assert not any("agentes_ejecuciones" in sql or "pg_advisory_unlock" in sql for sql in conn.sqls())
+
+def test_franja_ya_registrada_no_vuelve_a_ejecutarse(agentes, monkeypatch):
+    llamadas = []
+    conn = usar_conexion(monkeypatch, agentes, handler_lock(ejecucion_id=None))
+    programada = datetime(2024, 6, 1, 7, 0)
+    
+    resultado = asyncio.run(agentes.ejecutar_con_lock("check_warranties", agente_contado(llamadas), programada))
+    
+    assert resultado["status"] == "skipped"
+    assert llamadas == []
+    insert = next(args for m, sql, args in conn.consultas if "INSERT INTO agentes_ejecuciones" in sql)
+    assert insert == ("check_warranties", programada)
+    # El lock se libera igualmente
+    assert conn.consultas[-1][1] == "SELECT pg_advisory_unlock(hashtext($1))"
+
+def test_ejecucion_programada_registra_el_resultado(agentes, monkeypatch):
+    llamadas = []
+    conn = usar_conexion(monkeypatch, agentes, handler_lock(ejecucion_id=5))
+    
+    resultado = asyncio.run(agentes.ejecutar_con_lock("check_warranties", agente_contado(llamadas), datetime(2024, 6, 1, 7, 0)))
+    
+    assert resultado == {"status": "success"}
+    assert llamadas == [1]
+    update = next(args for m, sql, args in conn.consultas if "UPDATE agentes_ejecuciones" in sql)
+    assert update[:2] == (5, "success")
+    assert conn.consultas[-1][1] == "SELECT pg_advisory_unlock(hashtext($1))"
+
+def test_ejecucion_manual_no_se_registra(agentes, monkeypatch):
+    llamadas = []
+    conn = usar_conexion(monkeypatch, agentes, handler_lock())
+    
+    asyncio.run(agentes.ejecutar_con_lock("check_warranties", agente_contado(llamadas)))
+    
+    assert llamadas == [1]
+    assert not any("agentes_ejecuciones" in sql for sql in conn.sqls())
+
+# ---------- Retención del historial ----------
+
+def test_purge_ejecuciones_borra_las_anteriores_a_la_retencion(agentes, monkeypatch):
+    monkeypatch.setattr(agentes, "AGENT_HISTORY_RETENTION_DAYS", 7)
+    conn = usar_conexion(monkeypatch, agentes, lambda metodo, sql, args: "DELETE 42")
+    
+    resultado = asyncio.run(agentes.purge_ejecuciones())
+    
+    assert resultado["status"] == "success"
+    assert resultado["ejecuciones_eliminadas"] == 42
+    metodo, sql, args = conn.consultas[0]
+    assert sql.startswith("DELETE FROM agentes_ejecuciones WHERE fecha_inicio <")
+    assert args == (7,)
+
+def test_purge_ejecuciones_esta_programado(agentes):
+    agente, cron = agentes.AGENTES["purge_ejecuciones"]
+    assert agente is agentes.purge_ejecuciones
+    assert agentes.CronSchedule(cron).siguiente(datetime(2024, 6, 1, 12, 0)) == datetime(2024, 6, 2, 3, 15)
@@ -0,0 +1,532 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+class TransporteStub(httpx.AsyncBaseTransport):
+    """Transporte que entrega las respuestas sin leer, como un backend real"""
+    
+    def __init__(self, handler):
+        self.handler = handler
+    
+    async def handle_async_request(self, request):
+        await request.aread()
+        respuesta = await self.handler(request)
+        try:
+            stream = httpx.ByteStream(respuesta.content)
+        except httpx.ResponseNotRead:
+            # Cuerpo en streaming: se entrega tal cual, bloque a bloque
+            stream = respuesta.stream
+        return httpx.Response(respuesta.status_code, headers=respuesta.headers, stream=stream)
+
+class StubBackends:
+    """
+    Sustituye los clientes HTTP de todos los backends por un transporte en
+    memoria. 'responder' decide la respuesta de cada petición y 'llamadas'
+    registra las que llegaron a los servicios.
+    """
+    
+    def __init__(self, gateway, monkeypatch):
+        self.llamadas = []
+        self.responder = lambda request: httpx.Response(200, json={"path": request.url.path})
+        for nombre, backend in gateway.BACKENDS.items():
+            cliente = httpx.AsyncClient(transport=TransporteStub(self._handler))
+            monkeypatch.setattr(backend, "client", cliente)
+            monkeypatch.setattr(backend, "breaker", gateway.CircuitBreaker(f"TEST_{nombre.upper()}"))
+            monkeypatch.setattr(backend, "en_curso", 0)
+            for replica in backend.replicas:
+                monkeypatch.setattr(replica, "sana", True)
+                monkeypatch.setattr(replica, "en_curso", 0)
+        monkeypatch.setattr(gateway, "cache", gateway.MemoryLRUCache(100))
+        self.app = gateway.app
+    
+    async def _handler(self, request: httpx.Request):
+        self.llamadas.append(request)
+        respuesta = self.responder(request)
+        if asyncio.iscoroutine(respuesta):
+            respuesta = await respuesta
+        return respuesta
+    
+    def rutas(self):
+        return [r.url.path for r in self.llamadas]
+    
+    def cliente(self):
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=self.app), base_url="http://gateway")
+
+@pytest.fixture
+def stub(gateway, monkeypatch):
+    return StubBackends(gateway, monkeypatch)
+
+def ejecutar(stub, *peticiones, concurrentes=False):
+    """Envía las peticiones (método, url, kwargs) al gateway y retorna las respuestas"""
+    async def escenario():
+        async with stub.cliente() as cliente:
+            corrutinas = [cliente.request(m, url, **(kw[0] if kw else {})) for m, url, *kw in peticiones]
+            if concurrentes:
+                return await asyncio.gather(*corrutinas)
+            return [await c for c in corrutinas]
+    return asyncio.run(escenario())
+
+# ---------- Caché de respuestas ----------
+
+def test_get_cacheable_se_sirve_desde_cache(stub):
+    primera, segunda = ejecutar(stub, ("GET", "/api/reportes/equipos-por-estado"), ("GET", "/api/reportes/equipos-por-estado"))
+    assert primera.headers["x-cache"] == "MISS"
+    assert segunda.headers["x-cache"] == "HIT"
+    assert segunda.json() == primera.json()
+    assert len(stub.llamadas) == 1
+
+def test_fresh_true_omite_la_cache(stub):
+    respuestas = ejecutar(
+        stub,
+        ("GET", "/api/reportes/equipos-por-estado?fresh=true"),
+        ("GET", "/api/reportes/equipos-por-estado?fresh=true"),
+        ("GET", "/api/reportes/equipos-por-estado"),
+    )
+    assert len(stub.llamadas) == 3
+    assert "x-cache" not in respuestas[1].headers
+    assert all(r.url.params.get("fresh") == "true" for r in stub.llamadas[:2])
+
+def test_no_cache_omite_la_cache(stub):
+    ejecutar(
+        stub,
+        ("GET", "/api/categorias"),
+        ("GET", "/api/categorias", {"headers": {"Cache-Control": "no-cache"}}),
+    )
+    assert len(stub.llamadas) == 2
+
+@pytest.mark.parametrize("ruta", ["/api/reportes/render-stats", "/api/reportes/metrics", "/api/reportes/export/jobs/abc"])
+def test_endpoints_operativos_de_reportes_no_se_cachean(stub, ruta):
+    ejecutar(stub, ("GET", ruta), ("GET", ruta))
+    assert len(stub.llamadas) == 2
+
+def test_escritura_invalida_los_recursos_afectados(stub):
+    ejecutar(
+        stub,
+        ("GET", "/api/proveedores"),
+        ("POST", "/api/proveedores", {"json": {"razon_social": "ACME"}}),
+        ("GET", "/api/proveedores"),
+    )
+    assert stub.rutas() == ["/proveedores", "/proveedores", "/proveedores"]
+
+def test_cache_backend_es_abstracto(gateway):
+    with pytest.raises(TypeError):
+        gateway.CacheBackend()
+    
+    class Incompleto(gateway.CacheBackend):
+        async def get(self, key):
+            return None
+    
+    with pytest.raises(TypeError):
+        Incompleto()
+
+def test_lru_desaloja_la_entrada_menos_usada(gateway):
+    async def escenario():
+        cache = gateway.MemoryLRUCache(2)
+        await cache.set("a", "r", 1, 60)
+        await cache.set("b", "r", 2, 60)
+        await cache.get("a")
+        await cache.set("c", "r", 3, 60)
+        return await cache.get("a"), await cache.get("b"), await cache.get("c")
+    assert asyncio.run(escenario()) == (1, None, 3)
+
+# ---------- Circuit breaker y límite de concurrencia ----------
+
+def test_circuit_breaker_abre_pasa_a_half_open_y_cierra(gateway):
+    breaker = gateway.CircuitBreaker("TEST")
+    breaker.umbral_fallos, breaker.max_pruebas = 2, 1
+    
+    breaker.registrar_fallo()
+    assert breaker.permitir() is None
+    breaker.registrar_fallo()
+    assert breaker.estado == "open"
+    assert breaker.permitir() > 0
+    
+    breaker.abierto_hasta = 0.0
+    assert breaker.permitir() is None
+    assert breaker.estado == "half-open"
+    assert breaker.permitir() == 1.0
+    
+    breaker.registrar_exito()
+    assert breaker.estado == "closed"
+    assert breaker.permitir() is None
+
+def test_circuit_breaker_fallo_en_half_open_reabre(gateway):
+    breaker = gateway.CircuitBreaker("TEST")
+    breaker.abrir()
+    breaker.abierto_hasta = 0.0
+    assert breaker.permitir() is None
+    breaker.registrar_fallo()
+    assert breaker.estado == "open"
+    assert breaker.aperturas == 2
+
+def test_backend_con_5xx_abre_el_circuito(gateway, stub):
+    stub.responder = lambda request: httpx.Response(500, json={"detail": "error"})
+    gateway.BACKENDS["equipos"].breaker.umbral_fallos = 2
+    
+    respuestas = ejecutar(stub, *[("GET", f"/api/equipos/{i}") for i in range(3)])
+    
+    assert [r.status_code for r in respuestas] == [500, 500, 503]
+    assert int(respuestas[2].headers["retry-after"]) >= 1
+    assert len(stub.llamadas) == 2
+    
+    # Los demás backends no se ven afectados
+    stub.responder = lambda request: httpx.Response(200, json={})
+    assert ejecutar(stub, ("GET", "/api/proveedores/1"))[0].status_code == 200
+
+def test_limite_de_concurrencia_rechaza_con_429(gateway, stub, monkeypatch):
+    async def lento(request):
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={})
+    stub.responder = lento
+    monkeypatch.setattr(gateway.BACKENDS["equipos"], "max_concurrent", 1)
+    
+    respuestas = ejecutar(stub, ("GET", "/api/equipos/1"), ("GET", "/api/equipos/2"), concurrentes=True)
+    
+    assert sorted(r.status_code for r in respuestas) == [200, 429]
+    assert gateway.BACKENDS["equipos"].en_curso == 0
+
+# ---------- Single-flight ----------
+
+def test_gets_identicos_concurrentes_comparten_una_llamada(gateway, stub):
+    async def lento(request):
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"id": 1})
+    stub.responder = lento
+    
+    respuestas = ejecutar(stub, *[("GET", "/api/equipos/1")] * 5, concurrentes=True)
+    
+    assert [r.status_code for r in respuestas] == [200] * 5
+    assert all(r.json() == {"id": 1} for r in respuestas)
+    assert len(stub.llamadas) == 1
+    assert gateway._inflight == {}
+
+def test_single_flight_distingue_parametros(stub):
+    async def lento(request):
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"params": str(request.url.params)})
+    stub.responder = lento
+    
+    respuestas = ejecutar(stub, ("GET", "/api/equipos?estado=activo"), ("GET", "/api/equipos?estado=baja"), concurrentes=True)
+    
+    assert len(stub.llamadas) == 2
+    assert respuestas[0].json() != respuestas[1].json()
+
+def test_single_flight_no_reutiliza_llamadas_terminadas(stub):
+    ejecutar(stub, ("GET", "/api/equipos/1"), ("GET", "/api/equipos/1"))
+    assert len(stub.llamadas) == 2
+
+# ---------- ETag, 304 y compresión ----------
+
+def test_etag_y_304_con_if_none_match(stub):
+    stub.responder = lambda request: httpx.Response(200, json={"id": 1})
+    primera, = ejecutar(stub, ("GET", "/api/equipos/1", {"headers": {"Accept-Encoding": "identity"}}))
+    etag = primera.headers["etag"]
+    
+    segunda, distinta = ejecutar(
+        stub,
+        ("GET", "/api/equipos/1", {"headers": {"If-None-Match": etag}}),
+        ("GET", "/api/equipos/1", {"headers": {"If-None-Match": '"otro"'}}),
+    )
+    assert segunda.status_code == 304
+    assert segunda.content == b""
+    assert segunda.headers["etag"] == etag
+    assert distinta.status_code == 200
+
+def test_variante_comprimida_lleva_etag_propio_y_admite_304(stub):
+    grande = {"datos": "x" * 4096}
+    stub.responder = lambda request: httpx.Response(200, json=grande)
+    
+    comprimida, = ejecutar(stub, ("GET", "/api/equipos/1", {"headers": {"Accept-Encoding": "gzip"}}))
+    assert comprimida.headers["content-encoding"] == "gzip"
+    assert comprimida.headers["etag"].endswith('-gzip"')
+    assert comprimida.headers["vary"] == "Accept-Encoding"
+    assert comprimida.json() == grande
+    
+    revalidada, = ejecutar(
+        stub,
+        ("GET", "/api/equipos/1", {"headers": {"Accept-Encoding": "identity", "If-None-Match": "W/" + comprimida.headers["etag"]}}),
+    )
+    assert revalidada.status_code == 304
+
+def test_respuestas_de_error_no_llevan_etag(stub):
+    stub.responder = lambda request: httpx.Response(404, json={"detail": "no encontrado"})
+    respuesta, = ejecutar(stub, ("GET", "/api/equipos/99"))
+    assert respuesta.status_code == 404
+    assert "etag" not in respuesta.headers
+
+def test_etag_coincide_normaliza_candidatos(gateway):
+    etag = gateway.calcular_etag(b"{}")
+    assert gateway.etag_coincide(f'"otro", W/{etag[:-1]}-br"', etag)
+    assert gateway.etag_coincide("*", etag)
+    assert not gateway.etag_coincide(None, etag)
+    assert not gateway.etag_coincide('"otro"', etag)
+
+# ---------- X-Request-ID ----------
+
+def backend_con_traza(request):
+    """Respuesta de un backend real: devuelve el X-Request-ID recibido"""
+    return httpx.Response(200, json={"ok": True}, headers={"X-Request-ID": request.headers.get("x-request-id", "")})
+
+def test_respuesta_cacheada_lleva_el_id_de_la_peticion_actual(stub):
+    stub.responder = backend_con_traza
+    primera, segunda = ejecutar(
+        stub,
+        ("GET", "/api/categorias", {"headers": {"X-Request-ID": "traza-1"}}),
+        ("GET", "/api/categorias", {"headers": {"X-Request-ID": "traza-2"}}),
+    )
+    assert segunda.headers["x-cache"] == "HIT"
+    assert primera.headers.get_list("x-request-id") == ["traza-1"]
+    assert segunda.headers.get_list("x-request-id") == ["traza-2"]
+
+def test_peticiones_coalescidas_conservan_su_id(stub):
+    async def lento(request):
+        await asyncio.sleep(0.05)
+        return backend_con_traza(request)
+    stub.responder = lento
+    
+    respuestas = ejecutar(
+        stub,
+        *[("GET", "/api/equipos/1", {"headers": {"X-Request-ID": f"traza-{i}"}}) for i in range(3)],
+        concurrentes=True
+    )
+    
+    assert len(stub.llamadas) == 1
+    assert [r.headers.get_list("x-request-id") for r in respuestas] == [["traza-0"], ["traza-1"], ["traza-2"]]
+
+def test_respuesta_sin_cache_reemplaza_el_id_del_backend(stub):
+    stub.responder = lambda request: httpx.Response(201, json={}, headers={"X-Request-ID": "id-del-backend"})
+    respuesta, = ejecutar(stub, ("POST", "/api/equipos", {"json": {}, "headers": {"X-Request-ID": "traza-1"}}))
+    assert respuesta.headers.get_list("x-request-id") == ["traza-1"]
+
+# ---------- Batch ----------
+
+def test_batch_devuelve_el_status_de_cada_peticion(stub):
+    def responder(request):
+        if request.url.path == "/equipos/2":
+            return httpx.Response(404, json={"detail": "Equipo no encontrado"})
+        return httpx.Response(200, json={"path": request.url.path})
+    stub.responder = responder
+    
+    respuesta, = ejecutar(stub, ("POST", "/api/batch", {"json": {"requests": [
+        {"id": "uno", "path": "/api/equipos/1"},
+        {"path": "/api/equipos/2"},
+        {"method": "post", "path": "/api/proveedores", "body": {"razon_social": "ACME"}},
+    ]}}))
+    
+    assert respuesta.status_code == 200
+    assert respuesta.json()["responses"] == [
+        {"id": "uno", "status": 200, "body": {"path": "/equipos/1"}},
+        {"id": "1", "status": 404, "body": {"detail": "Equipo no encontrado"}},
+        {"id": "2", "status": 200, "body": {"path": "/proveedores"}},
+    ]
+    post, = [r for r in stub.llamadas if r.method == "POST"]
+    assert json.loads(post.content) == {"razon_social": "ACME"}
+
+def test_batch_rechaza_metodos_y_rutas_no_permitidos_por_elemento(stub):
+    respuesta, = ejecutar(stub, ("POST", "/api/batch", {"json": {"requests": [
+        {"method": "PATCH", "path": "/api/equipos/1"},
+        {"path": "/health"},
+        {"path": "/api/equipos/1"},
+    ]}}))
+    
+    assert [r["status"] for r in respuesta.json()["responses"]] == [405, 400, 200]
+    assert stub.rutas() == ["/equipos/1"]
+
+@pytest.mark.parametrize("ruta", [
+    "/api/batch",
+    "/api/batch/",
+    "/api/batch?x=1",
+    "/api/../api/batch",
+    "/api/equipos/../batch",
+    "/api/%2e%2e/api/batch",
+    "/api//batch",
+    "/api/./batch",
+])
+def test_batch_no_admite_batches_anidados(gateway, stub, ruta):
+    respuesta, = ejecutar(stub, ("POST", "/api/batch", {"json": {"requests": [
+        {"method": "POST", "path": ruta, "body": {"requests": [{"path": "/api/equipos/1"}]}},
+    ]}}))
+    
+    elemento, = respuesta.json()["responses"]
+    assert elemento["status"] == 400
+    assert "responses" not in elemento["body"]
+    assert stub.llamadas == []
+
+@pytest.mark.parametrize("cantidad", [0, 4])
+def test_batch_vacio_o_mayor_que_el_limite_responde_400(gateway, stub, monkeypatch, cantidad):
+    monkeypatch.setattr(gateway, "BATCH_MAX_REQUESTS", 3)
+    
+    respuesta, = ejecutar(stub, ("POST", "/api/batch", {"json": {"requests": [{"path": "/api/equipos/1"}] * cantidad}}))
+    
+    assert respuesta.status_code == 400
+    assert stub.llamadas == []
+
+def test_batch_ejecuta_las_peticiones_en_paralelo_con_el_limite_de_cada_backend(gateway, stub, monkeypatch):
+    async def lento(request):
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"path": request.url.path})
+    stub.responder = lento
+    monkeypatch.setattr(gateway.BACKENDS["equipos"], "max_concurrent", 2)
+    
+    respuesta, = ejecutar(stub, ("POST", "/api/batch", {"json": {"requests": [
+        {"path": f"/api/equipos/{i}"} for i in range(3)
+    ] + [{"path": "/api/proveedores/1"}]}}))
+    
+    estados = [r["status"] for r in respuesta.json()["responses"]]
+    # Concurrentes: el tercer GET a equipos supera max_concurrent del backend
+    assert sorted(estados[:3]) == [200, 200, 429]
+    assert estados[3] == 200
+    assert gateway.BACKENDS["equipos"].en_curso == 0
+
+# ---------- Balanceo entre réplicas ----------
+
+def backend_con_replicas(gateway, monkeypatch, estrategia, *urls):
+    backend = gateway.BACKENDS["equipos"]
+    monkeypatch.setattr(backend, "replicas", [gateway.Replica(url) for url in urls])
+    monkeypatch.setattr(backend, "estrategia", estrategia)
+    monkeypatch.setattr(backend, "_turno", 0)
+    return backend
+
+def test_round_robin_alterna_las_replicas_sanas(gateway, stub, monkeypatch):
+    backend = backend_con_replicas(gateway, monkeypatch, "round_robin", "http://a:8001", "http://b:8001", "http://c:8001")
+    
+    elegidas = [backend.elegir_replica().url for _ in range(6)]
+    assert elegidas == ["http://b:8001", "http://c:8001", "http://a:8001"] * 2
+    
+    backend.replicas[1].expulsar()
+    assert {backend.elegir_replica().url for _ in range(4)} == {"http://a:8001", "http://c:8001"}
+
+def test_least_outstanding_elige_la_menos_ocupada_y_reparte_empates(gateway, stub, monkeypatch):
+    backend = backend_con_replicas(gateway, monkeypatch, "least_outstanding", "http://a:8001", "http://b:8001")
+    
+    backend.replicas[0].en_curso = 3
+    assert [backend.elegir_replica().url for _ in range(3)] == ["http://b:8001"] * 3
+    
+    backend.replicas[0].en_curso = 0
+    assert {backend.elegir_replica().url for _ in range(2)} == {"http://a:8001", "http://b:8001"}
+
+def test_con_todas_las_replicas_expulsadas_se_usan_todas(gateway, stub, monkeypatch):
+    backend = backend_con_replicas(gateway, monkeypatch, "round_robin", "http://a:8001", "http://b:8001")
+    for replica in backend.replicas:
+        replica.expulsar()
+    
+    assert {backend.elegir_replica().url for _ in range(2)} == {"http://a:8001", "http://b:8001"}
+
+def test_connect_error_expulsa_la_replica(gateway, stub, monkeypatch):
+    backend = backend_con_replicas(gateway, monkeypatch, "round_robin", "http://a:8001", "http://b:8001")
+    
+    def responder(request):
+        if request.url.host == "b":
+            raise httpx.ConnectError("Connection refused", request=request)
+        return httpx.Response(200, json={"replica": request.url.host})
+    stub.responder = responder
+    
+    respuestas = ejecutar(stub, *[("GET", f"/api/equipos/{i}") for i in range(3)])
+    
+    # La primera va a b (turno 1) y falla; las siguientes solo van a a
+    assert [r.status_code for r in respuestas] == [503, 200, 200]
+    assert [r.url.host for r in stub.llamadas] == ["b", "a", "a"]
+    a, b = backend.replicas
+    assert (a.sana, b.sana) == (True, False)
+    assert b.expulsiones == 1
+    assert (a.en_curso, b.en_curso, backend.en_curso) == (0, 0, 0)
+
+def test_health_check_expulsa_tras_varios_fallos_y_readmite(gateway, stub, monkeypatch):
+    backend = backend_con_replicas(gateway, monkeypatch, "round_robin", "http://a:8001")
+    replica, = backend.replicas
+    monkeypatch.setattr(gateway, "HEALTH_CHECK_FAILURES", 2)
+    
+    def verificar():
+        asyncio.run(gateway.verificar_replica(backend, replica))
+    
+    stub.responder = lambda request: httpx.Response(503, json={"status": "unhealthy"})
+    verificar()
+    assert replica.sana is True
+    verificar()
+    assert replica.sana is False and replica.expulsiones == 1
+    
+    def sin_conexion(request):
+        raise httpx.ConnectError("Connection refused", request=request)
+    stub.responder = sin_conexion
+    verificar()
+    assert replica.sana is False and replica.expulsiones == 1
+    
+    stub.responder = lambda request: httpx.Response(200, json={"status": "healthy"})
+    verificar()
+    assert replica.sana is True and replica.fallos_health == 0
+    assert stub.rutas() == ["/health"] * 4
+
+def test_replica_readmitida_vuelve_a_recibir_peticiones(gateway, stub, monkeypatch):
+    backend = backend_con_replicas(gateway, monkeypatch, "round_robin", "http://a:8001", "http://b:8001")
+    backend.replicas[1].expulsar()
+    
+    ejecutar(stub, ("GET", "/api/equipos/1"), ("GET", "/api/equipos/2"))
+    assert [r.url.host for r in stub.llamadas] == ["a", "a"]
+    
+    asyncio.run(gateway.verificar_replica(backend, backend.replicas[1]))
+    ejecutar(stub, ("GET", "/api/equipos/3"), ("GET", "/api/equipos/4"))
+    assert sorted(r.url.host for r in stub.llamadas[3:]) == ["a", "b"]
+
+# ---------- Streaming ----------
+
+def test_exportacion_en_streaming_se_reenvia_bloque_a_bloque(gateway, stub):
+    """El gateway entrega cada bloque del backend sin esperar al cuerpo completo"""
+    async def escenario():
+        continuar = asyncio.Event()
+        terminado = False
+        
+        async def cuerpo():
+            nonlocal terminado
+            yield b"codigo_inventario,nombre\r\n"
+            await continuar.wait()
+            yield b"EQ-001,Laptop\r\n"
+            terminado = True
+        
+        stub.responder = lambda request: httpx.Response(200, headers={"content-type": "text/csv"}, content=cuerpo())
+        
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": "GET", "scheme": "http", "path": "/api/reportes/export/stream/equipos",
+            "raw_path": b"/api/reportes/export/stream/equipos", "query_string": b"format=csv",
+            "root_path": "", "headers": [(b"host", b"gateway")],
+            "client": ("127.0.0.1", 1234), "server": ("gateway", 80),
+        }
+        enviados = []
+        primer_bloque = asyncio.Event()
+        peticion = [{"type": "http.request", "body": b"", "more_body": False}]
+        
+        async def receive():
+            # Tras el cuerpo de la petición el cliente sigue conectado
+            if peticion:
+                return peticion.pop()
+            await asyncio.Event().wait()
+        
+        async def send(mensaje):
+            enviados.append(mensaje)
+            if mensaje["type"] == "http.response.body" and mensaje.get("body"):
+                primer_bloque.set()
+        
+        tarea = asyncio.create_task(stub.app(scope, receive, send))
+        await asyncio.wait_for(primer_bloque.wait(), 5)
+        
+        # El primer bloque ya llegó al cliente y el backend sigue a medias
+        assert not terminado
+        cuerpos = [m["body"] for m in enviados if m["type"] == "http.response.body" and m.get("body")]
+        assert cuerpos == [b"codigo_inventario,nombre\r\n"]
+        
+        continuar.set()
+        await asyncio.wait_for(tarea, 5)
+        return enviados
+    
+    enviados = asyncio.run(escenario())
+    
+    inicio = next(m for m in enviados if m["type"] == "http.response.start")
+    assert inicio["status"] == 200
+    assert (b"content-type", b"text/csv") in inicio["headers"]
+    cuerpos = [m["body"] for m in enviados if m["type"] == "http.response.body" and m.get("body")]
+    assert cuerpos == [b"codigo_inventario,nombre\r\n", b"EQ-001,Laptop\r\n"]
+    assert stub.rutas() == ["/export/stream/equipos"]
+    assert stub.llamadas[0].url.params["format"] == "csv"
+    assert gateway.BACKENDS["reportes"].en_curso == 0
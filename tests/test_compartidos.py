@@ -0,0 +1,59 @@
+import asyncio
+import importlib.util
+from pathlib import Path
+
+import httpx
+import pytest
+
+RAIZ = Path(__file__).resolve().parent.parent
+
+def cargar_sincronizador():
+    spec = importlib.util.spec_from_file_location("sincronizar_compartidos", RAIZ / "scripts" / "sincronizar_compartidos.py")
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+SINCRONIZADOR = cargar_sincronizador()
+
+@pytest.mark.parametrize("fuente,copia", list(SINCRONIZADOR.copias()), ids=lambda p: p.parent.name)
+def test_copias_identicas_a_la_fuente(fuente, copia):
+    assert copia.exists(), f"Falta {copia}: ejecutar scripts/sincronizar_compartidos.py"
+    assert copia.read_bytes() == fuente.read_bytes(), f"{copia} difiere de {fuente}: ejecutar scripts/sincronizar_compartidos.py"
+
+@pytest.mark.parametrize("servicio", SINCRONIZADOR.COMPARTIDOS["observabilidad.py"])
+def test_servicios_no_redefinen_la_observabilidad(servicio):
+    codigo = (RAIZ / "services" / servicio / "main.py").read_text(encoding="utf-8")
+    assert "from observabilidad import" in codigo
+    for definicion in ("class MetricsMiddleware", "class TracingMiddleware", "def acquire_connection", "def registrar_span"):
+        assert definicion not in codigo
+
+def test_latencia_http_etiquetada_con_status(equipos):
+    latencia = equipos.instrumentar.__globals__["HTTP_LATENCY"]
+    
+    async def escenario():
+        transporte = httpx.ASGITransport(app=equipos.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://equipos") as cliente:
+            await cliente.get("/health")
+            await cliente.get("/no-existe")
+    asyncio.run(escenario())
+    
+    etiquetas = {
+        (s.labels["route"], s.labels["status"])
+        for metrica in latencia.collect() for s in metrica.samples
+        if s.name.endswith("_count")
+    }
+    assert ("/health", "200") in etiquetas
+    assert ("sin_ruta", "404") in etiquetas
+
+@pytest.mark.parametrize("servicio", SINCRONIZADOR.COMPARTIDOS["referencias.py"])
+def test_servicios_no_redefinen_la_cache_de_referencias(servicio):
+    codigo = (RAIZ / "services" / servicio / "main.py").read_text(encoding="utf-8")
+    assert "from referencias import" in codigo
+    for definicion in ("def escuchar_referencias", "def obtener_referencia", "_referencias_activas"):
+        assert definicion not in codigo
+
+@pytest.mark.parametrize("servicio", SINCRONIZADOR.COMPARTIDOS["proyeccion.py"])
+def test_servicios_usan_la_proyeccion_compartida(servicio):
+    codigo = (RAIZ / "services" / servicio / "main.py").read_text(encoding="utf-8")
+    assert "from proyeccion import parsear_campos" in codigo
+    assert "def parsear_campos" not in codigo
@@ -0,0 +1,424 @@
+import asyncio
+import json
+import re
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from conftest import cargar_servicio
+from fakes import usar_conexion
+
+def filas_equipos(n, inicio=datetime(2024, 1, 31, 12, 0)):
+    """Filas con todas las columnas del listado, ordenadas como las devuelve la consulta"""
+    columnas = cargar_servicio("equipos_service").COLUMNAS_EQUIPOS
+    return [
+        {**dict.fromkeys(columnas), "id": 100 - i, "fecha_registro": inicio - timedelta(days=i),
+         "codigo_inventario": f"EQ-{i}", "nombre": f"Equipo {i}"}
+        for i in range(n)
+    ]
+
+# ---------- Paginación por cursor ----------
+
+def test_cursor_ida_y_vuelta(equipos):
+    fecha = datetime(2024, 5, 1, 8, 30, 15, 123456)
+    assert equipos.decode_cursor(equipos.encode_cursor(fecha, 42)) == (fecha, 42)
+
+def test_cursor_invalido_responde_400(equipos):
+    with pytest.raises(HTTPException) as exc:
+        equipos.decode_cursor("no-es-un-cursor")
+    assert exc.value.status_code == 400
+
+def test_listado_pide_una_fila_extra_y_devuelve_next_cursor(equipos, monkeypatch):
+    filas = filas_equipos(3)
+    conn = usar_conexion(monkeypatch, equipos, lambda metodo, sql, args: filas)
+    
+    resultado = asyncio.run(equipos.get_equipos(limit=2))
+    
+    _, sql, args = conn.consultas[0]
+    assert "ORDER BY e.fecha_registro DESC, e.id DESC" in sql
+    assert args[-1] == 3
+    assert [e["id"] for e in resultado["items"]] == [100, 99]
+    assert equipos.decode_cursor(resultado["next_cursor"]) == (filas[1]["fecha_registro"], 99)
+
+def test_ultima_pagina_sin_next_cursor(equipos, monkeypatch):
+    usar_conexion(monkeypatch, equipos, lambda metodo, sql, args: filas_equipos(2))
+    resultado = asyncio.run(equipos.get_equipos(limit=2))
+    assert resultado["next_cursor"] is None
+    assert len(resultado["items"]) == 2
+
+def test_cursor_filtra_por_clave_compuesta(equipos, monkeypatch):
+    conn = usar_conexion(monkeypatch, equipos, lambda metodo, sql, args: [])
+    fecha = datetime(2024, 1, 30, 12, 0)
+    
+    asyncio.run(equipos.get_equipos(estado="operativo", limit=10, cursor=equipos.encode_cursor(fecha, 99)))
+    
+    _, sql, args = conn.consultas[0]
+    assert "AND (e.fecha_registro, e.id) < ($2, $3)" in sql
+    assert args == ("operativo", fecha, 99, 11)
+
+@pytest.mark.parametrize("limit", [0, 1001])
+def test_limit_fuera_de_rango(equipos, monkeypatch, limit):
+    usar_conexion(monkeypatch, equipos)
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(equipos.get_equipos(limit=limit))
+    assert exc.value.status_code == 400
+
+# ---------- Proyección de campos (fields=) ----------
+
+def test_parsear_campos_sin_fields_devuelve_todas_las_columnas(equipos):
+    assert equipos.parsear_campos(None, equipos.COLUMNAS_EQUIPOS) == list(equipos.COLUMNAS_EQUIPOS)
+
+def test_parsear_campos_quita_espacios_y_repetidos(equipos):
+    campos = equipos.parsear_campos(" nombre,id ,nombre,,", equipos.COLUMNAS_EQUIPOS)
+    assert campos == ["nombre", "id"]
+
+@pytest.mark.parametrize("fields", ["nombre,password", "e.id", ",", "nombre; DROP TABLE equipos"])
+def test_parsear_campos_rechaza_campos_fuera_de_la_lista_blanca(equipos, fields):
+    with pytest.raises(HTTPException) as exc:
+        equipos.parsear_campos(fields, equipos.COLUMNAS_EQUIPOS)
+    assert exc.value.status_code == 400
+
+def test_listado_proyectado_solo_selecciona_los_campos_pedidos(equipos, monkeypatch):
+    filas = [{**fila, "categoria_nombre": "Laptop"} for fila in filas_equipos(3)]
+    conn = usar_conexion(monkeypatch, equipos, lambda metodo, sql, args: filas)
+    
+    resultado = asyncio.run(equipos.get_equipos(limit=2, fields="codigo_inventario,categoria_nombre"))
+    
+    _, sql, _ = conn.consultas[0]
+    seleccion = sql.split(" FROM ")[0]
+    # fecha_registro e id se seleccionan siempre para construir el cursor
+    assert seleccion == (
+        "SELECT e.codigo_inventario AS codigo_inventario, c.nombre AS categoria_nombre, "
+        "e.fecha_registro AS fecha_registro, e.id AS id"
+    )
+    assert "JOIN categorias_equipos" in sql
+    assert "JOIN ubicaciones" not in sql and "JOIN proveedores" not in sql
+    assert resultado["items"][0] == {"codigo_inventario": "EQ-0", "categoria_nombre": "Laptop"}
+    assert equipos.decode_cursor(resultado["next_cursor"]) == (filas[1]["fecha_registro"], filas[1]["id"])
+
+def test_listado_proyectado_une_categorias_si_se_filtra_por_ellas(equipos, monkeypatch):
+    conn = usar_conexion(monkeypatch, equipos, lambda metodo, sql, args: [])
+    
+    asyncio.run(equipos.get_equipos(categoria="Laptop", limit=10, fields="id,nombre"))
+    
+    _, sql, args = conn.consultas[0]
+    assert "LEFT JOIN categorias_equipos c" in sql and "AND c.nombre = $1" in sql
+    assert args == ("Laptop", 11)
+
+def test_listado_sin_fields_une_todas_las_tablas(equipos, monkeypatch):
+    conn = usar_conexion(monkeypatch, equipos, lambda metodo, sql, args: [])
+    
+    asyncio.run(equipos.get_equipos(limit=10))
+    
+    _, sql, _ = conn.consultas[0]
+    for join in equipos.JOINS_EQUIPOS.values():
+        assert join in sql
+
+def test_fields_invalido_responde_400_sin_consultar(equipos, monkeypatch):
+    conn = usar_conexion(monkeypatch, equipos)
+    
+    async def escenario():
+        transporte = httpx.ASGITransport(app=equipos.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://equipos") as cliente:
+            return await cliente.get("/equipos", params={"fields": "id,no_existe"})
+    respuesta = asyncio.run(escenario())
+    
+    assert respuesta.status_code == 400
+    assert "no_existe" in respuesta.json()["detail"]
+    assert conn.consultas == []
+
+# ---------- Búsqueda ----------
+
+def test_busqueda_combina_texto_completo_y_trigramas(equipos, monkeypatch):
+    filas = [{"id": 7, "nombre": "Laptop Dell", "busqueda": "'dell':2", "relevancia": 0.123456, "especificaciones": '{"ram": "16GB"}'}]
+    conn = usar_conexion(monkeypatch, equipos, lambda metodo, sql, args: filas)
+    
+    resultado = asyncio.run(equipos.search_equipos(q="  lapto dell ", limit=5))
+    
+    _, sql, args = conn.consultas[0]
+    assert "websearch_to_tsquery('spanish', $1)" in sql
+    assert "e.busqueda @@ b.consulta" in sql and "$1 <% e.nombre" in sql
+    assert "ILIKE $2" in sql
+    assert sql.endswith("ORDER BY relevancia DESC, e.id DESC LIMIT $3")
+    assert args == ("lapto dell", "%lapto dell%", 5)
+    assert resultado["query"] == "lapto dell"
+    assert resultado["items"] == [{"id": 7, "nombre": "Laptop Dell", "relevancia": 0.1235, "especificaciones": {"ram": "16GB"}}]
+
+def test_busqueda_con_filtros(equipos, monkeypatch):
+    conn = usar_conexion(monkeypatch, equipos, lambda metodo, sql, args: [])
+    
+    asyncio.run(equipos.search_equipos(q="dell", categoria="Laptop", estado="operativo", limit=10))
+    
+    _, sql, args = conn.consultas[0]
+    assert "AND c.nombre = $3" in sql and "AND e.estado_operativo = $4" in sql
+    assert sql.endswith("LIMIT $5")
+    assert args == ("dell", "%dell%", "Laptop", "operativo", 10)
+
+@pytest.mark.parametrize("q,esperado", [
+    ("50%", "%50\\%%"),
+    ("SN_01", "%SN\\_01%"),
+    ("a\\b", "%a\\\\b%"),
+])
+def test_busqueda_escapa_comodines_del_ilike(equipos, monkeypatch, q, esperado):
+    conn = usar_conexion(monkeypatch, equipos, lambda metodo, sql, args: [])
+    
+    asyncio.run(equipos.search_equipos(q=q))
+    
+    _, _, args = conn.consultas[0]
+    assert args[0] == q
+    assert args[1] == esperado
+
+@pytest.mark.parametrize("q,limit", [("a", 20), ("  a  ", 20), ("dell", 0), ("dell", 101)])
+def test_busqueda_invalida_responde_400_sin_consultar(equipos, monkeypatch, q, limit):
+    conn = usar_conexion(monkeypatch, equipos)
+    
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(equipos.search_equipos(q=q, limit=limit))
+    
+    assert exc.value.status_code == 400
+    assert conn.consultas == []
+
+# ---------- Importación en bloque ----------
+
+CSV_IMPORTACION = """codigo_inventario,categoria_id,nombre,especificaciones,numero_serie
+EQ-1,1,Laptop 1,"{""ram"": ""16GB""}",S-1
+EQ-2,,Laptop 2,,S-2
+EQ-1,1,Laptop repetida,,S-3
+EQ-4,1,Laptop 4,{no es json,S-4
+EQ-5,2,Monitor 5,,S-5
+"""
+
+def pedir_importacion(equipos, cuerpo: bytes, params: str, content_type: str = "text/csv"):
+    async def escenario():
+        transporte = httpx.ASGITransport(app=equipos.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://equipos") as cliente:
+            return await cliente.post(f"/equipos/import{params}", content=cuerpo, headers={"Content-Type": content_type})
+    return asyncio.run(escenario())
+
+def test_parsear_importacion_informa_errores_con_una_sola_forma(equipos):
+    validos, errores = equipos.parsear_importacion(CSV_IMPORTACION, "csv")
+    
+    assert [fila for fila, _ in validos] == [1, 5]
+    assert validos[0][1].especificaciones == {"ram": "16GB"}
+    assert [e["fila"] for e in errores] == [2, 3, 4]
+    assert all(set(e) == {"fila", "codigo_inventario", "errores"} for e in errores)
+    assert all(isinstance(e["errores"], list) and e["errores"] for e in errores)
+    assert errores[0]["codigo_inventario"] == "EQ-2"
+    assert errores[1]["errores"] == ["codigo_inventario repetido en el fichero"]
+
+def test_parsear_importacion_ndjson_mal_formado(equipos):
+    validos, errores = equipos.parsear_importacion('{"codigo_inventario": "EQ-1"\n\n[1, 2]\n', "ndjson")
+    assert validos == []
+    assert [e["fila"] for e in errores] == [1, 2]
+    assert errores[0]["codigo_inventario"] is None
+
+def test_parsear_importacion_rechaza_lo_que_la_base_no_admite(equipos):
+    lineas = [
+        {"codigo_inventario": "EQ-1", "categoria_id": 1, "nombre": "N" * 201},
+        {"codigo_inventario": "EQ-2", "categoria_id": 1, "nombre": "Servidor", "costo_compra": 1e10},
+        {"codigo_inventario": "EQ-3", "categoria_id": 1, "nombre": "Servidor", "costo_compra": 9999999999.995},
+        {"codigo_inventario": "EQ-4", "categoria_id": 2**31, "nombre": "Monitor", "marca": "M" * 101},
+        {"codigo_inventario": "EQ-5", "categoria_id": 1, "nombre": "Portátil\x00"},
+        {"codigo_inventario": "EQ-6", "categoria_id": 1, "nombre": "Portátil", "especificaciones": {"ram": "\x00"}},
+        {"codigo_inventario": "EQ-7", "categoria_id": 1, "nombre": "N" * 200, "costo_compra": 9999999999.99},
+    ]
+    contenido = "\n".join(json.dumps(linea) for linea in lineas)
+    contenido += '\n{"codigo_inventario": "EQ-8", "categoria_id": 1, "nombre": "X", "costo_compra": NaN}'
+    
+    validos, errores = equipos.parsear_importacion(contenido, "ndjson")
+    
+    assert [fila for fila, _ in validos] == [7]
+    assert [(e["fila"], e["codigo_inventario"]) for e in errores] == [(i, f"EQ-{i}") for i in (1, 2, 3, 4, 5, 6, 8)]
+    assert all(set(e) == {"fila", "codigo_inventario", "errores"} for e in errores)
+    assert errores[0]["errores"] == ["nombre: admite como máximo 200 caracteres"]
+    assert errores[1]["errores"][0].startswith("costo_compra:")
+    assert errores[3]["errores"] == ["marca: admite como máximo 100 caracteres", "categoria_id: fuera de rango"]
+
+def test_longitudes_de_importacion_coinciden_con_el_esquema(equipos):
+    sql = (Path(__file__).resolve().parent.parent / "database" / "schema.sql").read_text(encoding="utf-8")
+    tabla = re.search(r"CREATE TABLE IF NOT EXISTS equipos \((.*?)\n\);", sql, re.S).group(1)
+    longitudes = {columna: int(n) for columna, n in re.findall(r"^\s+(\w+) VARCHAR\((\d+)\)", tabla, re.M)}
+    assert equipos.LONGITUDES_EQUIPOS == longitudes
+    assert "costo_compra DECIMAL(12,2)" in tabla
+
+def test_importacion_limita_el_numero_de_filas(equipos, monkeypatch):
+    monkeypatch.setattr(equipos, "EQUIPOS_IMPORT_MAX_ROWS", 2)
+    with pytest.raises(HTTPException) as exc:
+        equipos.parsear_importacion(CSV_IMPORTACION, "csv")
+    assert exc.value.status_code == 413
+
+def test_importacion_valida_referencias_y_carga_con_copy(equipos, monkeypatch):
+    def handler(metodo, sql, args):
+        if metodo == "fetch" and "FROM import_equipos" in sql:
+            return [{
+                "fila": 5, "categoria_invalida": True, "proveedor_invalido": False,
+                "ubicacion_invalida": False, "usuario_invalido": False,
+                "codigo_existente": False, "serie_existente": True,
+            }]
+    conn = usar_conexion(monkeypatch, equipos, handler)
+    
+    respuesta = pedir_importacion(equipos, CSV_IMPORTACION.encode(), "?format=csv")
+    
+    assert respuesta.status_code == 200
+    informe = respuesta.json()
+    assert (informe["total"], informe["validos"], informe["insertados"], informe["rechazados"]) == (5, 1, 1, 4)
+    assert informe["errores"][-1] == {
+        "fila": 5, "codigo_inventario": "EQ-5",
+        "errores": ["La categoría no existe", "El número de serie ya está registrado"],
+    }
+    tablas = [tabla for tabla, _, _ in conn.copias]
+    assert tablas == ["import_equipos", "equipos"]
+    assert [r[0] for r in conn.copias[1][1]] == ["EQ-1"]
+    assert conn.transacciones == 1
+
+def test_importacion_solo_validar_no_inserta(equipos, monkeypatch):
+    conn = usar_conexion(monkeypatch, equipos)
+    cuerpo = b'{"codigo_inventario": "EQ-1", "categoria_id": 1, "nombre": "Laptop"}\n'
+    
+    respuesta = pedir_importacion(equipos, cuerpo, "?solo_validar=true", "application/x-ndjson")
+    
+    assert respuesta.json()["insertados"] == 0
+    assert respuesta.json()["validos"] == 1
+    assert [tabla for tabla, _, _ in conn.copias] == ["import_equipos"]
+
+def test_importacion_formato_no_soportado(equipos, monkeypatch):
+    usar_conexion(monkeypatch, equipos)
+    respuesta = pedir_importacion(equipos, b"x", "?format=xml")
+    assert respuesta.status_code == 400
+
+# ---------- Movimientos en bloque ----------
+
+def lote(equipos, ids, **campos):
+    datos = {"equipo_ids": ids, "ubicacion_destino_id": 7, "usuario_responsable_id": 3, "motivo": "Traslado"}
+    datos.update(campos)
+    return equipos.MovimientoBatchCreate(**datos)
+
+def handler_movimientos(existentes):
+    def handler(metodo, sql, args):
+        if "FOR UPDATE" in sql:
+            return [{"id": i} for i in sorted(existentes) if i in args[0]]
+        if "INSERT INTO movimientos_equipos" in sql:
+            return [{"id": 500 + i, "equipo_id": i} for i in sorted(args[0])]
+    return handler
+
+def test_lote_mueve_todos_en_una_transaccion(equipos, monkeypatch):
+    conn = usar_conexion(monkeypatch, equipos, handler_movimientos({1, 2, 3}))
+    
+    resultado = asyncio.run(equipos.create_movimientos_batch(lote(equipos, [3, 1, 3, 2])))
+    
+    assert resultado["movidos"] == 3
+    assert resultado["equipo_ids"] == [1, 2, 3]
+    assert resultado["movimiento_ids"] == [501, 502, 503]
+    assert conn.transacciones == 1
+    bloqueo, insercion, actualizacion = conn.consultas
+    # Ids sin repetir, bloqueados en orden de id
+    assert bloqueo[2] == ([3, 1, 2],) and "ORDER BY id FOR UPDATE" in bloqueo[1]
+    assert "INSERT INTO movimientos_equipos" in insercion[1] and "SELECT e.id, e.ubicacion_actual_id" in insercion[1]
+    assert "unnest($1::int[])" in actualizacion[1] and actualizacion[2] == ([3, 1, 2], 7)
+
+def test_lote_con_equipos_inexistentes_no_mueve_ninguno(equipos, monkeypatch):
+    conn = usar_conexion(monkeypatch, equipos, handler_movimientos({1}))
+    
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(equipos.create_movimientos_batch(lote(equipos, [1, 8, 9])))
+    
+    assert exc.value.status_code == 404
+    assert "[8, 9]" in exc.value.detail
+    assert len(conn.consultas) == 1
+
+@pytest.mark.parametrize("ids,limite", [([], 10), ([1, 2, 3], 2)])
+def test_lote_vacio_o_demasiado_grande_responde_400(equipos, monkeypatch, ids, limite):
+    conn = usar_conexion(monkeypatch, equipos)
+    monkeypatch.setattr(equipos, "MOVIMIENTOS_BATCH_MAX", limite)
+    
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(equipos.create_movimientos_batch(lote(equipos, ids)))
+    
+    assert exc.value.status_code == 400
+    assert conn.consultas == []
+
+def test_lote_con_ubicacion_inexistente_responde_400(equipos, monkeypatch):
+    base = handler_movimientos({1})
+    
+    def handler(metodo, sql, args):
+        if "INSERT INTO movimientos_equipos" in sql:
+            return equipos.asyncpg.ForeignKeyViolationError(
+                'insert or update on table "movimientos_equipos" violates foreign key constraint "movimientos_equipos_ubicacion_destino_id_fkey"'
+            )
+        return base(metodo, sql, args)
+    usar_conexion(monkeypatch, equipos, handler)
+    
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(equipos.create_movimientos_batch(lote(equipos, [1])))
+    
+    assert exc.value.status_code == 400
+    assert "ubicación con ID 7" in exc.value.detail
+
+# ---------- Datos de referencia ----------
+
+def cachear_referencias(modulo, monkeypatch, **tablas):
+    """Deja la caché de referencias del servicio activa con las filas dadas"""
+    estado = modulo.obtener_referencia.__globals__
+    monkeypatch.setitem(estado, "_referencias_activas", True)
+    monkeypatch.setitem(estado, "_referencias", tablas)
+
+def test_referencia_en_cache_no_consulta_la_base(equipos, monkeypatch):
+    cachear_referencias(equipos, monkeypatch, proveedores={3: {"id": 3, "activo": True}})
+    conn = usar_conexion(monkeypatch, equipos)
+    
+    fila = asyncio.run(equipos.obtener_referencia(conn, "proveedores", 3))
+    
+    assert fila == {"id": 3, "activo": True}
+    assert conn.consultas == []
+
+def test_referencia_ausente_se_confirma_contra_la_base(equipos, monkeypatch):
+    cachear_referencias(equipos, monkeypatch, proveedores={})
+    conn = usar_conexion(monkeypatch, equipos, lambda metodo, sql, args: {"id": 3, "activo": True})
+    
+    fila = asyncio.run(equipos.obtener_referencia(conn, "proveedores", 3))
+    
+    assert fila == {"id": 3, "activo": True}
+    assert conn.consultas[0][0] == "fetchrow" and conn.consultas[0][2] == (3,)
+
+def test_ubicacion_inactiva_en_cache_se_confirma_antes_de_rechazar(equipos, monkeypatch):
+    # La caché aún no procesó la notificación que reactivó la ubicación
+    cachear_referencias(equipos, monkeypatch, ubicaciones={7: {"id": 7, "activo": False}})
+    
+    def handler(metodo, sql, args):
+        if metodo == "fetchrow" and "FROM ubicaciones" in sql:
+            return {"id": 7, "activo": True}
+        if metodo == "fetchval" and "INSERT INTO equipos" in sql:
+            return 55
+    conn = usar_conexion(monkeypatch, equipos, handler)
+    
+    equipo = equipos.EquipoCreate(codigo_inventario="EQ-1", categoria_id=0, nombre="Portátil", ubicacion_actual_id=7)
+    resultado = asyncio.run(equipos.create_equipo(equipo))
+    
+    assert resultado["id"] == 55
+    assert any("FROM ubicaciones" in sql for sql in conn.sqls("fetchrow"))
+
+def test_ubicacion_inactiva_en_cache_y_en_base_responde_400(equipos, monkeypatch):
+    cachear_referencias(equipos, monkeypatch, ubicaciones={7: {"id": 7, "activo": False}})
+    conn = usar_conexion(monkeypatch, equipos, lambda metodo, sql, args: {"id": 7, "activo": False} if metodo == "fetchrow" else None)
+    
+    equipo = equipos.EquipoCreate(codigo_inventario="EQ-1", categoria_id=0, nombre="Portátil", ubicacion_actual_id=7)
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(equipos.create_equipo(equipo))
+    
+    assert exc.value.status_code == 400
+    assert not any("INSERT INTO equipos" in sql for sql in conn.sqls())
+
+def test_listados_de_referencia_desde_cache_o_base(equipos, monkeypatch):
+    ubicaciones = {1: {"id": 1, "activo": True}, 2: {"id": 2, "activo": False}}
+    conn = usar_conexion(monkeypatch, equipos, lambda metodo, sql, args: list(ubicaciones.values()))
+    
+    # Sin escucha activa se lee de la base
+    assert [u["id"] for u in asyncio.run(equipos.get_ubicaciones())] == [1]
+    assert len(conn.consultas) == 1
+    
+    cachear_referencias(equipos, monkeypatch, ubicaciones=ubicaciones)
+    assert [u["id"] for u in asyncio.run(equipos.get_ubicaciones())] == [1]
+    assert len(conn.consultas) == 1
@@ -0,0 +1,89 @@
+import asyncio
+from datetime import date
+
+import pytest
+from fastapi import HTTPException
+
+from fakes import usar_conexion
+
+def cachear_referencias(modulo, monkeypatch, **tablas):
+    """Deja la caché de referencias del servicio activa con las filas dadas"""
+    estado = modulo.obtener_referencia.__globals__
+    monkeypatch.setitem(estado, "_referencias_activas", True)
+    monkeypatch.setitem(estado, "_referencias", tablas)
+
+def nuevo_mantenimiento(mantenimiento, **campos):
+    return mantenimiento.MantenimientoCreate(
+        equipo_id=1, tipo="preventivo", fecha_programada=date(2024, 6, 1), descripcion="Revisión", **campos
+    )
+
+# ---------- Proyección de campos (fields=) ----------
+
+def test_listado_proyectado_sin_joins_innecesarios(mantenimiento, monkeypatch):
+    conn = usar_conexion(monkeypatch, mantenimiento, lambda metodo, sql, args: [{"id": 1, "estado": "programado"}])
+    
+    resultado = asyncio.run(mantenimiento.get_mantenimientos(estado="programado", fields="id,estado"))
+    
+    _, sql, args = conn.consultas[0]
+    assert sql.startswith("SELECT m.id AS id, m.estado AS estado FROM mantenimientos m WHERE 1=1")
+    assert "JOIN" not in sql
+    assert args == ("programado",)
+    assert resultado == [{"id": 1, "estado": "programado"}]
+
+def test_listado_proyectado_une_solo_las_tablas_pedidas(mantenimiento, monkeypatch):
+    conn = usar_conexion(monkeypatch, mantenimiento, lambda metodo, sql, args: [])
+    
+    asyncio.run(mantenimiento.get_mantenimientos(fields="id,tecnico_nombre"))
+    
+    _, sql, _ = conn.consultas[0]
+    assert "LEFT JOIN usuarios u" in sql
+    assert "JOIN equipos" not in sql and "JOIN proveedores" not in sql
+
+def test_listado_sin_fields_selecciona_todas_las_columnas(mantenimiento, monkeypatch):
+    conn = usar_conexion(monkeypatch, mantenimiento, lambda metodo, sql, args: [])
+    
+    asyncio.run(mantenimiento.get_mantenimientos())
+    
+    _, sql, _ = conn.consultas[0]
+    for campo in mantenimiento.COLUMNAS_MANTENIMIENTOS:
+        assert f" AS {campo}" in sql
+    for join in mantenimiento.JOINS_MANTENIMIENTOS.values():
+        assert join in sql
+
+@pytest.mark.parametrize("fields", ["id,costo_total", ",", "m.*"])
+def test_fields_invalido_responde_400_sin_consultar(mantenimiento, monkeypatch, fields):
+    conn = usar_conexion(monkeypatch, mantenimiento)
+    
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(mantenimiento.get_mantenimientos(fields=fields))
+    
+    assert exc.value.status_code == 400
+    assert conn.consultas == []
+
+# ---------- Datos de referencia ----------
+
+def test_tecnico_con_otro_rol_en_cache_se_confirma_contra_la_base(mantenimiento, monkeypatch):
+    # El usuario pasó a técnico y la caché aún no lo sabe
+    cachear_referencias(mantenimiento, monkeypatch, usuarios={4: {"id": 4, "rol": "usuario", "activo": True}})
+    
+    def handler(metodo, sql, args):
+        if metodo == "fetchrow" and "FROM usuarios" in sql:
+            return {"id": 4, "rol": "tecnico", "activo": True}
+        if metodo == "fetchval":
+            return 1 if "FROM equipos" in sql else 80
+    conn = usar_conexion(monkeypatch, mantenimiento, handler)
+    
+    resultado = asyncio.run(mantenimiento.create_mantenimiento(nuevo_mantenimiento(mantenimiento, tecnico_id=4)))
+    
+    assert resultado["id"] == 80
+    assert any("FROM usuarios" in sql for sql in conn.sqls("fetchrow"))
+
+def test_tecnico_inexistente_responde_400(mantenimiento, monkeypatch):
+    cachear_referencias(mantenimiento, monkeypatch, usuarios={})
+    conn = usar_conexion(monkeypatch, mantenimiento, lambda metodo, sql, args: 1 if metodo == "fetchval" else None)
+    
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(mantenimiento.create_mantenimiento(nuevo_mantenimiento(mantenimiento, tecnico_id=4)))
+    
+    assert exc.value.status_code == 400
+    assert not any("INSERT INTO mantenimientos" in sql for sql in conn.sqls())
@@ -0,0 +1,60 @@
+"""
+Comprobaciones estáticas de database/migrations/. Se aplican en orden sobre
+bases existentes y pueden volver a ejecutarse, así que cada script debe ser
+transaccional e idempotente.
+"""
+import re
+from pathlib import Path
+
+import pytest
+
+RAIZ = Path(__file__).resolve().parent.parent
+MIGRACIONES_DIR = RAIZ / "database" / "migrations"
+SCHEMA_PATH = RAIZ / "database" / "schema.sql"
+MIGRACIONES = sorted(MIGRACIONES_DIR.glob("*.sql"))
+
+def sentencias(sql: str) -> list:
+    """Sentencias del script sin comentarios ni cuerpos de funciones ($$ ... $$)"""
+    sql = re.sub(r"\$\$.*?\$\$", "$$", sql, flags=re.S)
+    sql = re.sub(r"--[^\n]*", "", sql)
+    return [" ".join(s.split()) for s in sql.split(";") if s.strip()]
+
+def test_numeracion_consecutiva():
+    numeros = [int(m.name.split("_")[0]) for m in MIGRACIONES]
+    assert numeros == list(range(1, len(MIGRACIONES) + 1))
+
+@pytest.mark.parametrize("migracion", MIGRACIONES, ids=lambda m: m.name)
+def test_migracion_transaccional(migracion):
+    lista = sentencias(migracion.read_text(encoding="utf-8"))
+    assert lista[0] == "BEGIN" and lista[-1] == "COMMIT"
+
+@pytest.mark.parametrize("migracion", MIGRACIONES, ids=lambda m: m.name)
+def test_migracion_idempotente(migracion):
+    lista = sentencias(migracion.read_text(encoding="utf-8"))
+    for i, sentencia in enumerate(lista):
+        if re.match(r"CREATE (UNIQUE )?INDEX|CREATE TABLE|CREATE MATERIALIZED VIEW|CREATE EXTENSION", sentencia):
+            assert "IF NOT EXISTS" in sentencia, sentencia
+        elif sentencia.startswith("CREATE FUNCTION"):
+            pytest.fail(f"Usar CREATE OR REPLACE FUNCTION: {sentencia}")
+        elif sentencia.startswith("CREATE TRIGGER"):
+            nombre = sentencia.split()[2]
+            assert f"DROP TRIGGER IF EXISTS {nombre}" in lista[i - 1], sentencia
+        elif sentencia.startswith("ALTER TABLE") and " ADD COLUMN " in sentencia:
+            assert "ADD COLUMN IF NOT EXISTS" in sentencia, sentencia
+
+def test_vistas_materializadas_del_esquema_tienen_migracion():
+    esquema = sentencias(SCHEMA_PATH.read_text(encoding="utf-8"))
+    migradas = {s for m in MIGRACIONES for s in sentencias(m.read_text(encoding="utf-8"))}
+    vistas = [s for s in esquema if s.startswith("CREATE MATERIALIZED VIEW")]
+    assert vistas
+    for vista in vistas:
+        assert vista in migradas, vista.split(" AS ")[0]
+
+def test_triggers_del_esquema_tienen_migracion():
+    # Los de la versión inicial del esquema ya existen en todas las bases
+    iniciales = {"trigger_update_equipos_timestamp"}
+    esquema = sentencias(SCHEMA_PATH.read_text(encoding="utf-8"))
+    migradas = {s for m in MIGRACIONES for s in sentencias(m.read_text(encoding="utf-8"))}
+    for trigger in (s for s in esquema if s.startswith("CREATE TRIGGER")):
+        if trigger.split()[2] not in iniciales:
+            assert trigger in migradas, trigger.split()[2]
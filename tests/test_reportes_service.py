@@ -0,0 +1,235 @@
+import asyncio
+import csv
+import io
+import json
+from datetime import date
+from decimal import Decimal
+
+import pytest
+from fastapi import HTTPException
+
+from fakes import usar_conexion
+from schema import columnas_inexistentes, columnas_por_tabla
+
+# ---------- Exportaciones ----------
+
+@pytest.mark.parametrize("tipo", ["equipos", "mantenimientos", "proveedores"])
+def test_consultas_de_exportacion_usan_columnas_del_esquema(reportes, tipo):
+    assert columnas_inexistentes(reportes.consulta_excel(tipo)) == []
+    query, headers = reportes.consulta_pdf(tipo)
+    assert columnas_inexistentes(query) == []
+
+# ---------- Exportación en streaming ----------
+
+FILAS_STREAM = [
+    {"codigo_inventario": "EQ-001", "nombre": "Laptop, 14\"", "fecha_compra": date(2024, 3, 1), "costo_compra": Decimal("1200.50")},
+    {"codigo_inventario": "EQ-002", "nombre": "Monitor", "fecha_compra": None, "costo_compra": None},
+    {"codigo_inventario": "EQ-003", "nombre": "Proyector", "fecha_compra": date(2023, 1, 15), "costo_compra": Decimal("800")},
+]
+
+def leer_stream(generador):
+    async def escenario():
+        return [bloque async for bloque in generador]
+    return asyncio.run(escenario())
+
+def test_stream_csv_recorre_un_cursor_dentro_de_una_transaccion(reportes, monkeypatch):
+    conn = usar_conexion(monkeypatch, reportes, lambda metodo, sql, args: FILAS_STREAM)
+    
+    bloques = leer_stream(reportes.stream_registros("SELECT * FROM equipos", "csv"))
+    
+    filas = list(csv.reader(io.StringIO(b"".join(bloques).decode())))
+    assert filas == [
+        ["codigo_inventario", "nombre", "fecha_compra", "costo_compra"],
+        ["EQ-001", 'Laptop, 14"', "2024-03-01", "1200.50"],
+        ["EQ-002", "Monitor", "", ""],
+        ["EQ-003", "Proyector", "2023-01-15", "800"],
+    ]
+    # Con el tamaño de bloque por defecto todo cabe en un único bloque
+    assert len(bloques) == 1
+    assert conn.transacciones == 1
+    assert conn.sqls() == ["SELECT * FROM equipos"]
+    sentencia, = conn.sentencias
+    assert sentencia.prefetch == reportes.STREAM_PREFETCH
+
+def test_stream_ndjson_serializa_decimales_y_fechas(reportes, monkeypatch):
+    usar_conexion(monkeypatch, reportes, lambda metodo, sql, args: FILAS_STREAM)
+    
+    bloques = leer_stream(reportes.stream_registros("SELECT * FROM equipos", "ndjson"))
+    
+    lineas = b"".join(bloques).decode().splitlines()
+    assert [json.loads(linea) for linea in lineas] == [
+        {"codigo_inventario": "EQ-001", "nombre": 'Laptop, 14"', "fecha_compra": "2024-03-01", "costo_compra": 1200.5},
+        {"codigo_inventario": "EQ-002", "nombre": "Monitor", "fecha_compra": None, "costo_compra": None},
+        {"codigo_inventario": "EQ-003", "nombre": "Proyector", "fecha_compra": "2023-01-15", "costo_compra": 800.0},
+    ]
+
+def test_stream_entrega_cada_bloque_antes_de_leer_el_resto(reportes, monkeypatch):
+    conn = usar_conexion(monkeypatch, reportes, lambda metodo, sql, args: FILAS_STREAM)
+    monkeypatch.setattr(reportes, "STREAM_CHUNK_BYTES", 1)
+    
+    async def escenario():
+        generador = reportes.stream_registros("SELECT * FROM equipos", "ndjson")
+        leidas = []
+        async for bloque in generador:
+            leidas.append((conn.sentencias[0].leidas, bloque))
+        return leidas
+    
+    leidas = asyncio.run(escenario())
+    
+    # Un bloque por fila, cada uno emitido en cuanto se lee su fila
+    assert [n for n, _ in leidas] == [1, 2, 3]
+    assert [json.loads(bloque)["codigo_inventario"] for _, bloque in leidas] == ["EQ-001", "EQ-002", "EQ-003"]
+
+def test_stream_sin_filas_no_emite_bloques(reportes, monkeypatch):
+    usar_conexion(monkeypatch, reportes, lambda metodo, sql, args: [])
+    assert leer_stream(reportes.stream_registros("SELECT * FROM equipos", "ndjson")) == []
+
+@pytest.mark.parametrize("tipo, formato", [("proveedores", "csv"), ("equipos", "xml")])
+def test_export_stream_rechaza_tipo_o_formato_no_validos(reportes, tipo, formato):
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(reportes.export_stream(tipo, formato))
+    assert error.value.status_code == 400
+
+def test_export_stream_responde_en_streaming(reportes, monkeypatch):
+    conn = usar_conexion(monkeypatch, reportes, lambda metodo, sql, args: FILAS_STREAM)
+    
+    async def escenario():
+        response = await reportes.export_stream("mantenimientos", "ndjson")
+        return response, [bloque async for bloque in response.body_iterator]
+    
+    response, bloques = asyncio.run(escenario())
+    
+    assert response.media_type == "application/x-ndjson"
+    disposicion = response.headers["content-disposition"]
+    assert disposicion.startswith("attachment; filename=mantenimientos_") and disposicion.endswith(".ndjson")
+    assert len(b"".join(bloques).splitlines()) == len(FILAS_STREAM)
+    assert conn.sqls() == [" ".join(reportes.consulta_excel("mantenimientos").split())]
+
+# ---------- Renderizado en procesos ----------
+
+def escribir_cgroup(tmp_path, archivos: dict):
+    for ruta, contenido in archivos.items():
+        destino = tmp_path / ruta
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        destino.write_text(contenido)
+    return str(tmp_path)
+
+def test_cpus_aplica_cuota_cgroup_v2(reportes, tmp_path, monkeypatch):
+    monkeypatch.setattr(reportes.os, "sched_getaffinity", lambda pid: set(range(64)))
+    assert reportes.cpus_disponibles(escribir_cgroup(tmp_path, {"cpu.max": "200000 100000\n"})) == 2
+
+def test_cpus_aplica_cuota_cgroup_v1(reportes, tmp_path, monkeypatch):
+    monkeypatch.setattr(reportes.os, "sched_getaffinity", lambda pid: set(range(64)))
+    raiz = escribir_cgroup(tmp_path, {"cpu/cpu.cfs_quota_us": "50000\n", "cpu/cpu.cfs_period_us": "100000\n"})
+    assert reportes.cpus_disponibles(raiz) == 1
+
+def test_cpus_sin_cuota_usa_la_afinidad(reportes, tmp_path, monkeypatch):
+    monkeypatch.setattr(reportes.os, "sched_getaffinity", lambda pid: {0, 1, 2})
+    assert reportes.cpus_disponibles(escribir_cgroup(tmp_path, {"cpu.max": "max 100000\n"})) == 3
+    assert reportes.cpus_disponibles(str(tmp_path / "no-existe")) == 3
+
+def test_profundidad_de_cola_de_renderizado_en_metrics(reportes, monkeypatch):
+    async def escenario():
+        monkeypatch.setattr(reportes, "_render_semaforo", asyncio.Semaphore(0))
+        tarea = asyncio.create_task(reportes.renderizar(len, b""))
+        await asyncio.sleep(0)
+        en_cola = reportes.RENDER_QUEUE_DEPTH._value.get()
+        tarea.cancel()
+        await asyncio.gather(tarea, return_exceptions=True)
+        return en_cola
+    
+    assert asyncio.run(escenario()) == 1
+    assert reportes.RENDER_QUEUE_DEPTH._value.get() == 0
+    cuerpo = asyncio.run(reportes.metrics()).body.decode()
+    assert "render_queue_depth 0.0" in cuerpo
+    assert "export_jobs_queued" in cuerpo
+
+# ---------- Trabajos de exportación compartidos entre réplicas ----------
+
+def fila_job(**campos):
+    job = {
+        "job_id": "a" * 32, "tipo": "equipos", "formato": "excel", "estado": "pendiente",
+        "progreso": 0, "replica": None, "archivo": None, "tamano_bytes": None, "error": None,
+    }
+    job.update(campos)
+    return job
+
+def test_trabajo_identico_activo_se_reutiliza(reportes, monkeypatch):
+    existente = fila_job(estado="en_proceso", replica="otra-replica", archivo="/x")
+    
+    def handler(metodo, sql, args):
+        if sql.lstrip().startswith("INSERT"):
+            return None
+        return existente
+    conn = usar_conexion(monkeypatch, reportes, handler)
+    
+    job = asyncio.run(reportes.create_export_job({"type": "equipos", "format": "excel"}))
+    
+    assert job["job_id"] == existente["job_id"]
+    assert "archivo" not in job and "replica" not in job
+    assert "ON CONFLICT (formato, tipo) WHERE estado IN ('pendiente', 'en_proceso')" in conn.sqls("fetchrow")[0]
+
+def test_procesar_job_guarda_archivo_y_resultado(reportes, monkeypatch, tmp_path):
+    conn = usar_conexion(monkeypatch, reportes)
+    monkeypatch.setattr(reportes, "REPORTS_PATH", str(tmp_path))
+    
+    async def generar(tipo, job_id):
+        return b"contenido"
+    monkeypatch.setitem(reportes.EXPORT_FORMATOS, "excel", (generar, "xlsx", reportes.EXCEL_MEDIA_TYPE))
+    
+    asyncio.run(reportes.procesar_job(fila_job(estado="en_proceso")))
+    
+    ruta = tmp_path / f"{'a' * 32}.xlsx"
+    assert ruta.read_bytes() == b"contenido"
+    (sql,) = conn.sqls("execute")
+    args = conn.consultas[-1][2]
+    assert "estado = 'completado'" in sql and "replica = $2" in sql
+    assert args[:4] == ("a" * 32, reportes.REPLICA_ID, str(ruta), len(b"contenido"))
+
+def test_procesar_job_registra_error(reportes, monkeypatch, tmp_path):
+    conn = usar_conexion(monkeypatch, reportes)
+    monkeypatch.setattr(reportes, "REPORTS_PATH", str(tmp_path))
+    
+    async def generar(tipo, job_id):
+        raise ValueError("sin datos")
+    monkeypatch.setitem(reportes.EXPORT_FORMATOS, "excel", (generar, "xlsx", reportes.EXCEL_MEDIA_TYPE))
+    
+    asyncio.run(reportes.procesar_job(fila_job(estado="en_proceso")))
+    
+    assert "estado = 'error'" in conn.sqls("execute")[0]
+    assert conn.consultas[-1][2][2] == "sin datos"
+    assert list(tmp_path.iterdir()) == []
+
+def test_limpieza_borra_expirados_y_huerfanos(reportes, monkeypatch, tmp_path):
+    expirado = tmp_path / f"{'1' * 32}.pdf"
+    huerfano = tmp_path / f"{'2' * 32}.xlsx"
+    vigente = tmp_path / f"{'3' * 32}.xlsx"
+    ajeno = tmp_path / "notas.txt"
+    for archivo in (expirado, huerfano, vigente, ajeno):
+        archivo.write_bytes(b"x")
+    
+    def handler(metodo, sql, args):
+        if sql.lstrip().startswith("DELETE"):
+            return [{"archivo": str(expirado)}, {"archivo": None}]
+        if "ANY" in sql:
+            return [{"job_id": "3" * 32}]
+    conn = usar_conexion(monkeypatch, reportes, handler)
+    monkeypatch.setattr(reportes, "REPORTS_PATH", str(tmp_path))
+    
+    asyncio.run(reportes.limpiar_exportaciones())
+    
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted([vigente.name, ajeno.name])
+    # Los trabajos abandonados por una réplica caída vuelven a la cola
+    assert any("SET estado = 'pendiente'" in sql for sql in conn.sqls("execute"))
+
+def test_descarga_sin_archivo_responde_410(reportes, monkeypatch, tmp_path):
+    job = fila_job(estado="completado", archivo=str(tmp_path / "no-existe.xlsx"))
+    usar_conexion(monkeypatch, reportes, lambda metodo, sql, args: job)
+    
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(reportes.download_export_job(job["job_id"]))
+    assert error.value.status_code == 410
+
+def test_export_jobs_existe_en_el_esquema():
+    columnas = columnas_por_tabla()["export_jobs"]
+    assert {"job_id", "estado", "replica", "archivo", "expira"} <= set(columnas)